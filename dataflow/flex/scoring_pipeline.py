@@ -1,13 +1,29 @@
 #!/usr/bin/env python3
 import argparse
 import hashlib
+import logging
 import os
-from typing import Dict, Iterable
+import sys
+import time
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Tuple
 
 import apache_beam as beam
 from apache_beam.options.pipeline_options import PipelineOptions, GoogleCloudOptions, SetupOptions, StandardOptions
+from apache_beam.io.filesystems import FileSystems
 from apache_beam.io.gcp.bigquery_tools import RetryStrategy
 
+# The phrase dictionary parser and matcher are shared with the analyzers under scripts/.
+# In the template image they sit next to this file and setup.py ships them to the workers;
+# in a checkout they are two directories up.
+for _root in (Path(__file__).resolve().parent, Path(__file__).resolve().parents[2]):
+    if (_root / 'scripts' / 'phrase_dictionary.py').exists():
+        sys.path.insert(0, str(_root))
+        break
+
+from scripts.lexicon_matcher import CompiledLexicon, LexiconEntry
+from scripts.phrase_dictionary import parse_dictionary_csv
+
 # Lightweight keyword rules
 RULES = [
     ("クレーム", 1.0), ("苦情", 1.0), ("不満", 1.0),
@@ -19,24 +35,69 @@ RULES = [
 ]
 
 
-def compute_score(text: str):
-    score = 0.0
-    hits = []
+DEFAULT_LEXICON = CompiledLexicon(LexiconEntry(phrase, '', weight, 'negative') for phrase, weight in RULES)
+
+# How often workers check the dictionary file for changes (seconds)
+DEFAULT_DICTIONARY_RELOAD_INTERVAL = 300
+DICTIONARY_LOCALE = 'ja'
+
+
+def compute_score(text: str, lexicon: Optional[CompiledLexicon] = None) -> Tuple[float, str]:
+    """Sum the weights of the matched phrases (each counted once) in a single pass over the text"""
     if not text:
         return 0.0, ""
-    for kw, w in RULES:
-        if kw in text:
-            score += w
-            hits.append(kw)
-    return score, ", ".join(hits)
+    lexicon = DEFAULT_LEXICON if lexicon is None else lexicon
+    matched = sorted({entry_id for entry_id, _ in lexicon.scan(text)})
+    entries = [lexicon.entries[entry_id] for entry_id in matched]
+    return sum(entry.weight for entry in entries), ", ".join(entry.phrase for entry in entries)
 
 
 class EnrichRecord(beam.DoFn):
+    """Score rows with RULES, or with a phrase dictionary CSV when dictionary_uri is set.
+
+    The dictionary is re-read every reload_interval seconds on each worker and the
+    rules are swapped only when the file content hash changes, so keyword updates
+    reach a running pipeline without a redeploy. A failed reload keeps the current rules.
+    """
+
+    def __init__(self, dictionary_uri: Optional[str] = None,
+                 reload_interval: float = DEFAULT_DICTIONARY_RELOAD_INTERVAL):
+        self.dictionary_uri = dictionary_uri
+        self.reload_interval = reload_interval
+        self.lexicon = None
+        self.dictionary_version = None
+        self._next_reload = 0.0
+
+    def setup(self):
+        if self.dictionary_uri:
+            self._reload_dictionary()
+
+    def _reload_dictionary(self):
+        self._next_reload = time.monotonic() + self.reload_interval
+        try:
+            with FileSystems.open(self.dictionary_uri) as f:
+                raw = f.read()
+            version = hashlib.sha256(raw).hexdigest()[:16]
+            if version == self.dictionary_version:
+                return
+            lexicon = CompiledLexicon(parse_dictionary_csv(raw.decode('utf-8-sig'), locale=DICTIONARY_LOCALE))
+        except Exception as e:
+            if self.lexicon is None:
+                raise
+            logging.warning('Dictionary reload failed, keeping version %s: %s', self.dictionary_version, e)
+            return
+        # Swap both together so a row never sees rules from one version and the tag of another
+        self.lexicon, self.dictionary_version = lexicon, version
+        logging.info('Loaded dictionary %s (version %s, %d rules)', self.dictionary_uri, version, len(lexicon.entries))
+
     def process(self, row: Dict) -> Iterable[Dict]:
+        if self.dictionary_uri and time.monotonic() >= self._next_reload:
+            self._reload_dictionary()
+
         subject = row.get('subject') or ''
         body_preview = row.get('body_preview') or ''
         text = f"{subject} {body_preview}"
-        score, keyword = compute_score(text)
+        score, keyword = compute_score(text, self.lexicon)
         level = 'high' if score >= 2.5 else ('medium' if score >= 1.0 else 'low')
         message_id = (row.get('message_id') or '')
         if message_id:
@@ -76,6 +137,9 @@ def run():
     parser.add_argument('--source_table', required=False, default='viewpers:salesguard_alerts.email_messages_threaded_v1')
     parser.add_argument('--dest_dataset', required=True)
     parser.add_argument('--dest_table', required=True)
+    parser.add_argument('--dictionary_uri', required=False, default=None,
+                        help='Phrase dictionary CSV (local path or gs://); replaces the built-in RULES')
+    parser.add_argument('--dictionary_reload_interval', type=float, default=DEFAULT_DICTIONARY_RELOAD_INTERVAL)
     args, beam_args = parser.parse_known_args()
 
     opts = PipelineOptions(beam_args)
@@ -134,7 +198,7 @@ def run():
         (
             p
             | 'ReadBQQuery' >> beam.io.ReadFromBigQuery(query=query, use_standard_sql=True)
-            | 'Enrich' >> beam.ParDo(EnrichRecord())
+            | 'Enrich' >> beam.ParDo(EnrichRecord(args.dictionary_uri, args.dictionary_reload_interval))
             | 'WriteBQ' >> beam.io.WriteToBigQuery(
                 table=table_spec,
                 schema=schema,
@@ -0,0 +1,12 @@
+"""Ships the shared phrase dictionary modules (scripts/) to the Dataflow workers of the Flex template.
+
+The image copies only scripts/lexicon_matcher.py and scripts/phrase_dictionary.py and adds the
+scripts/__init__.py package marker next to this file (see the Dockerfile).
+"""
+import setuptools
+
+setuptools.setup(
+    name='salesguard-scoring-pipeline',
+    version='0.1.0',
+    packages=['scripts'],
+)
@@ -22,10 +22,20 @@ export interface BatchNLPResult {
   error_message?: string;
 }
 
+interface PendingRequest {
+  resolve: (result: NLPResult) => void;
+  reject: (error: Error) => void;
+  timeout: NodeJS.Timeout;
+}
+
 export class NLPProcessor {
   private pythonProcess: ChildProcess | null = null;
   private isInitialized: boolean = false;
   private scriptPath: string;
+  // ワーカーはマイクロバッチ単位で複数行をまとめて返すため、応答は id で対応づける
+  private pendingRequests: Map<number, PendingRequest> = new Map();
+  private nextRequestId: number = 0;
+  private stdoutBuffer: string = '';
 
   constructor() {
     this.scriptPath = path.join(process.cwd(), 'scripts', 'nlp_analyzer.py');
@@ -57,9 +67,15 @@ export class NLPProcessor {
         throw error;
       });
 
+      // 標準出力は行単位（NDJSON）に分割して処理
+      this.pythonProcess.stdout?.on('data', (data) => {
+        this.handleStdout(data.toString());
+      });
+
       this.pythonProcess.on('exit', (code) => {
         console.log(`Pythonプロセス終了: ${code}`);
         this.isInitialized = false;
+        this.rejectPending(new Error(`Pythonプロセスが終了しました: ${code}`));
       });
 
       // 初期化完了を待つ
@@ -106,6 +122,51 @@ export class NLPProcessor {
     });
   }
 
+  /**
+   * 標準出力の断片をバッファし、完結した行ごとに対応するリクエストへ結果を渡す
+   */
+  private handleStdout(chunk: string): void {
+    this.stdoutBuffer += chunk;
+    const lines = this.stdoutBuffer.split('\n');
+    this.stdoutBuffer = lines.pop() ?? '';
+
+    for (const line of lines) {
+      if (!line.trim()) {
+        continue;
+      }
+
+      let message: NLPResult & { id?: number };
+      try {
+        message = JSON.parse(line);
+      } catch (error) {
+        console.error(`❌ 結果の解析に失敗: ${error}`);
+        continue;
+      }
+
+      const { id, ...result } = message;
+      const pending = id === undefined ? undefined : this.pendingRequests.get(id);
+      if (!pending) {
+        // タイムアウト済みのリクエストへの遅れた応答は捨てる
+        continue;
+      }
+      this.pendingRequests.delete(id!);
+      clearTimeout(pending.timeout);
+      pending.resolve(result as NLPResult);
+    }
+  }
+
+  /**
+   * 応答待ちのリクエストをすべて失敗させる
+   */
+  private rejectPending(error: Error): void {
+    for (const pending of this.pendingRequests.values()) {
+      clearTimeout(pending.timeout);
+      pending.reject(error);
+    }
+    this.pendingRequests.clear();
+    this.stdoutBuffer = '';
+  }
+
   /**
    * 単一テキストの感情分析を実行
    */
@@ -119,23 +180,17 @@ export class NLPProcessor {
     }
 
     return new Promise((resolve, reject) => {
+      const id = this.nextRequestId++;
       const timeout = setTimeout(() => {
+        this.pendingRequests.delete(id);
         reject(new Error('感情分析タイムアウト'));
       }, 10000); // 10秒タイムアウト
 
-      // 結果を受け取る
-      this.pythonProcess!.stdout!.once('data', (data) => {
-        clearTimeout(timeout);
-        try {
-          const result = JSON.parse(data.toString()) as NLPResult;
-          resolve(result);
-        } catch (error) {
-          reject(new Error(`結果の解析に失敗: ${error}`));
-        }
-      });
+      // 結果は handleStdout が id で対応づけて返す
+      this.pendingRequests.set(id, { resolve, reject, timeout });
 
       // テキストを送信
-      const input = JSON.stringify({ text });
+      const input = JSON.stringify({ id, text });
       this.pythonProcess!.stdin!.write(input + '\n');
     });
   }
@@ -144,46 +199,48 @@ export class NLPProcessor {
    * 複数テキストの一括感情分析を実行
    */
   async processBatch(texts: { id: string; text: string }[]): Promise<BatchNLPResult[]> {
-    const results: BatchNLPResult[] = [];
-    
     console.log(`📝 ${texts.length}件のテキストを一括処理中...`);
     
-    for (const { id, text } of texts) {
-      try {
-        const nlpResult = await this.processText(text);
-        
-        results.push({
+    // 並行する processText がそれぞれ Python プロセスを起動しないよう、先に初期化しておく
+    if (!this.isInitialized) {
+      await this.initialize();
+    }
+    
+    // 全件を一度に送り、ワーカー側のマイクロバッチでまとめて推論させる（結果は id で対応づく）
+    const settled = await Promise.allSettled(texts.map(({ text }) => this.processText(text)));
+    
+    return settled.map((outcome, index): BatchNLPResult => {
+      const { id, text } = texts[index];
+      
+      if (outcome.status === 'fulfilled') {
+        console.log(`✅ ${id}: 処理完了 (${outcome.value.processing_time_ms}ms)`);
+        return {
           alert_id: id,
-          nlp_result: nlpResult,
+          nlp_result: outcome.value,
           success: true
-        });
-        
-        console.log(`✅ ${id}: 処理完了 (${nlpResult.processing_time_ms}ms)`);
-        
-      } catch (error) {
-        console.error(`❌ ${id}: 処理失敗 - ${error}`);
-        
-        results.push({
-          alert_id: id,
-          nlp_result: {
-            sentiment: 'unknown',
-            sentiment_confidence: 0,
-            emotion: 'unknown',
-            emotion_confidence: 0,
-            text_length: text.length,
-            processed_text_length: 0,
-            processing_time_ms: 0,
-            processed: false,
-            model_version: 'unknown',
-            timestamp: Date.now()
-          },
-          success: false,
-          error_message: error instanceof Error ? error.message : String(error)
-        });
+        };
       }
-    }
-    
-    return results;
+      
+      const error = outcome.reason;
+      console.error(`❌ ${id}: 処理失敗 - ${error}`);
+      return {
+        alert_id: id,
+        nlp_result: {
+          sentiment: 'unknown',
+          sentiment_confidence: 0,
+          emotion: 'unknown',
+          emotion_confidence: 0,
+          text_length: text.length,
+          processed_text_length: 0,
+          processing_time_ms: 0,
+          processed: false,
+          model_version: 'unknown',
+          timestamp: Date.now()
+        },
+        success: false,
+        error_message: error instanceof Error ? error.message : String(error)
+      };
+    });
   }
 
   /**
@@ -252,6 +309,7 @@ export class NLPProcessor {
       this.pythonProcess.kill();
       this.pythonProcess = null;
       this.isInitialized = false;
+      this.rejectPending(new Error('NLP処理エンジンが終了しました'));
       console.log('✅ NLP処理エンジンの終了完了');
     }
   }
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+分析結果のコンテンツハッシュキャッシュ
+
+転送・引用返信・テンプレートで同じ本文が繰り返し現れるため、正規化した
+テキストとモデルバージョンのハッシュをキーに分析結果を再利用する。
+
+- メモリ上の LRU（件数上限付き）
+- 任意の SQLite ディスク層（件数上限付き、最終アクセスが古いものから削除）
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Optional
+
+_WHITESPACE = re.compile(r'\s+')
+
+DEFAULT_MEMORY_ENTRIES = 10000
+DEFAULT_DISK_ENTRIES = 1000000
+
+# ディスク層の件数チェック間隔（COUNT(*) を毎回走らせないため）
+_DISK_EVICT_INTERVAL = 256
+
+
+def normalize_text(text: str) -> str:
+    """キャッシュキー用の正規化（連続する空白を1つにまとめて前後を除去）
+
+    空白の畳み込みはキーワード一致やトークン化の結果を変えないため、
+    同じ本文の改行・インデント違いを同一視できる。
+    """
+    return _WHITESPACE.sub(' ', text).strip()
+
+
+class AnalysisCache:
+    """メモリ LRU + 任意の SQLite 層からなる分析結果キャッシュ
+
+    値は JSON にシリアライズ可能なオブジェクトであること。
+    """
+
+    def __init__(
+        self,
+        model_version: str,
+        max_entries: int = DEFAULT_MEMORY_ENTRIES,
+        disk_path: Optional[str] = None,
+        disk_max_entries: int = DEFAULT_DISK_ENTRIES,
+    ) -> None:
+        self.model_version = model_version
+        self.max_entries = max(0, int(max_entries))
+        self.disk_max_entries = max(1, int(disk_max_entries))
+        self._memory: OrderedDict[str, Any] = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_evictions = 0
+        self._disk_puts = 0
+
+        self._db = None
+        if disk_path:
+            self._db = sqlite3.connect(disk_path, timeout=30, check_same_thread=False)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS analysis_cache ('
+                'key TEXT PRIMARY KEY, value TEXT NOT NULL, accessed_at REAL NOT NULL)'
+            )
+            self._db.execute(
+                'CREATE INDEX IF NOT EXISTS analysis_cache_accessed_at ON analysis_cache (accessed_at)'
+            )
+            self._db.commit()
+
+    def key(self, text: str, namespace: str = '') -> str:
+        """正規化済みテキストとモデルバージョンからキーを作る
+
+        namespace には辞書のバージョンなど、実行中に変わりうる結果の依存先を渡す。
+        """
+        digest = hashlib.sha256()
+        digest.update(self.model_version.encode('utf-8'))
+        digest.update(b'\0')
+        if namespace:
+            digest.update(namespace.encode('utf-8'))
+            digest.update(b'\0')
+        digest.update(normalize_text(text).encode('utf-8', errors='ignore'))
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Any:
+        """キャッシュから値を取得する（無ければ None）"""
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return self._memory[key]
+
+            if self._db is not None:
+                row = self._db.execute('SELECT value FROM analysis_cache WHERE key = ?', (key,)).fetchone()
+                if row is not None:
+                    self._db.execute(
+                        'UPDATE analysis_cache SET accessed_at = ? WHERE key = ?', (time.time(), key)
+                    )
+                    self._db.commit()
+                    value = json.loads(row[0])
+                    self._remember(key, value)
+                    self.disk_hits += 1
+                    return value
+
+            self.misses += 1
+            return None
+
+    def put(self, key: str, value: Any) -> None:
+        """値をメモリ層とディスク層に保存する"""
+        with self._lock:
+            self._remember(key, value)
+
+            if self._db is not None:
+                self._db.execute(
+                    'INSERT OR REPLACE INTO analysis_cache (key, value, accessed_at) VALUES (?, ?, ?)',
+                    (key, json.dumps(value, ensure_ascii=False), time.time()),
+                )
+                self._disk_puts += 1
+                if self._disk_puts % _DISK_EVICT_INTERVAL == 0:
+                    self._evict_disk()
+                self._db.commit()
+
+    def get_or_compute(self, text: str, compute: Callable[[], Any], namespace: str = '') -> Any:
+        """キャッシュにあれば返し、無ければ compute() の結果を保存して返す"""
+        key = self.key(text, namespace)
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def _remember(self, key: str, value: Any) -> None:
+        if self.max_entries == 0:
+            return
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    def _evict_disk(self) -> None:
+        (count,) = self._db.execute('SELECT COUNT(*) FROM analysis_cache').fetchone()
+        overflow = count - self.disk_max_entries
+        if overflow > 0:
+            self._db.execute(
+                'DELETE FROM analysis_cache WHERE key IN ('
+                'SELECT key FROM analysis_cache ORDER BY accessed_at ASC LIMIT ?)',
+                (overflow,),
+            )
+            self.disk_evictions += overflow
+
+    def stats(self) -> dict:
+        """ヒット/ミス数とサイズ"""
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            lookups = hits + self.misses
+            stats = {
+                'hits': hits,
+                'misses': self.misses,
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'hit_ratio': round(hits / lookups, 4) if lookups else 0.0,
+                'memory_entries': len(self._memory),
+                'memory_evictions': self.evictions,
+            }
+            if self._db is not None:
+                (count,) = self._db.execute('SELECT COUNT(*) FROM analysis_cache').fetchone()
+                stats['disk_entries'] = count
+                stats['disk_evictions'] = self.disk_evictions
+            return stats
+
+    def close(self) -> None:
+        with self._lock:
+            if self._db is not None:
+                self._evict_disk()
+                self._db.commit()
+                self._db.close()
+                self._db = None
@@ -2,22 +2,141 @@
 # -*- coding: utf-8 -*-
 
 import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+# 起動時間の計測（重い import より前に開始する）
+from scripts.startup_timer import StartupTimer
+
+_startup_timer = StartupTimer()
+
+import argparse
 import json
+import multiprocessing
+import os
+import random
 import re
 import time
-from transformers import pipeline
-import torch
+from collections import deque
+
+from scripts.analysis_cache import DEFAULT_MEMORY_ENTRIES, AnalysisCache
+from scripts.inference_backend import DEFAULT_BACKEND, load_classifier
+from scripts.token_windows import DEFAULT_STRIDE, POOLING_METHODS, WindowedClassifier
+
+_startup_timer.imports_done()
+
+# 文脈フラグ別の検出パターン（キーの順序がフラグ出力の順序になる）
+CONTEXT_FLAG_PATTERNS = {
+    # 否定文
+    'has_negation': [
+        '問題ありません', '悪くありません', '困りません', '不満ありません',
+        '文句ありません', '特に問題ありません', '全く問題ありません', '何も問題ありません'
+    ],
+    # 条件文
+    'has_conditional': [
+        'もし', '場合', '仮に', '条件', '〜であれば', '〜の場合'
+    ],
+    # 比較文
+    'has_comparison': [
+        'より', '比較的', '相対的に', '〜よりも', '〜と比べて'
+    ],
+    # ビジネス文脈
+    'has_business_context': [
+        '見積', '契約', '商談', '営業', '提案', '打ち合わせ',
+        '会議', 'プロジェクト', '納期', '品質', 'サービス', 'サポート'
+    ],
+    # 緊急性
+    'has_urgency': [
+        '緊急', '至急', '急ぎ', '早急', 'すぐ', '今すぐ',
+        '期限', '締切', '納期', '間に合わない', '遅れる'
+    ],
+    # ポジティブ文脈
+    'has_positive_context': [
+        '良い', '優秀', '満足', '喜び', '嬉しい', '楽しい', '期待', '希望',
+        '成功', '達成', '完了', '承知', '了解', '承諾', '承認'
+    ]
+}
+
+
+def compile_context_flag_matcher(flag_patterns):
+    """全フラグのパターンを単一の正規表現に結合する
+
+    先読みで各位置の最長一致を拾うため、同じ位置から始まる短いパターン
+    （接頭辞）のフラグも一致文字列ごとにまとめて引けるようにしておく。
+    """
+    literal_flags = {}
+    for flag, patterns in flag_patterns.items():
+        for pattern in patterns:
+            literal_flags.setdefault(pattern, set()).add(flag)
+    
+    lookup = {}
+    for literal in literal_flags:
+        flags = set()
+        for other, other_flags in literal_flags.items():
+            if literal.startswith(other):
+                flags |= other_flags
+        lookup[literal] = tuple(flag for flag in flag_patterns if flag in flags)
+    
+    alternation = '|'.join(re.escape(literal) for literal in sorted(lookup, key=len, reverse=True))
+    return re.compile(f'(?=({alternation}))'), lookup
+
+
+_CONTEXT_FLAG_REGEX, _CONTEXT_FLAG_LOOKUP = compile_context_flag_matcher(CONTEXT_FLAG_PATTERNS)
+
+# 一括分析のデフォルトのマイクロバッチサイズ
+DEFAULT_BATCH_SIZE = 16
+
+MODEL_VERSION = 'cl-tohoku/bert-base-japanese-v3-context-aware'
+
+# モデルが返しうるラベル（LABEL_0: negative, LABEL_1: positive）
+MODEL_LABELS = ('LABEL_0', 'LABEL_1')
+
+# カスケード（ルール段）の信頼度と既定のしきい値
+RULE_CONFIDENCE_DECISIVE = 1.0   # モデルのラベルによらず最終セグメントが同じ
+RULE_CONFIDENCE_LEXICON = 0.7    # 緊急性/ポジティブ語のどちらか一方だけが出現
+RULE_CONFIDENCE_WEAK = 0.5
+DEFAULT_CASCADE_THRESHOLD = 0.9
 
 class ContextAwareAnalyzer:
-    def __init__(self):
-        """文脈理解 + ビジネスロジック分析器"""
+    def __init__(self, batch_size=DEFAULT_BATCH_SIZE, cache=None, pooling=None, window_stride=DEFAULT_STRIDE,
+                 cascade_threshold=None, cascade_audit_rate=0.0, num_threads=None):
+        """文脈理解 + ビジネスロジック分析器
+
+        pooling を指定すると文字数での切り詰めの代わりにトークン単位の
+        スライディングウィンドウで全文を評価し、ウィンドウのスコアを
+        pooling（'max-negative' / 'mean'）で統合する。
+
+        cascade_threshold を指定するとルール段の信頼度がしきい値以上の
+        テキストはBERTを呼ばずに判定する。cascade_audit_rate の割合で
+        そのようなテキストもモデルに回し、ルール判定との一致率を測る。
+
+        num_threads は ONNX バックエンドのセッションの演算スレッド数
+        （PyTorch はプロセス全体の torch.set_num_threads() に従う）。
+        """
         print("🤖 文脈理解エンジンを初期化中...", file=sys.stderr)
         
-        # 純粋NLPモデル（文脈理解）
-        self.nlp_analyzer = pipeline(
-            'sentiment-analysis', 
-            model='cl-tohoku/bert-base-japanese-v3'
-        )
+        # ルール優先カスケード（Noneなら常にモデルを使う）
+        self.cascade_threshold = cascade_threshold
+        self.cascade_audit_rate = cascade_audit_rate
+        self._audit_rng = random.Random()
+        self._rule_memo = {}
+        
+        # NLP結果のキャッシュ（AnalysisCache、Noneなら無効）
+        self.cache = cache
+        
+        # 一括分析時のマイクロバッチサイズ
+        self.batch_size = max(1, int(batch_size))
+        
+        # 純粋NLPモデル（文脈理解）は初回の推論時に読み込む。
+        # カスケードでルール段だけで判定できた場合は torch を読み込まずに済む
+        self._nlp_analyzer = None
+        self.num_threads = num_threads
+        
+        # トークン単位のウィンドウ分類（Noneなら従来の512文字切り詰め）
+        self.pooling = pooling
+        self.window_stride = window_stride
+        self._windowed = None
         
         # 既存セグメント定義
         self.business_segments = {
@@ -32,125 +151,17 @@ class ContextAwareAnalyzer:
         print("✅ 文脈理解エンジンの初期化完了！", file=sys.stderr)
     
     def detect_context_flags(self, text):
-        """文脈フラグの検出"""
-        context_flags = {
-            'has_negation': False,
-            'has_conditional': False,
-            'has_comparison': False,
-            'has_business_context': False,
-            'has_urgency': False,
-            'has_positive_context': False
-        }
-        
-        # 否定文の検出
-        negation_patterns = [
-            r'問題ありません',
-            r'悪くありません',
-            r'困りません',
-            r'不満ありません',
-            r'文句ありません',
-            r'特に問題ありません',
-            r'全く問題ありません',
-            r'何も問題ありません'
-        ]
-        
-        for pattern in negation_patterns:
-            if re.search(pattern, text):
-                context_flags['has_negation'] = True
-                break
-        
-        # 条件文の検出
-        conditional_patterns = [
-            r'もし',
-            r'場合',
-            r'仮に',
-            r'条件',
-            r'〜であれば',
-            r'〜の場合'
-        ]
-        
-        for pattern in conditional_patterns:
-            if re.search(pattern, text):
-                context_flags['has_conditional'] = True
-                break
-        
-        # 比較文の検出
-        comparison_patterns = [
-            r'より',
-            r'比較的',
-            r'相対的に',
-            r'〜よりも',
-            r'〜と比べて'
-        ]
-        
-        for pattern in comparison_patterns:
-            if re.search(pattern, text):
-                context_flags['has_comparison'] = True
-                break
-        
-        # 緊急性の検出
-        urgency_patterns = [
-            r'緊急',
-            r'至急',
-            r'急ぎ',
-            r'早急',
-            r'すぐ',
-            r'今すぐ',
-            r'期限',
-            r'締切',
-            r'納期',
-            r'間に合わない',
-            r'遅れる'
-        ]
-        
-        for pattern in urgency_patterns:
-            if re.search(pattern, text):
-                context_flags['has_urgency'] = True
-                break
-        
-        # ポジティブ文脈の検出
-        positive_patterns = [
-            r'良い',
-            r'優秀',
-            r'満足',
-            r'喜び',
-            r'嬉しい',
-            r'楽しい',
-            r'期待',
-            r'希望',
-            r'成功',
-            r'達成',
-            r'完了',
-            r'承知',
-            r'了解',
-            r'承諾',
-            r'承認'
-        ]
-        
-        for pattern in positive_patterns:
-            if re.search(pattern, text):
-                context_flags['has_positive_context'] = True
-                break
-        
-        # ビジネス文脈の検出
-        business_patterns = [
-            r'見積',
-            r'契約',
-            r'商談',
-            r'営業',
-            r'提案',
-            r'打ち合わせ',
-            r'会議',
-            r'プロジェクト',
-            r'納期',
-            r'品質',
-            r'サービス',
-            r'サポート'
-        ]
-        
-        for pattern in business_patterns:
-            if re.search(pattern, text):
-                context_flags['has_business_context'] = True
+        """文脈フラグの検出（全パターンを1回の走査で判定）"""
+        context_flags = dict.fromkeys(CONTEXT_FLAG_PATTERNS, False)
+        remaining = len(context_flags)
+        
+        for match in _CONTEXT_FLAG_REGEX.finditer(text):
+            for flag in _CONTEXT_FLAG_LOOKUP[match.group(1)]:
+                if not context_flags[flag]:
+                    context_flags[flag] = True
+                    remaining -= 1
+            # 全フラグが確定したら走査を打ち切る
+            if remaining == 0:
                 break
         
         return context_flags
@@ -278,45 +289,172 @@ class ContextAwareAnalyzer:
             'business_logic': True
         }
     
+    def rule_stage(self, context_flags):
+        """ルール/辞書による安価な一次判定
+
+        モデルの各ラベルについて最終セグメントを求め、どのラベルでも同じ
+        セグメントになる場合はモデルの出力に関わらず確定できる。そうでない
+        場合は緊急性/ポジティブ語の有無からラベルを推定する。
+        フラグの組み合わせは高々64通りなので結果をメモ化する。
+        """
+        memo_key = tuple(context_flags.values())
+        rule = self._rule_memo.get(memo_key)
+        if rule is not None:
+            return rule
+        
+        segments = {}
+        for label in MODEL_LABELS:
+            adjusted = self.adjust_sentiment_by_context([{'label': label, 'score': 0.5}], context_flags)
+            segments[label] = self.map_to_business_segments(adjusted)['segment_id']
+        
+        if context_flags['has_urgency'] and not context_flags['has_positive_context']:
+            label, confidence = 'LABEL_0', RULE_CONFIDENCE_LEXICON
+        elif context_flags['has_positive_context'] and not context_flags['has_urgency']:
+            label, confidence = 'LABEL_1', RULE_CONFIDENCE_LEXICON
+        else:
+            label, confidence = 'LABEL_0', RULE_CONFIDENCE_WEAK
+        
+        if len(set(segments.values())) == 1:
+            confidence = RULE_CONFIDENCE_DECISIVE
+        
+        rule = {'label': label, 'confidence': confidence, 'segment_id': segments[label]}
+        self._rule_memo[memo_key] = rule
+        return rule
+    
+    def route_by_rules(self, processed_text):
+        """カスケード時にルール段だけで判定できるかを調べる
+
+        戻り値は (context_flags, rule, skip_model, audited)。
+        """
+        context_flags = self.detect_context_flags(processed_text)
+        rule = self.rule_stage(context_flags)
+        decisive = rule['confidence'] >= self.cascade_threshold
+        audited = decisive and self._audit_rng.random() < self.cascade_audit_rate
+        return context_flags, rule, decisive and not audited, audited
+    
+    def build_rule_result(self, text, processed_text, context_flags, rule, processing_time):
+        """ルール段の判定からモデルを呼ばずに結果を組み立てる"""
+        nlp_result = [{'label': rule['label'], 'score': rule['confidence'], 'source': 'rules'}]
+        result = self.build_result(text, processed_text, nlp_result, processing_time, context_flags)
+        result['cascade'] = self.cascade_info(rule, 'rules')
+        return result
+    
+    def cascade_info(self, rule, stage, audited=False):
+        return {
+            'stage': stage,
+            'rule_label': rule['label'],
+            'rule_confidence': rule['confidence'],
+            'rule_segment_id': rule['segment_id'],
+            'audited': audited
+        }
+    
+    @property
+    def nlp_analyzer(self):
+        """純粋NLPモデル（初回アクセス時に読み込む）"""
+        if self._nlp_analyzer is None:
+            print("🤖 文脈理解モデルを読み込み中...", file=sys.stderr)
+            self._nlp_analyzer = load_classifier('cl-tohoku/bert-base-japanese-v3', num_threads=self.num_threads)
+        return self._nlp_analyzer
+    
+    @property
+    def windowed(self):
+        """ウィンドウ分類器（pooling未指定ならNone）"""
+        if self.pooling and self._windowed is None:
+            self._windowed = WindowedClassifier(
+                self.nlp_analyzer,
+                stride=self.window_stride,
+                pooling=self.pooling,
+                batch_size=self.batch_size
+            )
+        return self._windowed
+    
+    def preprocess(self, text):
+        """テキストの前処理（長さ制限。ウィンドウ分類時は全文を使う）"""
+        if self.pooling:
+            return text
+        return text[:512] if len(text) > 512 else text
+    
+    def infer(self, processed_texts):
+        """複数テキストを推論し、テキストごとの [ {label, score} ] を返す"""
+        if self.windowed is not None:
+            return self.windowed(processed_texts)
+        
+        nlp_results = self.nlp_analyzer(
+            list(processed_texts),
+            batch_size=len(processed_texts),
+            truncation=True
+        )
+        # 単一テキスト時と同じく [ {label, score} ] の形に揃える
+        return [[nlp_result] for nlp_result in nlp_results]
+    
+    def infer_one(self, processed_text):
+        """1件のテキストを推論する"""
+        if self.windowed is not None:
+            return self.windowed([processed_text])[0]
+        return self.nlp_analyzer(processed_text)
+    
+    def build_result(self, text, processed_text, nlp_result, processing_time, context_flags=None):
+        """NLP結果に文脈フラグ・感情調整・セグメントを適用して結果を組み立てる"""
+        # 2. 文脈フラグの検出
+        if context_flags is None:
+            context_flags = self.detect_context_flags(processed_text)
+        
+        # 3. 文脈に基づく感情調整
+        adjusted_result = self.adjust_sentiment_by_context(nlp_result, context_flags)
+        
+        # 4. ビジネスセグメントへのマッピング
+        segment_mapping = self.map_to_business_segments(adjusted_result)
+        
+        # 5. 結果統合
+        return {
+            'text': text[:100] + '...' if len(text) > 100 else text,
+            'original_nlp_result': nlp_result,
+            'context_flags': context_flags,
+            'sentiment_analysis': adjusted_result,
+            'business_segment': segment_mapping,
+            'text_length': len(text),
+            'processed_text_length': len(processed_text),
+            'processing_time_ms': int(processing_time),
+            'processed': True,
+            'model_version': MODEL_VERSION,
+            'timestamp': time.time(),
+            'analysis_method': 'context_aware_business_logic'
+        }
+    
     def analyze_with_context_and_business_logic(self, text):
         """文脈理解 + ビジネスロジックによる分析"""
         start_time = time.time()
         
         try:
             # テキストの前処理
-            processed_text = text[:512] if len(text) > 512 else text
+            processed_text = self.preprocess(text)
             
-            # 1. 純粋NLPで基本感情判定
-            nlp_result = self.nlp_analyzer(processed_text)
+            # 0. カスケード時はルール段で確定できればモデルを呼ばない
+            context_flags = rule = None
+            audited = False
+            if self.cascade_threshold is not None:
+                context_flags, rule, skip_model, audited = self.route_by_rules(processed_text)
+                if skip_model:
+                    processing_time = (time.time() - start_time) * 1000
+                    return self.build_rule_result(text, processed_text, context_flags, rule, processing_time)
             
-            # 2. 文脈フラグの検出
-            context_flags = self.detect_context_flags(processed_text)
-            
-            # 3. 文脈に基づく感情調整
-            adjusted_result = self.adjust_sentiment_by_context(nlp_result, context_flags)
-            
-            # 4. ビジネスセグメントへのマッピング
-            segment_mapping = self.map_to_business_segments(adjusted_result)
+            # 1. 純粋NLPで基本感情判定（同一本文はキャッシュから再利用）
+            stage = 'model'
+            if self.cache is not None:
+                key = self.cache.key(processed_text)
+                nlp_result = self.cache.get(key)
+                if nlp_result is None:
+                    nlp_result = self.infer_one(processed_text)
+                    self.cache.put(key, nlp_result)
+                else:
+                    stage = 'cache'
+            else:
+                nlp_result = self.infer_one(processed_text)
             
-            # 5. 処理時間計算
             processing_time = (time.time() - start_time) * 1000
-            
-            # 6. 結果統合
-            result = {
-                'text': text[:100] + '...' if len(text) > 100 else text,
-                'original_nlp_result': nlp_result,
-                'context_flags': context_flags,
-                'sentiment_analysis': adjusted_result,
-                'business_segment': segment_mapping,
-                'text_length': len(text),
-                'processed_text_length': len(processed_text),
-                'processing_time_ms': int(processing_time),
-                'processed': True,
-                'model_version': 'cl-tohoku/bert-base-japanese-v3-context-aware',
-                'timestamp': time.time(),
-                'analysis_method': 'context_aware_business_logic'
-            }
-            
+            result = self.build_result(text, processed_text, nlp_result, processing_time, context_flags)
+            if rule is not None:
+                result['cascade'] = self.cascade_info(rule, stage, audited)
             return result
             
         except Exception as e:
@@ -326,50 +464,332 @@ class ContextAwareAnalyzer:
                 'processing_time_ms': int((time.time() - start_time) * 1000)
             }
     
-    def analyze_batch(self, texts):
-        """複数テキストの一括分析"""
-        results = []
+    def token_lengths(self, texts):
+        """バケット分け用のトークン長を計算する"""
+        if self.pooling:
+            encoded = self.nlp_analyzer.tokenizer(list(texts), truncation=False)
+        else:
+            encoded = self.nlp_analyzer.tokenizer(list(texts), truncation=True, max_length=512)
+        return [len(ids) for ids in encoded['input_ids']]
+    
+    def plan_batches(self, processed_texts):
+        """トークン長でソートしたインデックスをマイクロバッチに分割する
+
+        長さの近いテキスト同士をまとめることでパディングを最小化する。
+        """
+        lengths = self.token_lengths(processed_texts)
+        order = sorted(range(len(processed_texts)), key=lambda i: lengths[i])
+        return [order[i:i + self.batch_size] for i in range(0, len(order), self.batch_size)]
+    
+    def analyze_micro_batch(self, texts, processed_texts):
+        """1回のフォワードパスでマイクロバッチを分析する"""
+        start_time = time.time()
+        
+        try:
+            nlp_results = self.infer(processed_texts)
+        except Exception as e:
+            # バッチ単位で失敗した場合は1件ずつ分析してエラーを局所化する
+            print(f"⚠️ バッチ推論に失敗したため1件ずつ再試行します: {e}", file=sys.stderr)
+            return [self.analyze_with_context_and_business_logic(text) for text in texts]
         
-        for i, text in enumerate(texts):
-            print(f"📝 テキスト {i+1}/{len(texts)} を文脈理解 + ビジネスロジックで分析中...", file=sys.stderr)
+        # バッチ全体の処理時間を1件あたりに按分
+        processing_time = (time.time() - start_time) * 1000 / len(texts)
+        
+        if self.cache is not None:
+            for processed_text, nlp_result in zip(processed_texts, nlp_results):
+                self.cache.put(self.cache.key(processed_text), nlp_result)
+        
+        return [
+            self.build_result(text, processed_text, nlp_result, processing_time)
+            for text, processed_text, nlp_result in zip(texts, processed_texts, nlp_results)
+        ]
+    
+    def analyze_batch(self, texts):
+        """複数テキストの一括分析（トークン長でバケット化したマイクロバッチ推論）"""
+        texts = list(texts)
+        if not texts:
+            return []
+        
+        processed_texts = [self.preprocess(text) for text in texts]
+        results = [None] * len(texts)
+        
+        # カスケード時はルール段で確定したテキストをモデルに回さない
+        routes = [None] * len(texts)
+        if self.cascade_threshold is not None:
+            for i, processed_text in enumerate(processed_texts):
+                context_flags, rule, skip_model, audited = self.route_by_rules(processed_text)
+                routes[i] = (rule, audited)
+                if skip_model:
+                    results[i] = self.build_rule_result(texts[i], processed_text, context_flags, rule, 0)
+        
+        # キャッシュ済みの本文は推論せず、同一本文はバッチ内で1回だけ推論する
+        pending = {}
+        cache_hits = set()
+        for i, processed_text in enumerate(processed_texts):
+            if results[i] is not None:
+                continue
             
-            result = self.analyze_with_context_and_business_logic(text)
-            results.append(result)
+            if self.cache is None:
+                pending[i] = [i]
+                continue
             
-            if result['processed']:
-                sentiment = result['sentiment_analysis']['adjusted_sentiment']
-                segment = result['business_segment']['segment_name']
-                print(f"✅ {sentiment} → {segment} ({result['processing_time_ms']}ms)", file=sys.stderr)
+            key = self.cache.key(processed_text)
+            if key in pending:
+                pending[key].append(i)
+                continue
+            
+            nlp_result = self.cache.get(key)
+            if nlp_result is not None:
+                results[i] = self.build_result(texts[i], processed_text, nlp_result, 0)
+                cache_hits.add(i)
             else:
-                print(f"❌ エラー: {result.get('error', 'Unknown error')}", file=sys.stderr)
+                pending[key] = [i]
+        
+        groups_to_run = list(pending.values())
+        targets = [group[0] for group in groups_to_run]
+        batches = self.plan_batches([processed_texts[i] for i in targets]) if targets else []
+        done = len(texts) - sum(len(group) for group in groups_to_run)
+        
+        for batch_no, positions in enumerate(batches, 1):
+            groups = [groups_to_run[position] for position in positions]
+            indices = [group[0] for group in groups]
+            batch_results = self.analyze_micro_batch(
+                [texts[i] for i in indices],
+                [processed_texts[i] for i in indices]
+            )
+            
+            # 元の入力順に戻す（重複分は同じNLP結果から組み立てる）
+            for group, result in zip(groups, batch_results):
+                results[group[0]] = result
+                for i in group[1:]:
+                    if result['processed']:
+                        results[i] = self.build_result(
+                            texts[i], processed_texts[i], result['original_nlp_result'], 0
+                        )
+                    else:
+                        results[i] = dict(result)
+            
+            done += sum(len(group) for group in groups)
+            failed = sum(1 for result in batch_results if not result['processed'])
+            print(
+                f"📝 バッチ {batch_no}/{len(batches)} 完了 ({done}/{len(texts)}件, エラー {failed}件)",
+                file=sys.stderr
+            )
+        
+        # モデル/キャッシュで判定したテキストにルール段の判定を添える（一致率の集計用）
+        for i, route in enumerate(routes):
+            if route is not None and 'cascade' not in results[i] and results[i]['processed']:
+                rule, audited = route
+                stage = 'cache' if i in cache_hits else 'model'
+                results[i]['cascade'] = self.cascade_info(rule, stage, audited)
         
         return results
+    
+    def imap_batches(self, text_chunks):
+        """テキストのチャンク列を順に分析し、チャンクごとの結果を返す"""
+        for texts in text_chunks:
+            yield self.analyze_batch(texts)
 
-def main():
-    """メイン処理"""
-    analyzer = ContextAwareAnalyzer()
+# ワーカープロセス内で1度だけ読み込む分析器
+_worker_analyzer = None
+
+def build_cache(cache_size, cache_db=None, pooling=None, window_stride=DEFAULT_STRIDE):
+    """CLI設定からNLP結果キャッシュを作る（どちらの層も無効ならNone）
+
+    ウィンドウ分類の設定で結果が変わるため、キーの名前空間に含める。
+    """
+    if cache_size <= 0 and not cache_db:
+        return None
+    namespace = MODEL_VERSION
+    if pooling:
+        namespace += f'+windows:{pooling}:{window_stride}'
+    return AnalysisCache(namespace, max_entries=cache_size, disk_path=cache_db)
+
+def create_analyzer(batch_size=DEFAULT_BATCH_SIZE, cache_size=0, cache_db=None, pooling=None,
+                    window_stride=DEFAULT_STRIDE, cascade_threshold=None, cascade_audit_rate=0.0, num_threads=None):
+    """CLI設定から分析器を作る（ワーカープロセスでも同じ設定で作れるように）"""
+    return ContextAwareAnalyzer(
+        batch_size=batch_size,
+        cache=build_cache(cache_size, cache_db, pooling, window_stride),
+        pooling=pooling,
+        window_stride=window_stride,
+        cascade_threshold=cascade_threshold,
+        cascade_audit_rate=cascade_audit_rate,
+        num_threads=num_threads
+    )
+
+def _init_worker(num_threads, analyzer_options):
+    """ワーカープロセスの初期化（推論スレッド数の設定と分析器の作成）
+
+    PyTorch はプロセス全体のスレッド数を設定し、ONNX はセッションのスレッド数として
+    分析器に渡す（ONNX のときは torch を読み込まない）。
+    """
+    global _worker_analyzer
+    if DEFAULT_BACKEND == 'pytorch':
+        import torch
+        
+        torch.set_num_threads(num_threads)
+        try:
+            torch.set_num_interop_threads(1)
+        except RuntimeError:
+            pass
+    _worker_analyzer = create_analyzer(**analyzer_options, num_threads=num_threads)
+
+def _analyze_shard(texts):
+    return _worker_analyzer.analyze_batch(texts)
+
+class WorkerPoolAnalyzer:
+    """ContextAwareAnalyzer を複数プロセスで並列実行する
+
+    各ワーカーはモデルを1度だけ読み込み、キュー経由で受け取ったシャードを
+    分析する。結果は投入順に返し、処理中のシャード数を上限で抑えることで
+    入力が大きくてもメモリ使用量が増えないようにしている。
+    """
     
-    print("🚀 文脈理解 + ビジネスロジック分析器が起動しました", file=sys.stderr)
-    print("📝 標準入力からテキストを受け取ります", file=sys.stderr)
+    def __init__(self, workers, analyzer_options=None, threads_per_worker=None, shard_size=None):
+        analyzer_options = dict(analyzer_options or {})
+        self.workers = max(1, int(workers))
+        self.batch_size = max(1, int(analyzer_options.get('batch_size', DEFAULT_BATCH_SIZE)))
+        self.shard_size = max(1, int(shard_size or self.batch_size * 4))
+        self.max_in_flight = self.workers * 2
+        
+        # コア数をワーカー間で分け合う（intra-opスレッドの過剰な競合を避ける）
+        if threads_per_worker is None:
+            threads_per_worker = max(1, (os.cpu_count() or 1) // self.workers)
+        self.threads_per_worker = threads_per_worker
+        
+        print(
+            f"🧵 ワーカー {self.workers}プロセス × 推論スレッド {self.threads_per_worker} で起動中...",
+            file=sys.stderr
+        )
+        context = multiprocessing.get_context('spawn')
+        self.pool = context.Pool(
+            processes=self.workers,
+            initializer=_init_worker,
+            initargs=(self.threads_per_worker, analyzer_options)
+        )
     
-    # 標準入力からテキスト読み込み
-    texts = []
-    input_data = sys.stdin.read()
+    def imap_batches(self, text_chunks):
+        """チャンクをワーカーに投入し、投入順に結果を返す"""
+        pending = deque()
+        
+        for texts in text_chunks:
+            pending.append(self.pool.apply_async(_analyze_shard, (texts,)))
+            if len(pending) >= self.max_in_flight:
+                yield pending.popleft().get()
+        
+        while pending:
+            yield pending.popleft().get()
     
-    # JSONオブジェクトを個別に分割
-    lines = input_data.strip().split('\n')
+    def analyze_batch(self, texts):
+        """テキストをシャードに分けて並列分析する（入力順を維持）"""
+        results = []
+        for shard_results in self.imap_batches(iter_chunks(texts, self.shard_size)):
+            results.extend(shard_results)
+        return results
+    
+    def close(self):
+        self.pool.close()
+        self.pool.join()
     
-    for line in lines:
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.pool.terminate()
+        return False
+
+def iter_input_records(stream):
+    """NDJSON入力を1行ずつ遅延的に読み、textを持つレコードを返す"""
+    for line in stream:
         line = line.strip()
         if not line:
             continue
-            
+        
         try:
             data = json.loads(line)
-            if 'text' in data:
-                texts.append(data['text'])
         except json.JSONDecodeError:
             continue
+        
+        if isinstance(data, dict) and 'text' in data:
+            yield data
+
+def iter_chunks(iterable, size):
+    """イテラブルを最大size件ずつのリストに分割する"""
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+class DistributionCounter:
+    """感情・セグメント分布の逐次集計"""
+    
+    def __init__(self):
+        self.total_texts = 0
+        self.sentiment_counts = {}
+        self.segment_counts = {}
+        self.cascade_counts = {}
+    
+    def add(self, result):
+        self.total_texts += 1
+        if result['processed']:
+            sentiment = result['sentiment_analysis']['adjusted_sentiment']
+            segment = result['business_segment']['segment_name']
+            
+            self.sentiment_counts[sentiment] = self.sentiment_counts.get(sentiment, 0) + 1
+            self.segment_counts[segment] = self.segment_counts.get(segment, 0) + 1
+            
+            if 'cascade' in result:
+                self.add_cascade(result['cascade'], result['business_segment']['segment_id'])
+    
+    def add_cascade(self, cascade, segment_id):
+        """カスケードの段別件数と、モデル判定に対するルール判定の一致数を数える"""
+        counts = self.cascade_counts
+        stage = cascade['stage']
+        counts[stage] = counts.get(stage, 0) + 1
+        
+        if stage != 'rules':
+            agreed = cascade['rule_segment_id'] == segment_id
+            prefix = 'audit_' if cascade['audited'] else ''
+            counts[prefix + 'compared'] = counts.get(prefix + 'compared', 0) + 1
+            counts[prefix + 'agreed'] = counts.get(prefix + 'agreed', 0) + int(agreed)
+    
+    def cascade_statistics(self):
+        counts = self.cascade_counts
+        total = counts.get('rules', 0) + counts.get('model', 0) + counts.get('cache', 0)
+        
+        def ratio(numerator, denominator):
+            return round(numerator / denominator, 4) if denominator else None
+        
+        return {
+            'skipped_model': counts.get('rules', 0),
+            'model_calls': counts.get('model', 0),
+            'cache_hits': counts.get('cache', 0),
+            'skip_ratio': ratio(counts.get('rules', 0), total),
+            'rule_agreement': ratio(counts.get('agreed', 0), counts.get('compared', 0)),
+            'audited': counts.get('audit_compared', 0),
+            'audit_agreement': ratio(counts.get('audit_agreed', 0), counts.get('audit_compared', 0))
+        }
+    
+    def statistics(self):
+        statistics = {
+            'sentiment_distribution': self.sentiment_counts,
+            'segment_distribution': self.segment_counts
+        }
+        if self.cascade_counts:
+            statistics['cascade'] = self.cascade_statistics()
+        return statistics
+
+def run_summary_mode(analyzer, stream):
+    """全件を分析してから1つのJSONサマリーを出力する（従来モード）"""
+    texts = [data['text'] for data in iter_input_records(stream)]
     
     if not texts:
         print("❌ テキストが入力されていません", file=sys.stderr)
@@ -381,29 +801,125 @@ def main():
     results = analyzer.analyze_batch(texts)
     
     # 統計情報の計算
-    sentiment_counts = {}
-    segment_counts = {}
-    
+    counter = DistributionCounter()
     for result in results:
-        if result['processed']:
-            sentiment = result['sentiment_analysis']['adjusted_sentiment']
-            segment = result['business_segment']['segment_name']
-            
-            sentiment_counts[sentiment] = sentiment_counts.get(sentiment, 0) + 1
-            segment_counts[segment] = segment_counts.get(segment, 0) + 1
+        counter.add(result)
     
     # 結果統合
     summary = {
         'total_texts': len(texts),
-        'statistics': {
-            'sentiment_distribution': sentiment_counts,
-            'segment_distribution': segment_counts
-        },
+        'statistics': counter.statistics(),
         'detailed_results': results
     }
     
     # 結果出力
     print(json.dumps(summary, ensure_ascii=False, indent=2))
 
+def run_stream_mode(analyzer, stream, out, window):
+    """NDJSONを逐次分析し、1入力につき1行の結果と最後に統計トレーラーを出力する
+
+    保持するのは最大window件の入力と分布カウンタのみなので、入力サイズに
+    関わらずメモリ使用量は一定に保たれる。
+    """
+    counter = DistributionCounter()
+    pending_records = deque()
+    
+    def text_chunks():
+        for records in iter_chunks(iter_input_records(stream), window):
+            pending_records.append(records)
+            yield [data['text'] for data in records]
+    
+    for results in analyzer.imap_batches(text_chunks()):
+        records = pending_records.popleft()
+        
+        for data, result in zip(records, results):
+            line = {'type': 'result', 'index': counter.total_texts}
+            if 'id' in data:
+                line['id'] = data['id']
+            line.update(result)
+            counter.add(result)
+            out.write(json.dumps(line, ensure_ascii=False) + '\n')
+        out.flush()
+    
+    trailer = {
+        'type': 'summary',
+        'total_texts': counter.total_texts,
+        'statistics': counter.statistics()
+    }
+    out.write(json.dumps(trailer, ensure_ascii=False) + '\n')
+    out.flush()
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='文脈理解 + ビジネスロジック分析器')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help='1回のフォワードパスで処理するテキスト数')
+    parser.add_argument('--stream', action='store_true',
+                        help='NDJSONを逐次読み込み、結果を1行ずつ出力する')
+    parser.add_argument('--stream-window', type=int, default=None,
+                        help='ストリーミング時に一度に読み込む件数（デフォルト: batch-sizeの4倍）')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='モデルを読み込むワーカープロセス数（1なら単一プロセス）')
+    parser.add_argument('--threads-per-worker', type=int, default=None,
+                        help='ワーカーごとの推論スレッド数（torch intra-op / ONNX Runtime。デフォルト: CPUコア数 / workers）')
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_MEMORY_ENTRIES,
+                        help='NLP結果のメモリキャッシュ件数（0で無効）')
+    parser.add_argument('--cache-db', default=None,
+                        help='NLP結果のディスクキャッシュ（SQLiteファイルのパス）')
+    parser.add_argument('--pooling', choices=POOLING_METHODS, default=None,
+                        help='トークン単位のスライディングウィンドウで全文を評価し、スコアを統合する方法')
+    parser.add_argument('--window-stride', type=int, default=DEFAULT_STRIDE,
+                        help='ウィンドウ間で重ねるトークン数')
+    parser.add_argument('--cascade', action='store_true',
+                        help='ルール段で確定できるテキストはBERTを呼ばずに判定する')
+    parser.add_argument('--cascade-threshold', type=float, default=DEFAULT_CASCADE_THRESHOLD,
+                        help='モデルを省略するルール段の信頼度の下限')
+    parser.add_argument('--cascade-audit-rate', type=float, default=0.0,
+                        help='ルール段で確定したテキストのうち一致率計測のためモデルにも回す割合')
+    return parser.parse_args(argv)
+
+def main():
+    """メイン処理"""
+    args = parse_args()
+    
+    analyzer_options = {
+        'batch_size': args.batch_size,
+        'cache_size': args.cache_size,
+        'cache_db': args.cache_db,
+        'pooling': args.pooling,
+        'window_stride': args.window_stride,
+        'cascade_threshold': args.cascade_threshold if args.cascade else None,
+        'cascade_audit_rate': args.cascade_audit_rate
+    }
+    
+    if args.workers > 1:
+        analyzer = WorkerPoolAnalyzer(
+            args.workers,
+            analyzer_options,
+            threads_per_worker=args.threads_per_worker
+        )
+    else:
+        analyzer = create_analyzer(**analyzer_options)
+        if args.stream and not args.cascade:
+            # ストリーミングでは最初の行の遅延に読み込み時間を持ち込まないよう先に読み込む
+            # （カスケード時はルール段で確定すれば不要なので初回利用時まで遅らせる）
+            analyzer.nlp_analyzer
+    _startup_timer.report()
+    
+    print("🚀 文脈理解 + ビジネスロジック分析器が起動しました", file=sys.stderr)
+    print("📝 標準入力からテキストを受け取ります", file=sys.stderr)
+    
+    try:
+        if args.stream:
+            window = args.stream_window or analyzer.batch_size * 4
+            run_stream_mode(analyzer, sys.stdin, sys.stdout, max(1, window))
+        else:
+            run_summary_mode(analyzer, sys.stdin)
+    finally:
+        if isinstance(analyzer, WorkerPoolAnalyzer):
+            analyzer.close()
+        elif analyzer.cache is not None:
+            print(f"🗃️ キャッシュ統計: {json.dumps(analyzer.cache.stats())}", file=sys.stderr)
+            analyzer.cache.close()
+
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
@@ -0,0 +1,449 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+感情分析モデルの推論バックエンド
+
+各分析器は `load_classifier()` でテキスト分類器を作る。バックエンドは
+環境変数 `NLP_BACKEND`（または引数）で切り替える。
+
+- pytorch: HF `pipeline`（従来どおり eager PyTorch fp32）
+- onnx:    初回に ONNX へエクスポートして int8 動的量子化し、ONNX Runtime で推論
+
+どちらも HF `pipeline` と同じ label/score 形式を返す。
+分類ヘッドが学習されていないチェックポイント（既定の cl-tohoku/bert-base-japanese-v3 など）は
+読み込むたびにヘッドがランダムに初期化されるため、バックエンドを切り替えると予測が変わる
+（ONNX はエクスポート時に初期化したヘッドを使い続ける）。
+numpy / torch / transformers / onnxruntime は実際に分類器を作るまで import しない。
+
+実行方法:
+  python scripts/inference_backend.py export --model cl-tohoku/bert-base-japanese-v3
+  python scripts/inference_backend.py parity --model cl-tohoku/bert-base-japanese-v3 < texts.ndjson
+"""
+
+from __future__ import annotations
+
+import argparse
+import copy
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import List, Optional
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from scripts.model_registry import get_shared_model, registry
+
+# Optional: fcntl（POSIX のみ。無ければエクスポートのプロセス間ロックを省く）
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+from scripts.token_windows import WindowedClassifier
+
+BACKENDS = ('pytorch', 'onnx')
+DEFAULT_BACKEND = os.environ.get('NLP_BACKEND', 'pytorch')
+DEFAULT_ONNX_ROOT = Path(os.environ.get('NLP_ONNX_DIR', Path(__file__).parent.parent / 'artifacts' / 'onnx'))
+
+ONNX_FILE = 'model.onnx'
+QUANTIZED_ONNX_FILE = 'model.int8.onnx'
+MAX_LENGTH = 512
+
+
+def onnx_dir_for(model_name: str, root: Optional[Path] = None) -> Path:
+    """モデル名ごとのエクスポート先ディレクトリ"""
+    return Path(root or DEFAULT_ONNX_ROOT) / model_name.replace('/', '__')
+
+
+def export_onnx(
+    model_name: str,
+    output_dir: Path,
+    quantize: bool = True,
+    opset: int = 14,
+    model=None,
+    tokenizer=None,
+) -> Path:
+    """HF モデルを ONNX にエクスポートし、必要なら int8 動的量子化する
+
+    トークナイザーと設定（id2label）も同じディレクトリに保存するため、
+    推論時に元のチェックポイントを再読み込みする必要はない。
+    ONNX ファイルは一時ファイルに書いてから os.replace で置くため、他のプロセスが
+    書きかけのファイルを開くことはない（トークナイザーと設定はその前に保存する）。
+    model / tokenizer を渡すと読み込み済みのインスタンス（CPU 上）をそのままエクスポートする。
+    """
+    import torch
+    from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    print(f"📦 {model_name} を ONNX にエクスポート中...", file=sys.stderr)
+    tokenizer = tokenizer or AutoTokenizer.from_pretrained(model_name)
+    if model is None:
+        model, loading_info = AutoModelForSequenceClassification.from_pretrained(model_name, output_loading_info=True)
+        if loading_info.get('missing_keys'):
+            print(f"⚠️ {model_name} の分類ヘッドはチェックポイントに無くランダムに初期化されます。"
+                  "PyTorch バックエンドとは予測が一致しません", file=sys.stderr)
+    model.eval()
+
+    sample = tokenizer(['サンプル'], return_tensors='pt')
+    input_names = [name for name in ('input_ids', 'attention_mask', 'token_type_ids') if name in sample]
+    dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in input_names}
+    dynamic_axes['logits'] = {0: 'batch'}
+
+    onnx_path = output_dir / ONNX_FILE
+    partial_onnx_path = output_dir / f'{os.getpid()}.partial.{ONNX_FILE}'
+    with torch.inference_mode():
+        torch.onnx.export(
+            model,
+            tuple(sample[name] for name in input_names),
+            str(partial_onnx_path),
+            input_names=input_names,
+            output_names=['logits'],
+            dynamic_axes=dynamic_axes,
+            opset_version=opset,
+        )
+
+    tokenizer.save_pretrained(output_dir)
+    model.config.save_pretrained(output_dir)
+
+    if not quantize:
+        os.replace(partial_onnx_path, onnx_path)
+        return onnx_path
+
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    print("🗜️ int8 動的量子化を適用中...", file=sys.stderr)
+    quantized_path = output_dir / QUANTIZED_ONNX_FILE
+    partial_quantized_path = output_dir / f'{os.getpid()}.partial.{QUANTIZED_ONNX_FILE}'
+    quantize_dynamic(str(partial_onnx_path), str(partial_quantized_path), weight_type=QuantType.QInt8)
+    os.replace(partial_onnx_path, onnx_path)
+    os.replace(partial_quantized_path, quantized_path)
+    return quantized_path
+
+
+def ensure_onnx_export(model_name: str, onnx_dir: Optional[Path] = None, quantized: bool = True) -> Path:
+    """エクスポート済みの ONNX ファイルのパスを返す（無ければエクスポートする）
+
+    同じディレクトリへの同時エクスポートはファイルロックで1回にまとめる
+    （prefork の各ワーカーなど、プロセスをまたいでも重ならない）。
+    """
+    model_dir = Path(onnx_dir) if onnx_dir else onnx_dir_for(model_name)
+    target = model_dir / (QUANTIZED_ONNX_FILE if quantized else ONNX_FILE)
+    if target.exists():
+        return target
+
+    model_dir.mkdir(parents=True, exist_ok=True)
+    with open(model_dir / '.export.lock', 'w') as lock:
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        # ロック待ちの間に他のプロセスがエクスポートを終えていれば何もしない
+        if not target.exists():
+            export_onnx(model_name, model_dir, quantize=quantized)
+    return target
+
+
+def softmax(logits: 'np.ndarray') -> 'np.ndarray':
+    import numpy as np
+
+    shifted = logits - logits.max(axis=-1, keepdims=True)
+    exp = np.exp(shifted)
+    return exp / exp.sum(axis=-1, keepdims=True)
+
+
+class OnnxTextClassifier:
+    """ONNX Runtime による text-classification（HF pipeline と同じ呼び出し規約）"""
+
+    def __init__(
+        self,
+        model_dir: Path,
+        quantized: bool = True,
+        return_all_scores: bool = False,
+        num_threads: Optional[int] = None,
+    ) -> None:
+        # Optional: onnxruntime（onnx バックエンド使用時のみ必要）
+        try:
+            import onnxruntime as ort
+        except ImportError as exc:
+            raise ImportError('onnxruntime is not installed; pip install onnxruntime') from exc
+        from transformers import AutoConfig, AutoTokenizer
+
+        model_dir = Path(model_dir)
+        self.model_path = model_dir / (QUANTIZED_ONNX_FILE if quantized else ONNX_FILE)
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.id2label = {int(k): v for k, v in AutoConfig.from_pretrained(model_dir).id2label.items()}
+        self.return_all_scores = return_all_scores
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(str(self.model_path), options, providers=['CPUExecutionProvider'])
+        self.input_names = {item.name for item in self.session.get_inputs()}
+
+    def probabilities(self, features: dict) -> List[List[float]]:
+        """トークナイズ済みの特徴量（numpy）からラベル確率を返す"""
+        import numpy as np
+
+        inputs = {name: np.asarray(value, dtype=np.int64) for name, value in features.items() if name in self.input_names}
+        # tokenizer.pad() で作った特徴量（ウィンドウ推論）には token_type_ids が無いが、
+        # エクスポート時のサンプルに含まれていればモデルの必須入力になっている
+        if 'token_type_ids' in self.input_names and 'token_type_ids' not in inputs:
+            inputs['token_type_ids'] = np.zeros_like(inputs['input_ids'])
+        (logits,) = self.session.run(['logits'], inputs)
+        return softmax(logits).tolist()
+
+    def __call__(self, inputs, batch_size: int = 1, truncation: bool = True, **kwargs):
+        single = isinstance(inputs, str)
+        texts = [inputs] if single else list(inputs)
+        return_all_scores = kwargs.get('return_all_scores', self.return_all_scores)
+        if 'top_k' in kwargs:
+            return_all_scores = kwargs['top_k'] is None
+
+        outputs = []
+        for start in range(0, len(texts), max(1, batch_size)):
+            chunk = texts[start:start + max(1, batch_size)]
+            features = self.tokenizer(
+                chunk, padding=True, truncation=truncation, max_length=MAX_LENGTH, return_tensors='np'
+            )
+            for probs in self.probabilities(features):
+                scores = [{'label': self.id2label[i], 'score': float(p)} for i, p in enumerate(probs)]
+                outputs.append(scores if return_all_scores else max(scores, key=lambda item: item['score']))
+
+        # pipeline と同様、単一文字列入力でもリストで返す
+        if single and return_all_scores:
+            return [outputs[0]]
+        return outputs
+
+
+def load_classifier(
+    model_name: str,
+    backend: Optional[str] = None,
+    return_all_scores: bool = False,
+    onnx_dir: Optional[Path] = None,
+    quantized: bool = True,
+    num_threads: Optional[int] = None,
+    **pipeline_kwargs,
+):
+    """バックエンドを選んでテキスト分類器を作る
+
+    重みとトークナイザー（ONNX はセッション）はモデルレジストリ経由で
+    プロセス内で共有し、同じモデルを何度要求しても読み込みは1回だけ。
+    onnx バックエンドでエクスポート済みモデルが無い場合は、その場で1度だけ
+    エクスポートと量子化を行う。
+    num_threads は ONNX Runtime セッションの演算スレッド数（PyTorch はプロセス全体の
+    torch.set_num_threads() に従う）。
+    """
+    backend = backend or DEFAULT_BACKEND
+    if backend not in BACKENDS:
+        raise ValueError(f'unknown inference backend: {backend}')
+
+    if backend == 'onnx':
+        model_dir = Path(onnx_dir) if onnx_dir else onnx_dir_for(model_name)
+        target = model_dir / (QUANTIZED_ONNX_FILE if quantized else ONNX_FILE)
+
+        def load_onnx():
+            ensure_onnx_export(model_name, model_dir, quantized=quantized)
+            return OnnxTextClassifier(model_dir, quantized=quantized, num_threads=num_threads)
+
+        shared = registry.get_or_load(('onnx', str(target)), load_onnx)
+        # セッションは共有し、出力形式の設定だけを呼び出し側ごとに持つ
+        classifier = copy.copy(shared)
+        classifier.return_all_scores = return_all_scores
+        return classifier
+
+    from transformers import pipeline
+
+    shared = get_shared_model(model_name, device=pipeline_kwargs.pop('device', None))
+    if return_all_scores:
+        pipeline_kwargs['return_all_scores'] = True
+    return pipeline(
+        'sentiment-analysis',
+        model=shared.model,
+        tokenizer=shared.tokenizer,
+        device=shared.device,
+        **pipeline_kwargs
+    )
+
+
+def classify_staged(classifier, texts: List[str], truncation: bool = True) -> tuple:
+    """トークナイズとフォワードを分けて1バッチ推論し、段階ごとの所要時間も返す
+
+    load_classifier() の分類器（HF pipeline / OnnxTextClassifier）を受け取り、
+    (テキストごとの全ラベルのスコア, {'tokenize': 秒, 'forward': 秒, 'tokens': トークン数}) を返す。
+    """
+    onnx = hasattr(classifier, 'probabilities')
+    started = time.perf_counter()
+    features = classifier.tokenizer(
+        list(texts), padding=True, truncation=truncation, max_length=MAX_LENGTH,
+        return_tensors='np' if onnx else 'pt',
+    )
+    tokenized = time.perf_counter()
+
+    if onnx:
+        id2label = classifier.id2label
+        probabilities = classifier.probabilities(features)
+    else:
+        import torch
+
+        model = classifier.model
+        id2label = model.config.id2label
+        with torch.inference_mode():
+            logits = model(**{name: tensor.to(model.device) for name, tensor in features.items()}).logits
+        probabilities = logits.softmax(dim=-1).tolist()
+    finished = time.perf_counter()
+
+    scores = [[{'label': id2label[i], 'score': float(p)} for i, p in enumerate(probs)] for probs in probabilities]
+    timings = {
+        'tokenize': tokenized - started,
+        'forward': finished - tokenized,
+        # パディングを除いた実トークン数
+        'tokens': int(features['attention_mask'].sum()),
+    }
+    return scores, timings
+
+
+def release_classifier(model_name: str, onnx_dir: Optional[Path] = None) -> None:
+    """load_classifier() がレジストリに共有したモデルを手放す（全デバイス・量子化の有無とも）"""
+    onnx_targets = {
+        str((Path(onnx_dir) if onnx_dir else onnx_dir_for(model_name)) / filename)
+        for filename in (ONNX_FILE, QUANTIZED_ONNX_FILE)
+    }
+    for key in registry.keys():
+        if key[0] == 'pytorch' and key[1] == model_name:
+            registry.discard(key)
+        elif key[0] == 'onnx' and key[1] in onnx_targets:
+            registry.discard(key)
+
+
+def check_parity(model_name: str, texts: List[str], onnx_dir: Optional[Path] = None, quantized: bool = True) -> dict:
+    """PyTorch と ONNX Runtime の出力を比較する（ラベル一致率と確率の最大差）
+
+    切り詰めた全文の分類に加え、ウィンドウ推論（`--pooling` の経路）も比較する。
+    チェックポイントにランダム初期化の重み（未学習の分類ヘッドなど）がある場合は、
+    ONNX 化と量子化による差だけを測るため、比較に使う PyTorch モデルそのものを
+    一時ディレクトリにエクスポートして比較する（onnx_dir のエクスポートは使わない）。
+    """
+    reference = load_classifier(model_name, backend='pytorch', return_all_scores=True)
+    shared = get_shared_model(model_name)
+    export_dir = None
+    if shared.newly_initialized:
+        print(f"⚠️ {model_name} にはランダムに初期化された重みがあります"
+              f"（{', '.join(shared.newly_initialized)}）。同じインスタンスをエクスポートして比較します",
+              file=sys.stderr)
+        export_dir = Path(tempfile.mkdtemp(prefix='onnx-parity-'))
+        export_onnx(model_name, export_dir, quantize=quantized, model=shared.model, tokenizer=shared.tokenizer)
+        onnx_dir = export_dir
+    try:
+        report = _compare_backends(reference, load_classifier(
+            model_name, backend='onnx', return_all_scores=True, onnx_dir=onnx_dir, quantized=quantized
+        ), texts)
+    finally:
+        if export_dir is not None:
+            for filename in (ONNX_FILE, QUANTIZED_ONNX_FILE):
+                registry.discard(('onnx', str(export_dir / filename)))
+            shutil.rmtree(export_dir, ignore_errors=True)
+    report['quantized'] = quantized
+    report['newly_initialized_weights'] = shared.newly_initialized
+    return report
+
+
+def _compare_backends(reference, candidate, texts: List[str]) -> dict:
+
+    def timed(classifier):
+        latencies = []
+        outputs = []
+        for text in texts:
+            start = time.perf_counter()
+            outputs.append(classifier(text, truncation=True)[0])
+            latencies.append((time.perf_counter() - start) * 1000)
+        return outputs, latencies
+
+    expected, torch_latencies = timed(reference)
+    actual, onnx_latencies = timed(candidate)
+
+    agreed = 0
+    max_abs_diff = 0.0
+    for want, got in zip(expected, actual):
+        want_scores = {item['label']: item['score'] for item in want}
+        got_scores = {item['label']: item['score'] for item in got}
+        agreed += max(want_scores, key=want_scores.get) == max(got_scores, key=got_scores.get)
+        max_abs_diff = max(max_abs_diff, max(abs(want_scores[label] - got_scores[label]) for label in want_scores))
+
+    # ウィンドウ推論: トークナイザーの pad() を通る別経路なので個別に比較する
+    windowed_expected = WindowedClassifier(reference, max_length=MAX_LENGTH, pooling='mean')(texts)
+    windowed_actual = WindowedClassifier(candidate, max_length=MAX_LENGTH, pooling='mean')(texts)
+    windowed_agreed = 0
+    windowed_max_diff = 0.0
+    for (want,), (got,) in zip(windowed_expected, windowed_actual):
+        if want['label'] == got['label']:
+            windowed_agreed += 1
+            windowed_max_diff = max(windowed_max_diff, abs(want['score'] - got['score']))
+
+    import numpy as np
+
+    def percentile(values, q):
+        return round(float(np.percentile(values, q)), 2) if values else None
+
+    return {
+        'texts': len(texts),
+        'label_agreement': round(agreed / len(texts), 4) if texts else None,
+        'max_abs_score_diff': round(max_abs_diff, 6),
+        'windowed_label_agreement': round(windowed_agreed / len(texts), 4) if texts else None,
+        'windowed_max_abs_score_diff': round(windowed_max_diff, 6),
+        'pytorch_ms': {'p50': percentile(torch_latencies, 50), 'p99': percentile(torch_latencies, 99)},
+        'onnx_ms': {'p50': percentile(onnx_latencies, 50), 'p99': percentile(onnx_latencies, 99)},
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='ONNX Runtime 推論バックエンドの準備と検証')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = sub.add_parser('export', help='ONNX へのエクスポートと int8 量子化')
+    export_parser.add_argument('--model', required=True)
+    export_parser.add_argument('--output', default=None)
+    export_parser.add_argument('--no-quantize', action='store_true')
+
+    parity_parser = sub.add_parser('parity', help='PyTorch 出力との一致を確認（標準入力: NDJSON {"text": ...}）')
+    parity_parser.add_argument('--model', required=True)
+    parity_parser.add_argument('--onnx-dir', default=None)
+    parity_parser.add_argument('--no-quantize', action='store_true')
+    parity_parser.add_argument('--min-agreement', type=float, default=0.98)
+
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        output = Path(args.output) if args.output else onnx_dir_for(args.model)
+        path = export_onnx(args.model, output, quantize=not args.no_quantize)
+        print(f"✅ エクスポート完了: {path}", file=sys.stderr)
+        return
+
+    texts = []
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            data = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+        if isinstance(data, dict) and data.get('text'):
+            texts.append(data['text'])
+
+    report = check_parity(
+        args.model, texts,
+        onnx_dir=Path(args.onnx_dir) if args.onnx_dir else None,
+        quantized=not args.no_quantize,
+    )
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    agreements = (report['label_agreement'], report['windowed_label_agreement'])
+    if any(agreement is not None and agreement < args.min_agreement for agreement in agreements):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
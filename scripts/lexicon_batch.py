@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+列単位の辞書スコアリング（バックフィル用）
+
+pandas の Series または Arrow の文字列配列をまとめて採点し、スコア・
+カテゴリ別ヒット数・フラグの列を返す。行ごとに分析器を呼んで dict を
+作る代わりに、列全体を区切り文字で連結した1本のバッファをマルチパターン
+マッチャーで1回だけ走査し、ヒット位置から行番号を引いて numpy で集計する。
+
+- マッチャー: pyahocorasick（ネイティブ実装、インストール時）または CompiledLexicon
+- スコアは ImprovedJapaneseSentimentAnalyzer と同じく、行内で出現した
+  エントリの重みの合計（同じエントリの複数出現は1回と数える）
+
+実行方法:
+  python scripts/lexicon_batch.py messages.parquet --column body --output scores.parquet
+  python scripts/lexicon_batch.py messages.csv --column body --dictionary data/samples/dictionary_sample.csv
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+from functools import lru_cache
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from scripts.lexicon_matcher import CompiledLexicon
+
+ENGINES = ('auto', 'ahocorasick', 'python')
+
+# 行の区切り（フレーズに含まれない文字であること）
+_ROW_SEPARATOR = '\x00'
+
+
+@lru_cache(maxsize=4)
+def _native_automaton(lexicon: CompiledLexicon):
+    """pyahocorasick のオートマトン（フレーズ → エントリ番号のタプル）"""
+    import ahocorasick
+
+    ids_by_phrase = {}
+    for entry_id, entry in enumerate(lexicon.entries):
+        ids_by_phrase.setdefault(entry.phrase, []).append(entry_id)
+
+    automaton = ahocorasick.Automaton()
+    for phrase, entry_ids in ids_by_phrase.items():
+        automaton.add_word(phrase, (len(phrase), tuple(entry_ids)))
+    automaton.make_automaton()
+    return automaton
+
+
+def resolve_engine(engine: str = 'auto') -> str:
+    if engine not in ENGINES:
+        raise ValueError(f'unknown matcher engine: {engine}')
+    if engine != 'auto':
+        return engine
+    # Optional: pyahocorasick（無ければ純 Python のオートマトンを使う）
+    try:
+        import ahocorasick  # noqa: F401
+        return 'ahocorasick'
+    except ImportError:
+        return 'python'
+
+
+def _to_texts(values):
+    """Series / Arrow 配列 / シーケンスを文字列のリストにする（欠損は空文字）"""
+    if hasattr(values, 'fillna'):
+        return values.fillna('').astype(str).tolist()
+    if hasattr(values, 'to_pylist'):
+        import pyarrow.compute as pc
+
+        return pc.fill_null(values, '').to_pylist()
+    return ['' if value is None else str(value) for value in values]
+
+
+def _find_hits(buffer: str, lexicon: CompiledLexicon, engine: str):
+    """バッファ中の全ヒットを (開始位置, エントリ番号) の配列で返す"""
+    import numpy as np
+
+    if engine == 'ahocorasick':
+        starts = []
+        entry_ids = []
+        for end, (length, ids) in _native_automaton(lexicon).iter(buffer):
+            for entry_id in ids:
+                starts.append(end - length + 1)
+                entry_ids.append(entry_id)
+    else:
+        matches = lexicon.scan(buffer)
+        starts = [start for _, start in matches]
+        entry_ids = [entry_id for entry_id, _ in matches]
+
+    return np.asarray(starts, dtype=np.int64), np.asarray(entry_ids, dtype=np.int64)
+
+
+def score_column(values, lexicon: CompiledLexicon, engine: str = 'auto'):
+    """テキスト列を採点してスコア・カテゴリ別ヒット数・フラグの列を返す
+
+    列:
+      negative_score / positive_score: 極性ごとの重みの合計
+      hits: 出現したエントリ数
+      hits_<カテゴリ>: カテゴリごとの出現エントリ数
+      has_negative / has_positive: その極性のヒットがあるか
+
+    pandas の Series を渡すと同じ index の DataFrame、Arrow 配列
+    （ChunkedArray を含む）を渡すと pyarrow.Table を返す。
+    """
+    import numpy as np
+
+    engine = resolve_engine(engine)
+    if any(_ROW_SEPARATOR in entry.phrase for entry in lexicon.entries):
+        raise ValueError('phrases must not contain NUL characters')
+
+    texts = _to_texts(values)
+    row_count = len(texts)
+
+    # 行の開始位置（区切り文字の分 +1）
+    lengths = np.fromiter(map(len, texts), dtype=np.int64, count=row_count)
+    row_starts = np.zeros(row_count, dtype=np.int64)
+    if row_count:
+        np.cumsum(lengths[:-1] + 1, out=row_starts[1:])
+
+    starts, entry_ids = _find_hits(_ROW_SEPARATOR.join(texts), lexicon, engine)
+
+    # (行, エントリ) の組を一意にして、行内の重複出現を1回に数える
+    entry_count = max(1, len(lexicon.entries))
+    rows = np.searchsorted(row_starts, starts, side='right') - 1
+    pairs = np.unique(rows * entry_count + entry_ids)
+    rows, entry_ids = np.divmod(pairs, entry_count)
+
+    weights = np.asarray([entry.weight for entry in lexicon.entries], dtype=np.float64)
+    polarities = np.asarray([entry.polarity for entry in lexicon.entries], dtype=object)
+    categories = list(dict.fromkeys(entry.category for entry in lexicon.entries))
+    category_codes = np.asarray(
+        [categories.index(entry.category) for entry in lexicon.entries], dtype=np.int64
+    )
+
+    hit_weights = weights[entry_ids]
+    hit_polarities = polarities[entry_ids]
+    hit_categories = category_codes[entry_ids]
+
+    columns = {}
+    for polarity in ('negative', 'positive'):
+        mask = hit_polarities == polarity
+        columns[f'{polarity}_score'] = np.bincount(rows[mask], weights=hit_weights[mask], minlength=row_count)
+    columns['hits'] = np.bincount(rows, minlength=row_count).astype(np.int32)
+    for code, category in enumerate(categories):
+        mask = hit_categories == code
+        columns[f'hits_{category}'] = np.bincount(rows[mask], minlength=row_count).astype(np.int32)
+    for polarity in ('negative', 'positive'):
+        columns[f'has_{polarity}'] = columns[f'{polarity}_score'] > 0
+
+    if hasattr(values, 'fillna'):
+        import pandas as pd
+
+        return pd.DataFrame(columns, index=values.index)
+    if hasattr(values, 'to_pylist'):
+        import pyarrow as pa
+
+        return pa.table(columns)
+    return columns
+
+
+def read_table(path: Path):
+    import pandas as pd
+
+    if path.suffix == '.parquet':
+        return pd.read_parquet(path)
+    if path.suffix in ('.jsonl', '.ndjson'):
+        return pd.read_json(path, lines=True)
+    return pd.read_csv(path)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='テキスト列の辞書スコアリング（一括）')
+    parser.add_argument('input', help='入力ファイル（.parquet / .csv / .jsonl）')
+    parser.add_argument('--column', default='body', help='採点するテキスト列')
+    parser.add_argument('--dictionary', default=None, help='組み込み辞書に加えるフレーズ辞書 CSV')
+    parser.add_argument('--engine', choices=ENGINES, default='auto')
+    parser.add_argument('--output', default=None, help='出力ファイル（.parquet / .csv、省略時は標準出力に CSV）')
+    args = parser.parse_args()
+
+    from scripts.nlp_analyzer_improved import ImprovedJapaneseSentimentAnalyzer
+
+    lexicon = ImprovedJapaneseSentimentAnalyzer(lexicon_only=True, dictionary_path=args.dictionary).lexicon
+    frame = read_table(Path(args.input))
+
+    start = time.perf_counter()
+    scores = score_column(frame[args.column], lexicon, engine=args.engine)
+    elapsed = time.perf_counter() - start
+    print(f"✅ {len(frame)} 行を {elapsed:.2f} 秒で採点 (engine={resolve_engine(args.engine)}, "
+          f"lexicon={lexicon.version})", file=sys.stderr)
+
+    if args.output is None:
+        scores.to_csv(sys.stdout)
+    elif args.output.endswith('.parquet'):
+        scores.to_parquet(args.output)
+    else:
+        scores.to_csv(args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+重み付き Aho-Corasick 辞書マッチャー
+
+辞書の全フレーズを1つのオートマトンにコンパイルし、本文を1回走査するだけで
+全カテゴリのヒット（出現位置つき）と極性ごとのスコアを求める。
+パターンごとに `in` で本文を走査する方式と違い、計算量は辞書の大きさに
+よらず本文長に比例する。
+"""
+
+from __future__ import annotations
+
+import hashlib
+from collections import deque
+from typing import Dict, Iterable, List, NamedTuple, Tuple
+
+
+class LexiconEntry(NamedTuple):
+    phrase: str
+    category: str
+    weight: float
+    polarity: str
+
+
+class CompiledLexicon:
+    """LexiconEntry 群をコンパイルした Aho-Corasick オートマトン
+
+    (phrase, category, polarity) が重複するエントリは1つにまとめる。
+    """
+
+    def __init__(self, entries: Iterable[LexiconEntry]) -> None:
+        self.entries: List[LexiconEntry] = []
+        seen = set()
+        for entry in entries:
+            key = (entry.phrase, entry.category, entry.polarity)
+            if entry.phrase and key not in seen:
+                seen.add(key)
+                self.entries.append(entry)
+
+        self.version = self._content_hash(self.entries)
+        self._build()
+
+    @staticmethod
+    def _content_hash(entries: List[LexiconEntry]) -> str:
+        digest = hashlib.sha256()
+        for entry in entries:
+            digest.update(f'{entry.phrase}\t{entry.category}\t{entry.weight}\t{entry.polarity}\n'.encode('utf-8'))
+        return digest.hexdigest()[:16]
+
+    def _build(self) -> None:
+        # goto: 状態ごとの遷移、output: 状態で終わるエントリ番号
+        self._goto: List[Dict[str, int]] = [{}]
+        self._output: List[List[int]] = [[]]
+
+        for entry_id, entry in enumerate(self.entries):
+            state = 0
+            for char in entry.phrase:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][char] = next_state
+                    self._goto.append({})
+                    self._output.append([])
+                state = next_state
+            self._output[state].append(entry_id)
+
+        # 幅優先で失敗リンクを張り、接尾辞で終わるエントリを出力に合流させる
+        self._fail = [0] * len(self._goto)
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(char, 0)
+                self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+
+    def scan(self, text: str) -> List[Tuple[int, int]]:
+        """本文中の全出現を (エントリ番号, 開始位置) で返す"""
+        goto = self._goto
+        fail = self._fail
+        output = self._output
+        entries = self.entries
+        matches = []
+        state = 0
+
+        for position, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for entry_id in output[state]:
+                matches.append((entry_id, position - len(entries[entry_id].phrase) + 1))
+
+        return matches
+
+    def analyze(self, text: str) -> Dict[str, Tuple[float, List[dict]]]:
+        """極性ごとの (スコア, ヒット一覧) を返す
+
+        スコアは出現したエントリの重みの合計（同じエントリの複数出現は1回と数える）。
+        ヒット一覧は辞書の定義順で、出現位置を positions に持つ。
+        """
+        positions: Dict[int, List[int]] = {}
+        for entry_id, start in self.scan(text):
+            positions.setdefault(entry_id, []).append(start)
+
+        results: Dict[str, Tuple[float, List[dict]]] = {}
+        for entry_id in sorted(positions):
+            entry = self.entries[entry_id]
+            score, hits = results.get(entry.polarity, (0, []))
+            hits.append({
+                'pattern': entry.phrase,
+                'category': entry.category,
+                'weight': entry.weight,
+                'positions': sorted(positions[entry_id]),
+            })
+            results[entry.polarity] = (score + entry.weight, hits)
+
+        return results
+
+
+def build_lexicon(
+    patterns_by_polarity: Dict[str, Dict[str, List[str]]],
+    category_weights: Dict[str, float],
+    default_weight: float = 1.0,
+) -> CompiledLexicon:
+    """{極性: {カテゴリ: [フレーズ, ...]}} 形式の辞書からマッチャーを作る"""
+    entries = []
+    for polarity, categories in patterns_by_polarity.items():
+        for category, phrases in categories.items():
+            weight = category_weights.get(category, default_weight)
+            for phrase in phrases:
+                entries.append(LexiconEntry(phrase, category, weight, polarity))
+    return CompiledLexicon(entries)
@@ -1,9 +1,54 @@
+import asyncio
+import json
 import os
-from typing import Optional, List
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import AsyncIterator, Callable, Dict, NamedTuple, Optional, List, Union
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 from pydantic import BaseModel
-from transformers import AutoModelForSequenceClassification, AutoTokenizer, pipeline
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+# Optional: orjson (faster JSON encoding) and msgpack (binary responses via Accept)
+try:
+  import orjson
+except ImportError:
+  orjson = None
+try:
+  import msgpack
+except ImportError:
+  msgpack = None
+
+from scripts.inference_backend import (
+  DEFAULT_BACKEND,
+  classify_staged,
+  ensure_onnx_export,
+  load_classifier,
+  release_classifier,
+)
+from scripts.model_pool import DEFAULT_MEMORY_BUDGET_MB, ModelPool
+from scripts.prefork_server import default_threads_per_worker, serve_prefork, set_inference_threads
+from scripts.sentiment_batcher import (
+  DEFAULT_AGING_MS,
+  DEFAULT_CONCURRENCY,
+  DEFAULT_MAX_BATCH_SIZE,
+  DEFAULT_MAX_QUEUE_SIZE,
+  DEFAULT_MAX_WAIT_MS,
+  DeadlineExceededError,
+  DynamicBatcher,
+  OverloadedError,
+  PRIORITIES,
+  QueueFullError,
+  resolve_priority,
+)
+from scripts.response_cache import DEFAULT_MAX_ENTRIES, DEFAULT_TTL_SECONDS, ResponseCache
+from scripts.server_metrics import BATCH_SIZE_BUCKETS, MetricsRegistry, StackSampler
 
 
 class SentimentScores(BaseModel):
@@ -24,51 +69,755 @@ class SentimentResponse(BaseModel):
 class SentimentRequest(BaseModel):
   text: str
   model: Optional[str] = None
+  deadlineMs: Optional[float] = None
+  # high / medium / low (or 0-2); when omitted, derived from `level` (e.g. scoring_pipeline's alert level)
+  priority: Optional[Union[str, int]] = None
+  level: Optional[str] = None
+
+
+class SentimentBatchItem(BaseModel):
+  id: Optional[Union[str, int]] = None
+  text: str
+  priority: Optional[Union[str, int]] = None
+  level: Optional[str] = None
+
+
+class SentimentBatchRequest(BaseModel):
+  items: List[SentimentBatchItem]
+  model: Optional[str] = None
+  deadlineMs: Optional[float] = None
+  # Default for items that carry neither priority nor level
+  priority: Optional[Union[str, int]] = None
+  level: Optional[str] = None
+
 
+class SentimentBatchResult(BaseModel):
+  id: Optional[Union[str, int]] = None
+  result: Optional[SentimentResponse] = None
+  error: Optional[str] = None
+
+
+class SentimentBatchResponse(BaseModel):
+  results: List[SentimentBatchResult]
+
+
+# Cold-start time is measured from module import (in prefork mode, from the parent's import)
+SERVER_STARTED = time.perf_counter()
 
 MODEL_NAME = os.getenv('LOCAL_SENTIMENT_MODEL', 'daigo/bert-base-japanese-sentiment')
-tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
-model = AutoModelForSequenceClassification.from_pretrained(MODEL_NAME)
-classifier = pipeline('sentiment-analysis', model=model, tokenizer=tokenizer, return_all_scores=True)
+BACKEND = os.getenv('LOCAL_SENTIMENT_BACKEND', DEFAULT_BACKEND)
+# Models a request may select with `model` (comma-separated); the default model is always allowed
+ALLOWED_MODELS = [MODEL_NAME] + [
+  name.strip() for name in os.getenv('LOCAL_SENTIMENT_MODELS', '').split(',') if name.strip() and name.strip() != MODEL_NAME
+]
+MAX_BATCH_ITEMS = int(os.getenv('LOCAL_SENTIMENT_MAX_BATCH_ITEMS', '1000'))
+# Default per-request deadline in ms when the request does not carry deadlineMs (0 = none)
+REQUEST_TIMEOUT_MS = float(os.getenv('LOCAL_SENTIMENT_REQUEST_TIMEOUT_MS', '0'))
+CONCURRENCY = int(os.getenv('LOCAL_SENTIMENT_CONCURRENCY', DEFAULT_CONCURRENCY))
+# Priority of requests that carry neither priority nor level: interactive single requests and bulk batch/stream
+DEFAULT_PRIORITY = resolve_priority(os.getenv('LOCAL_SENTIMENT_DEFAULT_PRIORITY', 'medium'))
+BULK_PRIORITY = resolve_priority(os.getenv('LOCAL_SENTIMENT_BULK_PRIORITY', 'low'))
+# Queued requests allowed per priority (LOCAL_SENTIMENT_MAX_QUEUE_HIGH etc., defaulting to LOCAL_SENTIMENT_MAX_QUEUE)
+QUEUE_LIMITS = [
+  int(os.getenv(f'LOCAL_SENTIMENT_MAX_QUEUE_{name.upper()}') or os.getenv('LOCAL_SENTIMENT_MAX_QUEUE', DEFAULT_MAX_QUEUE_SIZE))
+  for name in PRIORITIES
+]
+# A request waiting this long per priority step is served ahead of higher priorities (starvation protection)
+PRIORITY_AGING_MS = float(os.getenv('LOCAL_SENTIMENT_PRIORITY_AGING_MS', DEFAULT_AGING_MS))
+# Worker processes forked after the parent preloads the model (1 = single process, no fork)
+WORKERS = max(1, int(os.getenv('LOCAL_SENTIMENT_WORKERS', '1')))
+THREADS_PER_WORKER = int(os.getenv('LOCAL_SENTIMENT_THREADS_PER_WORKER', '0')) or default_threads_per_worker(WORKERS)
+# Drop rawResult (a second copy of the scores) from responses unless the request passes ?compact=0
+COMPACT_RESPONSES = os.getenv('LOCAL_SENTIMENT_COMPACT', '0') == '1'
+# Retry-After (seconds) sent while the model is still loading
+STARTUP_RETRY_AFTER = 5
+# Expose GET /debug/profile (sampling profiler); off by default
+PROFILER_ENABLED = os.getenv('LOCAL_SENTIMENT_PROFILER', '0') == '1'
+
+model_pool = ModelPool(
+  lambda name: load_classifier(
+    name, backend=BACKEND, return_all_scores=True, num_threads=THREADS_PER_WORKER if WORKERS > 1 else None
+  ),
+  memory_budget_mb=float(os.getenv('LOCAL_SENTIMENT_MODEL_MEMORY_MB', DEFAULT_MEMORY_BUDGET_MB)),
+  allowed_models=ALLOWED_MODELS,
+  unloader=release_classifier,
+)
+
+# One inference thread pool and concurrency limit shared by every model's batcher
+inference_executor = ThreadPoolExecutor(max_workers=max(1, CONCURRENCY), thread_name_prefix='sentiment-infer')
+inference_slots = asyncio.Semaphore(max(1, CONCURRENCY))
+batchers: Dict[str, DynamicBatcher] = {}
+
+
+metrics = MetricsRegistry()
+REQUEST_SECONDS = metrics.histogram(
+  'sentiment_request_duration_seconds', 'HTTP request latency until the response is complete', ['endpoint', 'status']
+)
+STAGE_SECONDS = metrics.histogram(
+  'sentiment_stage_duration_seconds',
+  'Time spent per stage: tokenize and forward per batch, serialize per response body', ['stage', 'model'],
+)
+BATCH_SIZE = metrics.histogram('sentiment_batch_size', 'Texts per model forward pass', ['model'], buckets=BATCH_SIZE_BUCKETS)
+TOKENS = metrics.counter('sentiment_tokens_total', 'Tokens run through the model (rate() gives tokens/sec)', ['model'])
+RESPONSE_BYTES = metrics.counter('sentiment_response_bytes_total', 'Encoded response body bytes', ['format'])
+TOKENS_PER_SECOND = metrics.gauge('sentiment_tokens_per_second', 'Forward-pass throughput of the latest batch', ['model'])
+
+
+# Text lengths (characters) run through the model before it reports ready, so lazy kernel setup is not paid by
+# real requests; the default covers a short chat reply, a typical email paragraph and a full-length message
+WARMUP_LENGTHS = tuple(
+  int(length) for length in os.getenv('LOCAL_SENTIMENT_WARMUP_LENGTHS', '16,128,512').split(',') if length.strip()
+)
+WARMUP_SAMPLE = 'お世話になっております。先日ご提案いただいた件について、社内で検討した結果をご連絡いたします。'
+
+
+def warmup(model: str = MODEL_NAME) -> float:
+  """Run one small batch per representative length on the model; returns the seconds taken."""
+  started = time.perf_counter()
+  classifier = model_pool.get(model)
+  for length in WARMUP_LENGTHS:
+    text = (WARMUP_SAMPLE * (length // len(WARMUP_SAMPLE) + 1))[:length]
+    classify_staged(classifier, [text] * 4)
+  return time.perf_counter() - started
+
+
+class StartupState:
+  """Progress of loading and warming the default model; the server is ready once both are done."""
+
+  def __init__(self) -> None:
+    self.ready = False
+    self.error: Optional[str] = None
+    self.load_seconds: Optional[float] = None
+    self.warmup_seconds: Optional[float] = None
+    self.cold_start_seconds: Optional[float] = None
+
+  @property
+  def status(self) -> str:
+    return 'ready' if self.ready else 'failed' if self.error else 'warming'
+
+  def stats(self) -> dict:
+    def seconds(value: Optional[float]) -> Optional[float]:
+      return round(value, 3) if value is not None else None
+
+    return {
+      'status': self.status,
+      'error': self.error,
+      'load_seconds': seconds(self.load_seconds),
+      'warmup_seconds': seconds(self.warmup_seconds),
+      'cold_start_seconds': seconds(self.cold_start_seconds),
+      'uptime_seconds': seconds(time.perf_counter() - SERVER_STARTED),
+    }
+
+
+startup = StartupState()
+
+
+def load_and_warm() -> None:
+  """Load the default model, warm it up and mark the server ready (runs off the event loop)."""
+  try:
+    started = time.perf_counter()
+    model_pool.get(MODEL_NAME)
+    startup.load_seconds = time.perf_counter() - started
+    startup.warmup_seconds = warmup(MODEL_NAME)
+  except Exception as exc:
+    startup.error = f'{type(exc).__name__}: {exc}'
+    print(f'❌ failed to load {MODEL_NAME}: {startup.error}', file=sys.stderr)
+    return
+  startup.cold_start_seconds = time.perf_counter() - SERVER_STARTED
+  startup.ready = True
+  print(
+    f'✅ {MODEL_NAME} ready: load {startup.load_seconds:.1f}s, warmup {startup.warmup_seconds:.1f}s, '
+    f'cold start {startup.cold_start_seconds:.1f}s',
+    file=sys.stderr,
+  )
+
+
+def preload() -> None:
+  """Prefork parent: load and warm the default model once so the workers share its weights copy-on-write."""
+  if BACKEND == 'onnx':
+    # ONNX Runtime sessions own thread pools that do not survive fork, so each worker opens its own session;
+    # export the model file here so the workers do not all export over each other on first start
+    ensure_onnx_export(MODEL_NAME)
+    return
+  # Load and warm single-threaded: an OpenMP pool started in the parent would hang in the forked workers.
+  # Import torch first so the limit applies before the load, which may already run ops on the intra-op pool.
+  import torch  # noqa: F401
+
+  set_inference_threads(1)
+  warmup(MODEL_NAME)
+
+
+def init_worker() -> None:
+  """Prefork worker: size the inference threads for this worker and warm up before accepting requests."""
+  set_inference_threads(THREADS_PER_WORKER)
+  load_and_warm()
+  if startup.error:
+    # Fail the worker during startup so serve_prefork stops instead of reporting 503-only workers as ready
+    raise RuntimeError(f'failed to load {MODEL_NAME}: {startup.error}')
+
+
+class ModelEvictedError(OverloadedError):
+  """The model was unloaded to make room for another between admission and its batch."""
+
+
+def classify_batch(model: str, texts: List[str]) -> List[list]:
+  """Run one batched classifier call on an already-resident model; returns the label scores per text.
+
+  Loading happens in ensure_loaded before requests are queued, so a cold model never holds an inference slot.
+  """
+  classifier = model_pool.get_resident(model)
+  if classifier is None:
+    raise ModelEvictedError(f'{model} was unloaded while requests were queued')
+  scores, timings = classify_staged(classifier, texts)
+  STAGE_SECONDS.observe(timings['tokenize'], stage='tokenize', model=model)
+  STAGE_SECONDS.observe(timings['forward'], stage='forward', model=model)
+  BATCH_SIZE.observe(len(texts), model=model)
+  TOKENS.inc(timings['tokens'], model=model)
+  if timings['forward'] > 0:
+    TOKENS_PER_SECOND.set(timings['tokens'] / timings['forward'], model=model)
+  return scores
+
+
+async def get_batcher(model: str) -> DynamicBatcher:
+  batcher = batchers.get(model)
+  if batcher is None:
+    batcher = DynamicBatcher(
+      lambda texts: classify_batch(model, texts),
+      max_batch_size=int(os.getenv('LOCAL_SENTIMENT_MAX_BATCH_SIZE', DEFAULT_MAX_BATCH_SIZE)),
+      max_wait_ms=float(os.getenv('LOCAL_SENTIMENT_MAX_WAIT_MS', DEFAULT_MAX_WAIT_MS)),
+      max_queue_size=int(os.getenv('LOCAL_SENTIMENT_MAX_QUEUE', DEFAULT_MAX_QUEUE_SIZE)),
+      concurrency=CONCURRENCY,
+      executor=inference_executor,
+      slots=inference_slots,
+      queue_limits=QUEUE_LIMITS,
+      aging_ms=PRIORITY_AGING_MS,
+    )
+    batchers[model] = batcher
+    await batcher.start()
+  return batcher
+
+
+def resolve_model(requested: Optional[str]) -> str:
+  model = (requested or '').strip() or MODEL_NAME
+  if not model_pool.is_allowed(model):
+    raise HTTPException(status_code=400, detail=f'model is not served here: {model} (allowed: {", ".join(ALLOWED_MODELS)})')
+  return model
+
+
+response_cache = ResponseCache(
+  max_entries=int(os.getenv('LOCAL_SENTIMENT_CACHE_SIZE', DEFAULT_MAX_ENTRIES)),
+  ttl_seconds=float(os.getenv('LOCAL_SENTIMENT_CACHE_TTL_SECONDS', DEFAULT_TTL_SECONDS)),
+)
+
+
+def collect_batchers(attribute: str):
+  return lambda: [({'model': name}, getattr(batcher, attribute)) for name, batcher in list(batchers.items())]
+
+
+metrics.gauge(
+  'sentiment_queue_depth', 'Requests waiting for a batch', ['model', 'priority'],
+  collect=lambda: [
+    ({'model': name, 'priority': priority}, queued)
+    for name, batcher in list(batchers.items())
+    for priority, queued in batcher.queued_by_priority().items()
+  ],
+)
+metrics.gauge('sentiment_active_batches', 'Batches running inference', ['model'], collect=collect_batchers('active_batches'))
+metrics.counter(
+  'sentiment_rejected_total', 'Requests shed (queue full or deadline unreachable)', ['model'],
+  collect=collect_batchers('rejected'),
+)
+metrics.counter(
+  'sentiment_expired_total', 'Requests whose deadline passed before inference', ['model'],
+  collect=collect_batchers('expired'),
+)
+metrics.counter(
+  'sentiment_cache_requests_total', 'Response cache lookups by outcome', ['result'],
+  collect=lambda: [
+    ({'result': result}, response_cache.stats()[key])
+    for result, key in (('hit', 'hits'), ('miss', 'misses'), ('coalesced', 'coalesced'))
+  ],
+)
+metrics.gauge('sentiment_cache_entries', 'Cached responses', collect=lambda: [({}, response_cache.stats()['entries'])])
+metrics.gauge(
+  'sentiment_model_load_seconds', 'Time the latest load of each model took', ['model'],
+  collect=lambda: [({'model': name}, seconds) for name, seconds in dict(model_pool.load_seconds).items()],
+)
+metrics.gauge(
+  'sentiment_model_resident_bytes', 'Estimated memory of resident models', ['model'],
+  collect=lambda: [({'model': name}, size) for name, size in model_pool.stats()['resident'].items()],
+)
+metrics.gauge('sentiment_ready', '1 once the default model is loaded and warmed', collect=lambda: [({}, int(startup.ready))])
+metrics.gauge(
+  'sentiment_cold_start_seconds', 'Time from server start until ready',
+  collect=lambda: [({}, startup.cold_start_seconds)] if startup.cold_start_seconds is not None else [],
+)
+metrics.gauge(
+  'sentiment_warmup_seconds', 'Time the warmup batches took',
+  collect=lambda: [({}, startup.warmup_seconds)] if startup.warmup_seconds is not None else [],
+)
+metrics.counter('sentiment_model_loads_total', 'Model loads', collect=lambda: [({}, model_pool.loads)])
+metrics.counter('sentiment_model_evictions_total', 'Models unloaded to stay within the memory budget',
+                collect=lambda: [({}, model_pool.evictions)])
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+  # Start accepting connections right away (health checks answer during the load); prefork workers arrive warmed
+  loading = None if startup.ready else asyncio.create_task(asyncio.to_thread(load_and_warm))
+  await get_batcher(MODEL_NAME)
+  try:
+    yield
+  finally:
+    if loading is not None and not loading.done():
+      loading.cancel()
+    for batcher in list(batchers.values()):
+      await batcher.stop()
+    inference_executor.shutdown(wait=False, cancel_futures=True)
+
+
+app = FastAPI(title='Local Sentiment API', version='1.0.0', lifespan=lifespan)
+
+
+class RequestMetricsMiddleware:
+  """Records request latency per route until the last body chunk is sent (streams included)."""
+
+  def __init__(self, app) -> None:
+    self.app = app
+
+  async def __call__(self, scope, receive, send):
+    if scope['type'] != 'http':
+      await self.app(scope, receive, send)
+      return
+    started = time.perf_counter()
+    status = 500
+
+    async def send_with_status(message):
+      nonlocal status
+      if message['type'] == 'http.response.start':
+        status = message['status']
+      await send(message)
+
+    try:
+      await self.app(scope, receive, send_with_status)
+    finally:
+      # The router records the matched route on the scope; label by its template to keep cardinality bounded
+      endpoint = getattr(scope.get('route'), 'path', 'unmatched')
+      REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint, status=str(status))
+
+
+app.add_middleware(RequestMetricsMiddleware)
+
+
+MSGPACK_MEDIA_TYPES = ('application/msgpack', 'application/x-msgpack', 'application/vnd.msgpack')
+
+
+class ResponseFormat(NamedTuple):
+  """Shape and encoding of response bodies, negotiated per request."""
+
+  compact: bool
+  binary: bool
+
+  @property
+  def name(self) -> str:
+    return 'msgpack' if self.binary else 'json'
+
+  @property
+  def media_type(self) -> str:
+    return 'application/msgpack' if self.binary else 'application/json'
+
+  def encode(self, payload) -> bytes:
+    if self.binary:
+      return msgpack.packb(payload, use_bin_type=True)
+    if orjson is not None:
+      return orjson.dumps(payload)
+    return json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def prefers_msgpack(accept: str) -> bool:
+  """True when the Accept header ranks a msgpack type at least as high as JSON."""
+  quality = {}
+  for part in accept.lower().split(','):
+    media_type, *params = [piece.strip() for piece in part.split(';')]
+    try:
+      quality[media_type] = next((float(param[2:]) for param in params if param.startswith('q=')), 1.0)
+    except ValueError:
+      continue
+  binary = max(quality.get(media_type, 0.0) for media_type in MSGPACK_MEDIA_TYPES)
+  return binary > 0 and binary >= quality.get('application/json', 0.0)
 
-app = FastAPI(title='Local Sentiment API', version='1.0.0')
+
+def negotiate(request: Request) -> ResponseFormat:
+  """`?compact=1|0` overrides LOCAL_SENTIMENT_COMPACT; msgpack is used when Accept prefers it and it is installed."""
+  compact = request.query_params.get('compact')
+  return ResponseFormat(
+    compact=COMPACT_RESPONSES if compact is None else compact.lower() in ('1', 'true', 'yes'),
+    binary=msgpack is not None and prefers_msgpack(request.headers.get('accept', '')),
+  )
+
+
+def serialize(build: Callable[[], object], model: str, response_format: ResponseFormat) -> Response:
+  """Build and encode a response body, timing both as the serialize stage (also sent back in Server-Timing)."""
+  started = time.perf_counter()
+  body = response_format.encode(build())
+  elapsed = time.perf_counter() - started
+  STAGE_SECONDS.observe(elapsed, stage='serialize', model=model)
+  RESPONSE_BYTES.inc(len(body), format=response_format.name)
+  return Response(
+    content=body,
+    media_type=response_format.media_type,
+    headers={'Server-Timing': f'serialize;dur={elapsed * 1000:.3f}', 'Vary': 'Accept'},
+  )
+
+
+def result_payload(scores: List[dict], model: str, compact: bool = False) -> dict:
+  """SentimentResponse as a plain dict (skips pydantic model construction on the hot path)."""
+  dominant = max(scores, key=lambda item: item['score'])
+  payload = {
+    'method': 'onnxruntime' if BACKEND == 'onnx' else 'transformers_pipeline',
+    'dominantEmotion': dominant['label'],
+    'confidence': float(dominant['score']),
+    'scores': [{'label': item['label'], 'score': float(item['score'])} for item in scores],
+    'provider': 'local',
+    'model': model,
+  }
+  if not compact:
+    payload['rawResult'] = {'scores': scores}
+  return payload
+
+
+class ItemOutcome(NamedTuple):
+  id: Optional[Union[str, int]]
+  scores: Optional[List[dict]] = None
+  error: Optional[str] = None
+
+
+def item_payload(outcome: ItemOutcome, model: str, compact: bool, exclude_none: bool) -> dict:
+  """SentimentBatchResult as a plain dict."""
+  payload = {
+    'id': outcome.id,
+    'result': result_payload(outcome.scores, model, compact) if outcome.scores else None,
+    'error': outcome.error,
+  }
+  if exclude_none:
+    return {key: value for key, value in payload.items() if value is not None}
+  return payload
+
+
+async def ensure_loaded(model: str) -> None:
+  """Load a cold model on the default thread pool, outside the inference slots shared by every model."""
+  if model_pool.get_resident(model) is None:
+    await asyncio.to_thread(model_pool.get, model)
+
+
+async def classify_text(
+  text: str, model: str, deadline: Optional[float] = None, priority: int = DEFAULT_PRIORITY
+) -> List[dict]:
+  """Label scores for one text: cached, joined onto an identical in-flight request, or batched.
+
+  A request that joins an in-flight duplicate still honours its own deadline, and resubmits with its own
+  deadline and priority if the duplicate missed its deadline or was shed. It waits at the duplicate's
+  priority otherwise; aging bounds how long that can be.
+  """
+  batcher = await get_batcher(model)
+  timeout = None if deadline is None else max(0.0, deadline - asyncio.get_running_loop().time())
+
+  async def compute() -> List[dict]:
+    await ensure_loaded(model)
+    try:
+      return await batcher.submit(text, deadline=deadline, priority=priority)
+    except ModelEvictedError:
+      # Evicted by another model's load after we checked: reload once and requeue
+      await ensure_loaded(model)
+      return await batcher.submit(text, deadline=deadline, priority=priority)
+
+  try:
+    return await response_cache.get_or_compute(
+      ResponseCache.key(model, text),
+      compute,
+      timeout=timeout,
+      retry_on=(DeadlineExceededError, OverloadedError),
+    )
+  except asyncio.TimeoutError as exc:
+    raise DeadlineExceededError('deadline exceeded while waiting for a duplicate request') from exc
+
+
+def request_priority(priority: Union[str, int, None], level: Optional[str], default: int) -> int:
+  """Explicit priority first, then the alert level (high / medium / low), then the endpoint default."""
+  return resolve_priority(priority if priority not in (None, '') else level, default=default)
+
+
+def resolve_deadline(deadline_ms: Optional[float]) -> Optional[float]:
+  """Turn a relative deadline in ms into an event-loop timestamp."""
+  deadline_ms = deadline_ms if deadline_ms is not None else REQUEST_TIMEOUT_MS
+  if not deadline_ms or deadline_ms <= 0:
+    return None
+  return asyncio.get_running_loop().time() + deadline_ms / 1000
+
+
+def overloaded(exc: OverloadedError) -> HTTPException:
+  # A full queue is the client's cue to back off (429); a deadline we cannot meet is a capacity problem (503)
+  status_code = 429 if isinstance(exc, QueueFullError) else 503
+  return HTTPException(
+    status_code=status_code,
+    detail=f'sentiment server is overloaded: {exc}',
+    headers={'Retry-After': str(exc.retry_after)},
+  )
+
+
+def reject_if_not_ready() -> None:
+  """503 until the default model is warmed, so early requests fail fast instead of queueing behind the load."""
+  if not startup.ready:
+    raise HTTPException(
+      status_code=503, detail=f'sentiment server is {startup.status}', headers={'Retry-After': str(STARTUP_RETRY_AFTER)}
+    )
+
+
+def reject_if_saturated(batcher: DynamicBatcher, priority: int) -> None:
+  """Fast-fail multi-item requests up front instead of failing each item."""
+  if batcher.is_full(priority):
+    raise overloaded(QueueFullError(
+      f'{PRIORITIES[priority]} priority queue is full ({batcher.queue_limits[priority]} pending)',
+      batcher.retry_after(priority),
+    ))
+
+
+def priority_or_400(priority: Union[str, int, None], level: Optional[str], default: int) -> int:
+  try:
+    return request_priority(priority, level, default)
+  except ValueError as exc:
+    raise HTTPException(status_code=400, detail=str(exc)) from exc
+
+
+async def analyze_item(
+  item_id, text: str, model: str, deadline: Optional[float] = None,
+  priority: Union[str, int, None] = None, level: Optional[str] = None, default_priority: int = BULK_PRIORITY,
+) -> ItemOutcome:
+  """Classify one batch/stream item; failures are reported on the item instead of failing the request."""
+  text = (text or '').strip()
+  if not text:
+    return ItemOutcome(item_id, error='text is required')
+  try:
+    resolved = request_priority(priority, level, default_priority)
+  except ValueError as exc:
+    return ItemOutcome(item_id, error=str(exc))
+  try:
+    scores = await classify_text(text, model, deadline, resolved)
+  except OverloadedError as exc:
+    return ItemOutcome(item_id, error=f'sentiment server is overloaded: {exc}')
+  except DeadlineExceededError as exc:
+    return ItemOutcome(item_id, error=str(exc))
+  except Exception as exc:
+    return ItemOutcome(item_id, error=f'sentiment inference failed: {exc}')
+  if not scores:
+    return ItemOutcome(item_id, error='empty result from classifier')
+  return ItemOutcome(item_id, scores)
+
+
+def stream_window(batcher: DynamicBatcher) -> int:
+  """Items in flight per batch/stream request (keeps one request from filling the queue)."""
+  return max(1, min(batcher.max_queue_size // 2, batcher.max_batch_size * 4))
 
 
 @app.post('/api/sentiment', response_model=SentimentResponse)
-async def analyze_sentiment(body: SentimentRequest):
+async def analyze_sentiment(body: SentimentRequest, request: Request):
+  """`?compact=1` drops rawResult; `Accept: application/msgpack` returns msgpack instead of JSON."""
   text = body.text.strip()
   if not text:
     raise HTTPException(status_code=400, detail='text is required')
+  model = resolve_model(body.model)
+  priority = priority_or_400(body.priority, body.level, DEFAULT_PRIORITY)
+  reject_if_not_ready()
 
   try:
-    results = classifier(text)
+    scores = await classify_text(text, model, resolve_deadline(body.deadlineMs), priority)
+  except OverloadedError as exc:
+    raise overloaded(exc) from exc
+  except DeadlineExceededError as exc:
+    raise HTTPException(status_code=504, detail=str(exc)) from exc
   except Exception as exc:
     raise HTTPException(status_code=500, detail=f'sentiment inference failed: {exc}') from exc
 
-  if not results:
+  if not scores:
     raise HTTPException(status_code=500, detail='empty result from classifier')
 
-  scores = results[0]
-  dominant = max(scores, key=lambda item: item['score'])
+  response_format = negotiate(request)
+  return serialize(lambda: result_payload(scores, model, response_format.compact), model, response_format)
+
+
+@app.post('/api/sentiment/batch', response_model=SentimentBatchResponse)
+async def analyze_sentiment_batch(body: SentimentBatchRequest, request: Request):
+  """Same `?compact=1` and msgpack negotiation as /api/sentiment; compact results also omit null fields."""
+  if len(body.items) > MAX_BATCH_ITEMS:
+    raise HTTPException(status_code=413, detail=f'at most {MAX_BATCH_ITEMS} items per request')
+  model = resolve_model(body.model)
+  default_priority = priority_or_400(body.priority, body.level, BULK_PRIORITY)
+  reject_if_not_ready()
+  batcher = await get_batcher(model)
+  reject_if_saturated(batcher, default_priority)
+
+  deadline = resolve_deadline(body.deadlineMs)
+  results: List[ItemOutcome] = []
+  window = stream_window(batcher)
+  for start in range(0, len(body.items), window):
+    chunk = body.items[start:start + window]
+    results.extend(await asyncio.gather(*(
+      analyze_item(item.id, item.text, model, deadline, item.priority, item.level, default_priority) for item in chunk
+    )))
+  response_format = negotiate(request)
+  compact = response_format.compact
+  return serialize(
+    lambda: {'results': [item_payload(outcome, model, compact, exclude_none=compact) for outcome in results]},
+    model,
+    response_format,
+  )
+
+
+class DuplexStreamingResponse(StreamingResponse):
+  """StreamingResponse that leaves receive() to the handler, which keeps reading the request body while responding."""
 
-  response = SentimentResponse(
-    method='transformers_pipeline',
-    dominantEmotion=dominant['label'],
-    confidence=float(dominant['score']),
-    scores=[SentimentScores(label=item['label'], score=float(item['score'])) for item in scores],
-    provider='local',
-    model=MODEL_NAME,
-    rawResult={'scores': scores},
+  async def __call__(self, scope, receive, send):
+    await self.stream_response(send)
+
+
+async def iter_ndjson_lines(request: Request) -> AsyncIterator[bytes]:
+  buffer = b''
+  async for chunk in request.stream():
+    buffer += chunk
+    *lines, buffer = buffer.split(b'\n')
+    for line in lines:
+      if line.strip():
+        yield line
+  if buffer.strip():
+    yield buffer
+
+
+@app.post('/api/sentiment/stream')
+async def analyze_sentiment_stream(request: Request):
+  """NDJSON in ({"id", "text"} per line), NDJSON out in input order as results become ready.
+
+  The model is selected with the `model` query parameter; a deadline for the whole
+  stream can be given in the X-Request-Deadline-Ms header. Lines may carry `priority` or
+  `level`; `?priority=` / `?level=` set the default for lines without them. With `Accept: application/msgpack`
+  the response is a stream of concatenated msgpack objects instead of NDJSON.
+  """
+  model = resolve_model(request.query_params.get('model'))
+  default_priority = priority_or_400(
+    request.query_params.get('priority'), request.query_params.get('level'), BULK_PRIORITY
   )
-  return response
+  reject_if_not_ready()
+  batcher = await get_batcher(model)
+  reject_if_saturated(batcher, default_priority)
+  header_deadline = request.headers.get('x-request-deadline-ms')
+  try:
+    deadline = resolve_deadline(float(header_deadline) if header_deadline else None)
+  except ValueError as exc:
+    raise HTTPException(status_code=400, detail='X-Request-Deadline-Ms must be a number') from exc
+
+  response_format = negotiate(request)
+  separator = b'' if response_format.binary else b'\n'
+
+  def serialize_line(outcome: ItemOutcome) -> bytes:
+    started = time.perf_counter()
+    line = response_format.encode(item_payload(outcome, model, response_format.compact, exclude_none=True)) + separator
+    STAGE_SECONDS.observe(time.perf_counter() - started, stage='serialize', model=model)
+    RESPONSE_BYTES.inc(len(line), format=response_format.name)
+    return line
+
+  async def results() -> AsyncIterator[bytes]:
+    pending = deque()
+    window = stream_window(batcher)
+    line_no = 0
+
+    async for line in iter_ndjson_lines(request):
+      line_no += 1
+      try:
+        data = json.loads(line)
+        if not isinstance(data, dict):
+          raise ValueError('expected an object')
+      except ValueError:
+        invalid = asyncio.get_running_loop().create_future()
+        invalid.set_result(ItemOutcome(None, error=f'invalid JSON on line {line_no}'))
+        pending.append(invalid)
+      else:
+        pending.append(asyncio.ensure_future(analyze_item(
+          data.get('id'), data.get('text'), model, deadline, data.get('priority'), data.get('level'), default_priority
+        )))
+
+      while len(pending) >= window:
+        yield serialize_line(await pending.popleft())
+
+    while pending:
+      yield serialize_line(await pending.popleft())
+
+  media_type = response_format.media_type if response_format.binary else 'application/x-ndjson'
+  return DuplexStreamingResponse(results(), media_type=media_type, headers={'Vary': 'Accept'})
+
+
+@app.get('/api/sentiment/stats')
+async def sentiment_stats():
+  return {
+    'model': MODEL_NAME,
+    'startup': startup.stats(),
+    'models': model_pool.stats(),
+    'cache': response_cache.stats(),
+    'batchers': {name: batcher.stats() for name, batcher in batchers.items()},
+  }
+
+
+@app.get('/healthz')
+async def healthz():
+  """Liveness: the process is serving; fails only when the default model could not be loaded."""
+  if startup.error:
+    raise HTTPException(status_code=503, detail=f'model load failed: {startup.error}')
+  return {'status': 'ok'}
+
+
+@app.get('/readyz')
+async def readyz():
+  """Readiness: 200 once the default model is loaded and warmed, 503 while warming."""
+  if not startup.ready:
+    return JSONResponse(status_code=503, content=startup.stats())
+  return startup.stats()
+
+
+@app.get('/metrics')
+async def prometheus_metrics():
+  return PlainTextResponse(metrics.render(), media_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+profilers: Dict[str, StackSampler] = {}
+
+
+@app.get('/debug/profile')
+async def sampling_profile(seconds: float = 10.0, interval_ms: float = 5.0, threads: str = 'sentiment-infer'):
+  """Sample thread stacks for a while and return them in collapsed format (flamegraph.pl / speedscope).
+
+  Only the inference threads are sampled by default; pass `threads=` (empty) to sample every thread.
+  """
+  if not PROFILER_ENABLED:
+    raise HTTPException(status_code=404, detail='profiler is disabled (set LOCAL_SENTIMENT_PROFILER=1)')
+  sampler = profilers.setdefault(threads, StackSampler(thread_prefix=threads))
+  try:
+    stacks = await asyncio.to_thread(sampler.sample, min(max(seconds, 0.1), 60.0), interval_ms / 1000)
+  except RuntimeError as exc:
+    raise HTTPException(status_code=409, detail=str(exc)) from exc
+  return PlainTextResponse(StackSampler.render_collapsed(stacks))
 
 
 if __name__ == '__main__':
   import uvicorn
 
+  port = int(os.getenv('LOCAL_SENTIMENT_PORT', '8000'))
+  if WORKERS > 1:
+    # Import under the package name so the app and model pool served are the ones preloaded here
+    from scripts import local_sentiment_server as server
+
+    sys.exit(serve_prefork(server.app, '0.0.0.0', port, WORKERS, preload=server.preload, worker_init=server.init_worker))
+
   uvicorn.run(
     'scripts.local_sentiment_server:app',
     host='0.0.0.0',
-    port=int(os.getenv('LOCAL_SENTIMENT_PORT', '8000')),
+    port=port,
     reload=False,
   )
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+メモリ予算つきのモデルプール
+
+リクエストで指定されたモデルを初回利用時に読み込み、常駐モデルの推定
+メモリ使用量の合計が予算を超えたら最も長く使われていないモデルから
+解放する。解放は読み込みの前に行い（読み込むモデルのサイズは推定値）、
+読み込み中も予算 + モデル1つ分にはならないようにする。同じモデルの同時
+読み込みは1回にまとめる。
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Optional
+
+DEFAULT_MEMORY_BUDGET_MB = 4096
+
+
+def estimate_model_bytes(classifier) -> int:
+    """分類器の重みが占めるメモリの推定値（バイト）
+
+    PyTorch はパラメータとバッファのサイズ、ONNX Runtime はモデルファイルのサイズ。
+    """
+    model = getattr(classifier, 'model', None)
+    if model is not None and hasattr(model, 'parameters'):
+        tensors = list(model.parameters()) + list(getattr(model, 'buffers', lambda: [])())
+        return sum(tensor.numel() * tensor.element_size() for tensor in tensors)
+
+    model_path = getattr(classifier, 'model_path', None)
+    if model_path is not None and Path(model_path).exists():
+        return Path(model_path).stat().st_size
+    return 0
+
+
+class ModelPool:
+    """名前でモデルを取得し、メモリ予算内で LRU 管理するプール
+
+    loader(name) がモデルを読み込み、unloader(name) が（レジストリなど）
+    プール外の参照を解放する。allowed_models を指定した場合はそれ以外を拒否する。
+    """
+
+    def __init__(
+        self,
+        loader: Callable[[str], object],
+        memory_budget_mb: float = DEFAULT_MEMORY_BUDGET_MB,
+        allowed_models: Optional[Iterable[str]] = None,
+        unloader: Optional[Callable[[str], None]] = None,
+        size_of: Callable[[object], int] = estimate_model_bytes,
+    ) -> None:
+        self.loader = loader
+        self.unloader = unloader
+        self.size_of = size_of
+        self.memory_budget = int(max(0.0, float(memory_budget_mb)) * 1024 * 1024)
+        self.allowed_models = set(allowed_models) if allowed_models else None
+        self.loads = 0
+        self.evictions = 0
+        self.load_seconds: Dict[str, float] = {}
+        # 読み込んだことのあるモデルのサイズ（解放後の再読み込み前の見積もりに使う）
+        self.known_sizes: Dict[str, int] = {}
+
+        self._models: OrderedDict[str, tuple] = OrderedDict()
+        self._loading: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def is_allowed(self, name: str) -> bool:
+        return self.allowed_models is None or name in self.allowed_models
+
+    @property
+    def resident_bytes(self) -> int:
+        with self._lock:
+            return sum(size for _, size in self._models.values())
+
+    def get_resident(self, name: str):
+        """読み込み済みならモデルを返し、未読み込み（または解放済み）なら None を返す（読み込まない）"""
+        with self._lock:
+            entry = self._models.get(name)
+            if entry is None:
+                return None
+            self._models.move_to_end(name)
+            return entry[0]
+
+    def get(self, name: str):
+        """モデルを返す（未読み込みなら読み込み、必要なら他のモデルを解放する）"""
+        if not self.is_allowed(name):
+            raise KeyError(f'model is not allowed: {name}')
+
+        with self._lock:
+            if name in self._models:
+                self._models.move_to_end(name)
+                return self._models[name][0]
+            name_lock = self._loading.setdefault(name, threading.Lock())
+
+        # 同じモデルの同時読み込みは1回にまとめる（他のモデルの利用は妨げない）
+        with name_lock:
+            with self._lock:
+                if name in self._models:
+                    self._models.move_to_end(name)
+                    return self._models[name][0]
+
+            # 読み込む分の空きを先に作る（推定サイズは前回の実測、未知なら常駐モデルの最大）
+            with self._lock:
+                evicted = self._evict_over_budget(keep=name, reserve=self.estimate_bytes(name))
+            self._unload(evicted)
+
+            started = time.perf_counter()
+            model = self.loader(name)
+            elapsed = time.perf_counter() - started
+            size = self.size_of(model)
+
+            with self._lock:
+                self._models[name] = (model, size)
+                self._loading.pop(name, None)
+                self.loads += 1
+                self.load_seconds[name] = elapsed
+                self.known_sizes[name] = size
+                # 推定より大きかった場合の調整
+                evicted = self._evict_over_budget(keep=name)
+
+        self._unload(evicted)
+        return model
+
+    def estimate_bytes(self, name: str) -> int:
+        """読み込む前のモデルサイズの見積もり（呼び出し側で _lock を保持する）"""
+        if name in self.known_sizes:
+            return self.known_sizes[name]
+        return max((size for _, size in self._models.values()), default=0)
+
+    def _unload(self, names: list) -> None:
+        if self.unloader is not None:
+            for name in names:
+                self.unloader(name)
+
+    def _evict_over_budget(self, keep: str, reserve: int = 0) -> list:
+        """常駐サイズ + reserve が予算に収まるまで古いモデルから外す（keep は残す）"""
+        evicted = []
+        total = sum(size for _, size in self._models.values()) + reserve
+        for candidate in list(self._models):
+            if total <= self.memory_budget:
+                break
+            if candidate == keep:
+                continue
+            _, size = self._models.pop(candidate)
+            total -= size
+            evicted.append(candidate)
+            self.evictions += 1
+        return evicted
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'resident': {name: size for name, (_, size) in self._models.items()},
+                'resident_bytes': sum(size for _, size in self._models.values()),
+                'memory_budget_bytes': self.memory_budget,
+                'loads': self.loads,
+                'evictions': self.evictions,
+                'load_seconds': {name: round(seconds, 3) for name, seconds in self.load_seconds.items()},
+            }
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+プロセス共有のモデルレジストリ
+
+同じチェックポイントを分析器やヘッドごとに読み込み直さないよう、重みと
+トークナイザーをプロセス内で1度だけ読み込んで共有する。
+
+- `registry.get_or_load(key, loader)`: キー単位で1度だけ loader を実行（同時読み込みも1回にまとめる）
+- `SharedEncoderModel`: 1つのエンコーダーに複数の分類ヘッドを載せ、
+  テキストごとのエンコーダー出力を1回だけ計算して全ヘッドに渡す
+"""
+
+from __future__ import annotations
+
+import threading
+from typing import Callable, Dict, Hashable, Iterable, List, Optional, Sequence
+
+DEFAULT_HEAD = 'default'
+MAX_LENGTH = 512
+
+
+class ModelRegistry:
+    """キーごとに1度だけモデルを読み込むスレッドセーフなレジストリ"""
+
+    def __init__(self) -> None:
+        self._entries: Dict[Hashable, object] = {}
+        self._loading: Dict[Hashable, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], object]):
+        with self._lock:
+            if key in self._entries:
+                return self._entries[key]
+            key_lock = self._loading.setdefault(key, threading.Lock())
+
+        # 同じキーの同時読み込みは1回にまとめる（他のキーの読み込みは妨げない）
+        with key_lock:
+            with self._lock:
+                if key in self._entries:
+                    return self._entries[key]
+            value = loader()
+            with self._lock:
+                self._entries[key] = value
+                self._loading.pop(key, None)
+            return value
+
+    def keys(self) -> List[Hashable]:
+        with self._lock:
+            return list(self._entries)
+
+    def discard(self, key: Hashable) -> None:
+        """キーの参照を手放す（他に参照が無ければモデルのメモリが解放される）"""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+# プロセス全体で共有するレジストリ
+registry = ModelRegistry()
+
+
+def _resolve_device(device):
+    import torch
+
+    if device is None or device == -1:
+        return torch.device('cpu')
+    if isinstance(device, int):
+        return torch.device(f'cuda:{device}')
+    return torch.device(device)
+
+
+class SharedEncoderModel:
+    """1つのエンコーダーを複数の分類ヘッドで共有するモデル
+
+    既定ヘッドはチェックポイントの分類器そのもの。`add_head()` で追加した
+    ヘッドは同じプーリング出力を入力に取るため、ヘッドが増えてもフォワード
+    パスは1回で済む。
+    """
+
+    def __init__(self, model_name: str, device=None) -> None:
+        import torch
+        from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+        self.model_name = model_name
+        self.device = _resolve_device(device)
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model, loading_info = AutoModelForSequenceClassification.from_pretrained(model_name, output_loading_info=True)
+        self.model = model.to(self.device)
+        self.model.eval()
+        # チェックポイントに無くランダムに初期化された重み（分類ヘッドが未学習のモデルなど）。
+        # 読み込むたびに値が変わるため、別に読み込んだモデル（ONNX エクスポートなど）とは予測が一致しない
+        self.newly_initialized = sorted(loading_info.get('missing_keys', []))
+
+        # BERT 系のようにプーリング出力を線形層で分類するモデルだけヘッドを共有できる
+        self.supports_shared_heads = isinstance(getattr(self.model, 'classifier', None), torch.nn.Linear)
+        self.heads = {DEFAULT_HEAD: (getattr(self.model, 'classifier', None), dict(self.model.config.id2label))}
+        self._lock = threading.Lock()
+
+    def add_head(self, name: str, id2label: Optional[Dict[int, str]] = None) -> None:
+        """エンコーダーを共有する分類ヘッドを追加する（既にあれば何もしない）"""
+        import torch
+
+        with self._lock:
+            if name in self.heads:
+                return
+            if not self.supports_shared_heads:
+                raise NotImplementedError(f'{self.model_name} does not support shared classification heads')
+
+            id2label = dict(id2label or self.model.config.id2label)
+            head = torch.nn.Linear(self.model.config.hidden_size, len(id2label))
+            self.model._init_weights(head)
+            head.to(self.device).eval()
+            self.heads[name] = (head, id2label)
+
+    def classify(
+        self,
+        texts: Sequence[str],
+        heads: Optional[Iterable[str]] = None,
+        batch_size: int = 16,
+        truncation: bool = True,
+    ) -> Dict[str, List[List[dict]]]:
+        """各ヘッドについてテキストごとの全ラベルのスコアを返す"""
+        import torch
+
+        heads = list(heads or [DEFAULT_HEAD])
+        outputs = {name: [] for name in heads}
+        batch_size = max(1, int(batch_size))
+
+        with torch.inference_mode():
+            for start in range(0, len(texts), batch_size):
+                features = self.tokenizer(
+                    list(texts[start:start + batch_size]),
+                    padding=True,
+                    truncation=truncation,
+                    max_length=MAX_LENGTH,
+                    return_tensors='pt',
+                ).to(self.device)
+
+                if self.supports_shared_heads:
+                    encoded = self.model.base_model(**features)
+                    pooled = getattr(encoded, 'pooler_output', None)
+                    if pooled is None:
+                        pooled = encoded.last_hidden_state[:, 0]
+                    logits_by_head = {name: self.heads[name][0](pooled) for name in heads}
+                else:
+                    logits_by_head = {DEFAULT_HEAD: self.model(**features).logits}
+
+                for name in heads:
+                    id2label = self.heads[name][1]
+                    for probs in logits_by_head[name].softmax(dim=-1).tolist():
+                        outputs[name].append(
+                            [{'label': id2label[i], 'score': float(p)} for i, p in enumerate(probs)]
+                        )
+
+        return outputs
+
+
+def get_shared_model(model_name: str, device=None) -> SharedEncoderModel:
+    """プロセス共有の SharedEncoderModel を取得する（初回のみ読み込み）"""
+    return registry.get_or_load(
+        ('pytorch', model_name, str(_resolve_device(device))),
+        lambda: SharedEncoderModel(model_name, device=device),
+    )
@@ -2,29 +2,59 @@
 # -*- coding: utf-8 -*-
 
 import sys
-import json
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+# 起動時間の計測（重い import より前に開始する）
+from scripts.startup_timer import StartupTimer
+
+_startup_timer = StartupTimer()
+
+import argparse
 import time
-from transformers import pipeline
-import torch
+
+from scripts.inference_backend import DEFAULT_BACKEND, load_classifier
+from scripts.model_registry import DEFAULT_HEAD, get_shared_model
+from scripts.stdin_worker import add_worker_arguments, run_stdin_worker
+
+_startup_timer.imports_done()
+
+MODEL_NAME = "cl-tohoku/bert-base-japanese-v3"
+EMOTION_HEAD = 'emotion'
+
+def top_label(scores):
+    """全ラベルのスコアから最上位の1件を pipeline の出力形式（1要素のリスト）で返す"""
+    return [max(scores, key=lambda item: item['score'])]
 
 class JapaneseSentimentAnalyzer:
-    def __init__(self):
-        """軽量日本語感情分析器の初期化"""
+    def __init__(self, backend=None):
+        """軽量日本語感情分析器の初期化（モデルは最初の分析時に読み込む）"""
+        self.backend = backend or DEFAULT_BACKEND
+        self.shared_model = None
+        self.classifier = None
+    
+    def load_model(self):
+        """モデルを読み込む（読み込み済みなら何もしない）"""
+        if self.shared_model is not None or self.classifier is not None:
+            return
+        
         print("🤖 日本語感情分析モデルを読み込み中...", file=sys.stderr)
         
         try:
-            # 軽量日本語モデル読み込み
-            self.sentiment_analyzer = pipeline(
-                "sentiment-analysis",
-                model="cl-tohoku/bert-base-japanese-v3",
-                device=0 if torch.cuda.is_available() else -1
-            )
-            
-            # 感情カテゴリ分類器（カスタム）
-            self.emotion_classifier = pipeline(
-                "text-classification",
-                model="cl-tohoku/bert-base-japanese-v3"
-            )
+            if self.backend == 'pytorch':
+                import torch
+                
+                # 感情分析と感情カテゴリ分類は同じエンコーダーを共有し、
+                # テキストごとのフォワードパスを1回にまとめる
+                self.shared_model = get_shared_model(
+                    MODEL_NAME,
+                    device=0 if torch.cuda.is_available() else -1
+                )
+                self.shared_model.add_head(EMOTION_HEAD)
+            else:
+                # ONNX グラフは分類ヘッドが1つなので、両方の判定に同じ出力を使う
+                self.classifier = load_classifier(MODEL_NAME, backend=self.backend, return_all_scores=True)
             
             print("✅ モデルの読み込み完了！", file=sys.stderr)
             
@@ -32,6 +62,44 @@ class JapaneseSentimentAnalyzer:
             print(f"❌ モデルの読み込みに失敗: {e}", file=sys.stderr)
             raise
     
+    def classify_batch(self, processed_texts):
+        """複数テキストの感情分析と感情カテゴリ分類の最上位ラベルを1回のバッチ推論で返す"""
+        self.load_model()
+        batch_size = max(1, len(processed_texts))
+        
+        if self.shared_model is not None:
+            outputs = self.shared_model.classify(
+                processed_texts, heads=(DEFAULT_HEAD, EMOTION_HEAD), batch_size=batch_size
+            )
+            sentiment_scores = outputs[DEFAULT_HEAD]
+            emotion_scores = outputs[EMOTION_HEAD]
+        else:
+            sentiment_scores = emotion_scores = self.classifier(list(processed_texts), batch_size=batch_size)
+        
+        return [
+            (top_label(sentiment), top_label(emotion))
+            for sentiment, emotion in zip(sentiment_scores, emotion_scores)
+        ]
+    
+    def classify(self, processed_text):
+        """感情分析と感情カテゴリ分類の最上位ラベルを返す"""
+        return self.classify_batch([processed_text])[0]
+    
+    def build_result(self, text, processed_text, sentiment_result, emotion_result, processing_time):
+        """分類結果を出力形式にまとめる"""
+        return {
+            'sentiment': sentiment_result[0]['label'],
+            'sentiment_confidence': float(sentiment_result[0]['score']),
+            'emotion': emotion_result[0]['label'],
+            'emotion_confidence': float(emotion_result[0]['score']),
+            'text_length': len(text),
+            'processed_text_length': len(processed_text),
+            'processing_time_ms': int(processing_time),
+            'processed': True,
+            'model_version': MODEL_NAME,
+            'timestamp': time.time()
+        }
+    
     def analyze(self, text):
         """テキストの感情分析を実行"""
         start_time = time.time()
@@ -40,30 +108,14 @@ class JapaneseSentimentAnalyzer:
             # テキストの前処理（長さ制限）
             processed_text = text[:512] if len(text) > 512 else text
             
-            # 基本感情分析
-            sentiment_result = self.sentiment_analyzer(processed_text)
-            
-            # 感情カテゴリ分類
-            emotion_result = self.emotion_classifier(processed_text)
+            # 基本感情分析 + 感情カテゴリ分類（1回のフォワードパス）
+            sentiment_result, emotion_result = self.classify(processed_text)
             
             # 処理時間計算
             processing_time = (time.time() - start_time) * 1000
             
             # 結果統合
-            result = {
-                'sentiment': sentiment_result[0]['label'],
-                'sentiment_confidence': float(sentiment_result[0]['score']),
-                'emotion': emotion_result[0]['label'],
-                'emotion_confidence': float(emotion_result[0]['score']),
-                'text_length': len(text),
-                'processed_text_length': len(processed_text),
-                'processing_time_ms': int(processing_time),
-                'processed': True,
-                'model_version': 'cl-tohoku/bert-base-japanese-v3',
-                'timestamp': time.time()
-            }
-            
-            return result
+            return self.build_result(text, processed_text, sentiment_result, emotion_result, processing_time)
             
         except Exception as e:
             return {
@@ -73,48 +125,52 @@ class JapaneseSentimentAnalyzer:
             }
     
     def analyze_batch(self, texts):
-        """複数テキストの一括感情分析"""
-        results = []
+        """複数テキストの一括感情分析（1回のバッチ推論）
+        
+        processing_time_ms はバッチ全体の処理時間（各リクエストが待った時間）。
+        バッチ推論に失敗した場合は1件ずつ分析し直し、失敗を該当テキストに限定する。
+        """
+        start_time = time.time()
+        processed_texts = [text[:512] if len(text) > 512 else text for text in texts]
         
-        for i, text in enumerate(texts):
-            print(f"📝 テキスト {i+1}/{len(texts)} を処理中...", file=sys.stderr)
-            result = self.analyze(text)
-            results.append(result)
+        try:
+            classified = self.classify_batch(processed_texts)
+        except Exception as e:
+            print(f"⚠️ バッチ推論に失敗したため1件ずつ処理します: {e}", file=sys.stderr)
+            return [self.analyze(text) for text in texts]
         
-        return results
+        processing_time = (time.time() - start_time) * 1000
+        return [
+            self.build_result(text, processed_text, sentiment_result, emotion_result, processing_time)
+            for text, processed_text, (sentiment_result, emotion_result)
+            in zip(texts, processed_texts, classified)
+        ]
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='日本語感情分析器（標準入力の NDJSON を処理）')
+    add_worker_arguments(parser)
+    # 既存の呼び出し元が渡す位置引数は無視する
+    args, _ = parser.parse_known_args(argv)
+    return args
 
 def main():
     """メイン処理"""
+    args = parse_args()
     analyzer = JapaneseSentimentAnalyzer()
+    # 常駐ワーカーでは入力を待つ前に読み込む（呼び出し側は「モデルの読み込み完了」を
+    # 初期化完了の合図にしており、最初のリクエストに読み込み時間を持ち込まない）
+    analyzer.load_model()
+    _startup_timer.report()
     
     print("🚀 日本語感情分析器が起動しました", file=sys.stderr)
     print("📝 標準入力からテキストを受け取ります", file=sys.stderr)
     
-    # 標準入力からテキスト読み込み
-    for line in sys.stdin:
-        try:
-            data = json.loads(line.strip())
-            text = data.get('text', '')
-            
-            if not text:
-                continue
-            
-            # 感情分析実行
-            result = analyzer.analyze(text)
-            
-            # 結果を標準出力に出力
-            print(json.dumps(result, ensure_ascii=False))
-            sys.stdout.flush()
-            
-        except json.JSONDecodeError:
-            print("❌ JSON形式が無効です", file=sys.stderr)
-            continue
-        except KeyboardInterrupt:
-            print("\n👋 処理を終了します", file=sys.stderr)
-            break
-        except Exception as e:
-            print(f"❌ 予期しないエラー: {e}", file=sys.stderr)
-            continue
+    # 短時間に届いた行をまとめて1回のバッチ推論で処理する
+    run_stdin_worker(
+        analyzer.analyze_batch,
+        batch_window_ms=args.batch_window_ms,
+        max_batch_size=args.max_batch_size,
+    )
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
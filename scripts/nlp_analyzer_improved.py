@@ -2,127 +2,158 @@
 # -*- coding: utf-8 -*-
 
 import sys
-import json
-import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+# 起動時間の計測（重い import より前に開始する）
+from scripts.startup_timer import StartupTimer
+
+_startup_timer = StartupTimer()
+
+import argparse
 import re
-from transformers import pipeline
-import torch
+import time
+
+from scripts.analysis_cache import DEFAULT_MEMORY_ENTRIES, AnalysisCache
+from scripts.lexicon_matcher import build_lexicon
+from scripts.phrase_dictionary import PhraseDictionary
+from scripts.stdin_worker import add_worker_arguments, run_stdin_worker
+
+_startup_timer.imports_done()
+
+MODEL_VERSION = 'cl-tohoku/bert-base-japanese-v3-improved'
+
+# 辞書カテゴリ別の重み（未定義のカテゴリは 1.0）
+CATEGORY_WEIGHTS = {
+    '強いネガティブ': 3.0,
+    '中程度ネガティブ': 2.0,
+    '軽微ネガティブ': 1.0,
+    '緊急・危機': 2.5,
+    '強いポジティブ': 3.0,
+    '中程度ポジティブ': 2.0,
+    '軽微ポジティブ': 1.0,
+}
 
 class ImprovedJapaneseSentimentAnalyzer:
-    def __init__(self):
-        """改善された日本語感情分析器の初期化"""
-        print("🤖 改善された日本語感情分析モデルを読み込み中...", file=sys.stderr)
+    def __init__(self, cache=None, lexicon_only=False, dictionary_path=None, dictionary_check_interval=5.0):
+        """改善された日本語感情分析器の初期化
+
+        analyze() はパターンベースのためモデルは初回アクセス時まで読み込まない。
+        lexicon_only=True ではモデル（torch / transformers）を一切使わない。
+        dictionary_path を指定すると、組み込み辞書にその辞書 CSV のフレーズを加え、
+        ファイルの変更を検知して再起動なしで差し替える。
+        """
+        print("🤖 改善された日本語感情分析器を初期化中...", file=sys.stderr)
         
-        try:
-            # 軽量日本語モデル読み込み
-            self.sentiment_analyzer = pipeline(
-                "sentiment-analysis",
-                model="cl-tohoku/bert-base-japanese-v3",
-                device=0 if torch.cuda.is_available() else -1
+        # パターン分析結果のキャッシュ（AnalysisCache、Noneなら無効）
+        self.cache = cache
+        
+        # 辞書のみで動作するモード
+        self.lexicon_only = lexicon_only
+        self._sentiment_analyzer = None
+        
+        # ネガティブ判定用の辞書
+        self.negative_patterns = {
+            '強いネガティブ': [
+                '最悪', '絶望', '破滅', '崩壊', '破綻', '失敗', '大失敗',
+                '二度と', '絶対に', '決して', '返金', '解約', 'キャンセル',
+                '怒り', '激怒', '憤り', '憎しみ', '恨み', '復讐'
+            ],
+            '中程度ネガティブ': [
+                '悪い', '良くない', '期待外れ', 'がっかり', '失望',
+                '不満', '問題', '困った', '困っています', '改善',
+                '対応', '解決', '謝罪', '申し訳', 'すみません'
+            ],
+            '軽微ネガティブ': [
+                '普通', '特に', '思わない', '期待していたほど',
+                '微妙', 'イマイチ', '普通以下', '平均的'
+            ],
+            '緊急・危機': [
+                '緊急', '至急', '急ぎ', '早急', 'すぐ', '今すぐ',
+                '期限', '締切', '納期', '間に合わない', '遅れる',
+                'トラブル', '障害', '停止', 'ダウン', 'エラー'
+            ]
+        }
+        
+        # ポジティブ判定用の辞書
+        self.positive_patterns = {
+            '強いポジティブ': [
+                '素晴らしい', '完璧', '最高', '最高級', '最高品質',
+                '感動', '感激', '感激', '感激', '感激',
+                '愛してる', '大好き', '最高', '完璧'
+            ],
+            '中程度ポジティブ': [
+                '良い', '優秀', '満足', '喜び', '嬉しい',
+                '楽しい', '期待', '希望', '成功', '達成',
+                '完了', '承知', '了解', '承諾', '承認'
+            ],
+            '軽微ポジティブ': [
+                'まあまあ', '悪くない', '普通以上', '期待通り',
+                '安心', '信頼', '頼もしい', '心強い'
+            ]
+        }
+        
+        # 全辞書を1つの重み付きマッチャーにコンパイル（重複語は1エントリにまとめる）
+        self.builtin_lexicon = build_lexicon(
+            {'negative': self.negative_patterns, 'positive': self.positive_patterns},
+            CATEGORY_WEIGHTS,
+        )
+        
+        # 外部の辞書 CSV（ホットリロード対応）
+        self.dictionary = None
+        if dictionary_path:
+            self.dictionary = PhraseDictionary(
+                dictionary_path,
+                base_entries=self.builtin_lexicon.entries,
+                check_interval=dictionary_check_interval,
             )
-            
-            print("✅ モデルの読み込み完了！", file=sys.stderr)
-            
-            # ネガティブ判定用の辞書
-            self.negative_patterns = {
-                '強いネガティブ': [
-                    '最悪', '絶望', '破滅', '崩壊', '破綻', '失敗', '大失敗',
-                    '二度と', '絶対に', '決して', '返金', '解約', 'キャンセル',
-                    '怒り', '激怒', '憤り', '憎しみ', '恨み', '復讐'
-                ],
-                '中程度ネガティブ': [
-                    '悪い', '良くない', '期待外れ', 'がっかり', '失望',
-                    '不満', '問題', '困った', '困っています', '改善',
-                    '対応', '解決', '謝罪', '申し訳', 'すみません'
-                ],
-                '軽微ネガティブ': [
-                    '普通', '特に', '思わない', '期待していたほど',
-                    '微妙', 'イマイチ', '普通以下', '平均的'
-                ],
-                '緊急・危機': [
-                    '緊急', '至急', '急ぎ', '早急', 'すぐ', '今すぐ',
-                    '期限', '締切', '納期', '間に合わない', '遅れる',
-                    'トラブル', '障害', '停止', 'ダウン', 'エラー'
-                ]
-            }
-            
-            # ポジティブ判定用の辞書
-            self.positive_patterns = {
-                '強いポジティブ': [
-                    '素晴らしい', '完璧', '最高', '最高級', '最高品質',
-                    '感動', '感激', '感激', '感激', '感激',
-                    '愛してる', '大好き', '最高', '完璧'
-                ],
-                '中程度ポジティブ': [
-                    '良い', '優秀', '満足', '喜び', '嬉しい',
-                    '楽しい', '期待', '希望', '成功', '達成',
-                    '完了', '承知', '了解', '承諾', '承認'
-                ],
-                '軽微ポジティブ': [
-                    'まあまあ', '悪くない', '普通以上', '期待通り',
-                    '安心', '信頼', '頼もしい', '心強い'
-                ]
-            }
-            
-        except Exception as e:
-            print(f"❌ モデルの読み込みに失敗: {e}", file=sys.stderr)
-            raise
+        
+    @property
+    def lexicon(self):
+        """現在のマッチャー（辞書 CSV 使用時は更新があれば差し替わる）"""
+        if self.dictionary is not None:
+            return self.dictionary.current()
+        return self.builtin_lexicon
+        
+    @property
+    def sentiment_analyzer(self):
+        """BERTパイプライン（初回アクセス時に読み込む）"""
+        if self.lexicon_only:
+            raise RuntimeError('lexicon-only モードではモデルを使用できません')
+        
+        if self._sentiment_analyzer is None:
+            print("🤖 日本語感情分析モデルを読み込み中...", file=sys.stderr)
+            try:
+                import torch
+                from scripts.inference_backend import load_classifier
+                
+                # 軽量日本語モデル読み込み
+                self._sentiment_analyzer = load_classifier(
+                    "cl-tohoku/bert-base-japanese-v3",
+                    device=0 if torch.cuda.is_available() else -1
+                )
+                print("✅ モデルの読み込み完了！", file=sys.stderr)
+            except Exception as e:
+                print(f"❌ モデルの読み込みに失敗: {e}", file=sys.stderr)
+                raise
+        
+        return self._sentiment_analyzer
+    
+    def analyze_lexicon(self, text, lexicon=None):
+        """1回の走査でネガティブ/ポジティブ両方のスコアとヒットを求める"""
+        results = (lexicon or self.lexicon).analyze(text)
+        negative_score, negative_patterns = results.get('negative', (0, []))
+        positive_score, positive_patterns = results.get('positive', (0, []))
+        return negative_score, negative_patterns, positive_score, positive_patterns
     
     def analyze_negative_patterns(self, text):
         """ネガティブパターンの詳細分析"""
-        negative_score = 0
-        detected_patterns = []
-        
-        for category, patterns in self.negative_patterns.items():
-            for pattern in patterns:
-                if pattern in text:
-                    # カテゴリ別の重み付け
-                    if category == '強いネガティブ':
-                        weight = 3.0
-                    elif category == '中程度ネガティブ':
-                        weight = 2.0
-                    elif category == '軽微ネガティブ':
-                        weight = 1.0
-                    elif category == '緊急・危機':
-                        weight = 2.5
-                    else:
-                        weight = 1.0
-                    
-                    negative_score += weight
-                    detected_patterns.append({
-                        'pattern': pattern,
-                        'category': category,
-                        'weight': weight
-                    })
-        
-        return negative_score, detected_patterns
+        return self.lexicon.analyze(text).get('negative', (0, []))
     
     def analyze_positive_patterns(self, text):
         """ポジティブパターンの詳細分析"""
-        positive_score = 0
-        detected_patterns = []
-        
-        for category, patterns in self.positive_patterns.items():
-            for pattern in patterns:
-                if pattern in text:
-                    # カテゴリ別の重み付け
-                    if category == '強いポジティブ':
-                        weight = 3.0
-                    elif category == '中程度ポジティブ':
-                        weight = 2.0
-                    elif category == '軽微ポジティブ':
-                        weight = 1.0
-                    else:
-                        weight = 1.0
-                    
-                    positive_score += weight
-                    detected_patterns.append({
-                        'pattern': pattern,
-                        'category': category,
-                        'weight': weight
-                    })
-        
-        return positive_score, detected_patterns
+        return self.lexicon.analyze(text).get('positive', (0, []))
     
     def determine_sentiment(self, negative_score, positive_score):
         """感情の決定ロジック"""
@@ -152,7 +183,23 @@ class ImprovedJapaneseSentimentAnalyzer:
         
         return sentiment, confidence
     
-    def analyze(self, text):
+    def analyze_patterns(self, text, lexicon=None):
+        """パターンベースの感情判定（キャッシュ対象の部分）"""
+        negative_score, negative_patterns, positive_score, positive_patterns = self.analyze_lexicon(text, lexicon)
+        
+        # 感情の決定
+        sentiment, confidence = self.determine_sentiment(negative_score, positive_score)
+        
+        return {
+            'sentiment': sentiment,
+            'sentiment_confidence': round(confidence, 3),
+            'negative_score': negative_score,
+            'positive_score': positive_score,
+            'negative_patterns': negative_patterns,
+            'positive_patterns': positive_patterns
+        }
+    
+    def analyze(self, text, lexicon=None):
         """テキストの感情分析を実行"""
         start_time = time.time()
         
@@ -160,29 +207,31 @@ class ImprovedJapaneseSentimentAnalyzer:
             # テキストの前処理（長さ制限）
             processed_text = text[:512] if len(text) > 512 else text
             
-            # パターンベース分析
-            negative_score, negative_patterns = self.analyze_negative_patterns(text)
-            positive_score, positive_patterns = self.analyze_positive_patterns(text)
+            # 1件の分析中に辞書が差し替わっても混ざらないよう、マッチャーを固定する
+            lexicon = lexicon or self.lexicon
             
-            # 感情の決定
-            sentiment, confidence = self.determine_sentiment(negative_score, positive_score)
+            # パターンベース分析（同一本文・同一辞書バージョンはキャッシュから再利用）
+            if self.cache is not None:
+                pattern_result = self.cache.get_or_compute(
+                    text,
+                    lambda: self.analyze_patterns(text, lexicon),
+                    namespace=f'lexicon:{lexicon.version}',
+                )
+            else:
+                pattern_result = self.analyze_patterns(text, lexicon)
             
             # 処理時間計算
             processing_time = (time.time() - start_time) * 1000
             
             # 結果統合
             result = {
-                'sentiment': sentiment,
-                'sentiment_confidence': round(confidence, 3),
-                'negative_score': negative_score,
-                'positive_score': positive_score,
-                'negative_patterns': negative_patterns,
-                'positive_patterns': positive_patterns,
+                **pattern_result,
                 'text_length': len(text),
                 'processed_text_length': len(processed_text),
                 'processing_time_ms': int(processing_time),
                 'processed': True,
-                'model_version': 'cl-tohoku/bert-base-japanese-v3-improved',
+                'model_version': MODEL_VERSION,
+                'lexicon_version': lexicon.version,
                 'timestamp': time.time(),
                 'analysis_method': 'pattern_based'
             }
@@ -197,48 +246,48 @@ class ImprovedJapaneseSentimentAnalyzer:
             }
     
     def analyze_batch(self, texts):
-        """複数テキストの一括感情分析"""
-        results = []
-        
-        for i, text in enumerate(texts):
-            print(f"📝 テキスト {i+1}/{len(texts)} を処理中...", file=sys.stderr)
-            result = self.analyze(text)
-            results.append(result)
-        
-        return results
+        """複数テキストの一括感情分析（バッチ内は同じ辞書バージョンで判定）"""
+        lexicon = self.lexicon
+        return [self.analyze(text, lexicon) for text in texts]
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='改善された日本語感情分析器')
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_MEMORY_ENTRIES,
+                        help='分析結果のメモリキャッシュ件数（0で無効）')
+    parser.add_argument('--cache-db', default=None,
+                        help='分析結果のディスクキャッシュ（SQLiteファイルのパス）')
+    parser.add_argument('--lexicon-only', action='store_true',
+                        help='辞書のみで分析し、torch / transformers を読み込まない')
+    parser.add_argument('--dictionary', default=None,
+                        help='追加するフレーズ辞書 CSV（変更は再起動なしで反映）')
+    parser.add_argument('--dictionary-check-interval', type=float, default=5.0,
+                        help='辞書 CSV の変更を確認する間隔（秒）')
+    add_worker_arguments(parser)
+    return parser.parse_args(argv)
 
 def main():
     """メイン処理"""
-    analyzer = ImprovedJapaneseSentimentAnalyzer()
+    args = parse_args()
+    cache = None
+    if args.cache_size > 0 or args.cache_db:
+        cache = AnalysisCache(MODEL_VERSION, max_entries=args.cache_size, disk_path=args.cache_db)
+    analyzer = ImprovedJapaneseSentimentAnalyzer(
+        cache=cache,
+        lexicon_only=args.lexicon_only,
+        dictionary_path=args.dictionary,
+        dictionary_check_interval=args.dictionary_check_interval,
+    )
+    _startup_timer.report()
     
     print("🚀 改善された日本語感情分析器が起動しました", file=sys.stderr)
     print("📝 標準入力からテキストを受け取ります", file=sys.stderr)
     
-    # 標準入力からテキスト読み込み
-    for line in sys.stdin:
-        try:
-            data = json.loads(line.strip())
-            text = data.get('text', '')
-            
-            if not text:
-                continue
-            
-            # 感情分析実行
-            result = analyzer.analyze(text)
-            
-            # 結果を標準出力に出力
-            print(json.dumps(result, ensure_ascii=False))
-            sys.stdout.flush()
-            
-        except json.JSONDecodeError:
-            print("❌ JSON形式が無効です", file=sys.stderr)
-            continue
-        except KeyboardInterrupt:
-            print("\n👋 処理を終了します", file=sys.stderr)
-            break
-        except Exception as e:
-            print(f"❌ 予期しないエラー: {e}", file=sys.stderr)
-            continue
+    # 短時間に届いた行をまとめて処理し、書き込みと flush をバッチ単位にする
+    run_stdin_worker(
+        analyzer.analyze_batch,
+        batch_window_ms=args.batch_window_ms,
+        max_batch_size=args.max_batch_size,
+    )
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+フレーズ辞書 CSV の読み込みとホットリロード
+
+`data/samples/dictionary_sample.csv` と同じスキーマ
+（phrase, category, weight, locale, enabled, updated_at、任意で polarity）の
+CSV から CompiledLexicon を作る。常駐プロセスではファイルの変更を検知して
+新しいマッチャーをアトミックに差し替えるため、キーワードの追加・変更に
+再デプロイやワーカーの再起動（モデルの再読み込み）は不要。
+
+- 変更検知は mtime/サイズで行い、内容のハッシュが変わったときだけ再コンパイルする
+- 差し替えは参照の付け替えのみ。読み取り側は `current()` で得たマッチャーを
+  1件の処理のあいだ使い続ければ、途中で辞書が混ざることはない
+- 読み込みに失敗した場合は直前の辞書を使い続ける
+"""
+
+from __future__ import annotations
+
+import csv
+import hashlib
+import io
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Iterable, List, Optional
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from scripts.lexicon_matcher import CompiledLexicon, LexiconEntry
+
+DEFAULT_DICTIONARY_PATH = Path(__file__).parent.parent / 'data' / 'samples' / 'dictionary_sample.csv'
+DEFAULT_POLARITY = 'negative'
+DEFAULT_CHECK_INTERVAL = 5.0
+
+_TRUE_VALUES = {'true', '1', 'yes', 'y', 't'}
+
+
+def parse_dictionary_csv(
+    content: str,
+    locale: Optional[str] = None,
+    default_polarity: str = DEFAULT_POLARITY,
+) -> List[LexiconEntry]:
+    """辞書 CSV の本文を LexiconEntry のリストにする
+
+    enabled が偽の行と、locale 指定時に一致しない行は除く。
+    polarity 列が無い場合は default_polarity を使う。
+    """
+    entries = []
+    for line_no, row in enumerate(csv.DictReader(io.StringIO(content)), start=2):
+        phrase = (row.get('phrase') or '').strip()
+        if not phrase:
+            continue
+        if (row.get('enabled') or 'true').strip().lower() not in _TRUE_VALUES:
+            continue
+        if locale and (row.get('locale') or '').strip() not in ('', locale):
+            continue
+        try:
+            weight = float(row.get('weight') or 1.0)
+        except ValueError as exc:
+            raise ValueError(f'invalid weight on line {line_no}: {row.get("weight")!r}') from exc
+
+        entries.append(LexiconEntry(
+            phrase,
+            (row.get('category') or '').strip(),
+            weight,
+            (row.get('polarity') or default_polarity).strip(),
+        ))
+    return entries
+
+
+class PhraseDictionary:
+    """辞書 CSV から作ったマッチャーを保持し、ファイル変更時に差し替える
+
+    base_entries はコードに組み込んだ辞書で、CSV のエントリより前に並ぶ。
+    """
+
+    def __init__(
+        self,
+        path,
+        base_entries: Iterable[LexiconEntry] = (),
+        locale: Optional[str] = None,
+        default_polarity: str = DEFAULT_POLARITY,
+        check_interval: float = DEFAULT_CHECK_INTERVAL,
+    ) -> None:
+        self.path = Path(path)
+        self.base_entries = list(base_entries)
+        self.locale = locale
+        self.default_polarity = default_polarity
+        self.check_interval = max(0.0, float(check_interval))
+        self.reloads = 0
+        self.last_error: Optional[str] = None
+
+        self._lock = threading.Lock()
+        self._stat = None
+        self._content_hash = None
+        self._next_check = 0.0
+        self._lexicon: Optional[CompiledLexicon] = None
+
+        # 初回の読み込み失敗は起動時に知らせる
+        self._load(self._read())
+
+    @property
+    def version(self) -> str:
+        return self._lexicon.version
+
+    def current(self) -> CompiledLexicon:
+        """現在のマッチャーを返す（check_interval ごとにファイルの変更を確認）"""
+        if time.monotonic() >= self._next_check:
+            self.maybe_reload()
+        return self._lexicon
+
+    def maybe_reload(self) -> bool:
+        """ファイルが変わっていれば読み込み直す。マッチャーを差し替えたら True"""
+        # 同時に確認するのは1スレッドだけ（他は現在の辞書をそのまま使う）
+        if not self._lock.acquire(blocking=False):
+            return False
+        try:
+            self._next_check = time.monotonic() + self.check_interval
+            try:
+                stat = self._file_stat()
+                if stat == self._stat:
+                    return False
+                return self._load(self._read())
+            except (OSError, ValueError) as exc:
+                self.last_error = str(exc)
+                print(f"⚠️ 辞書の再読み込みに失敗（現在の辞書を継続使用）: {exc}", file=sys.stderr)
+                return False
+        finally:
+            self._lock.release()
+
+    def stats(self) -> dict:
+        return {
+            'path': str(self.path),
+            'version': self.version,
+            'entries': len(self._lexicon.entries),
+            'reloads': self.reloads,
+            'last_error': self.last_error,
+        }
+
+    def _file_stat(self):
+        stat = os.stat(self.path)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _read(self):
+        stat = self._file_stat()
+        return stat, self.path.read_bytes()
+
+    def _load(self, snapshot) -> bool:
+        stat, raw = snapshot
+        self._stat = stat
+        content_hash = hashlib.sha256(raw).hexdigest()
+        if content_hash == self._content_hash:
+            # touch されただけ等、内容が同じなら再コンパイルしない
+            return False
+
+        entries = parse_dictionary_csv(
+            raw.decode('utf-8-sig'), locale=self.locale, default_polarity=self.default_polarity
+        )
+        lexicon = CompiledLexicon(self.base_entries + entries)
+
+        replaced = self._lexicon is not None
+        self._lexicon = lexicon
+        self._content_hash = content_hash
+        self.last_error = None
+        if replaced:
+            self.reloads += 1
+            print(f"🔄 辞書を更新しました: {self.path.name} (version {lexicon.version}, "
+                  f"{len(lexicon.entries)} entries)", file=sys.stderr)
+        return replaced
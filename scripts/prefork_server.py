@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+事前読み込み + fork によるマルチワーカー起動
+
+親プロセスでモデルを読み込んでウォームアップしてから待ち受けソケットを作り、
+N 個のワーカーを fork する。重みのページは copy-on-write で共有されるため、
+ワーカーを増やしてもモデルのメモリはほぼ1プロセス分で済む。
+
+- ワーカーごとに推論スレッド数を設定してからウォームアップし、終わってから受け付けを始める
+- 全ワーカーのウォームアップが終わった時点で親が ready を出力する
+- 落ちたワーカーは親が fork し直す（読み込み済みの重みを引き継ぐので速い）
+- SIGTERM / SIGINT は全ワーカーに転送し、終了を待つ
+"""
+
+from __future__ import annotations
+
+import gc
+import os
+import select
+import signal
+import socket
+import sys
+import time
+import traceback
+from typing import Callable, Dict
+
+# 親がウォームアップを終えてから準備完了を待つ上限
+DEFAULT_READY_TIMEOUT = 600.0
+
+
+def default_threads_per_worker(workers: int) -> int:
+    """コア数をワーカーで割った推論スレッド数（1以上）"""
+    return max(1, (os.cpu_count() or 1) // max(1, workers))
+
+
+def set_inference_threads(num_threads: int) -> None:
+    """このプロセスの PyTorch の演算スレッド数を設定する（torch を読み込んでいなければ何もしない）"""
+    torch = sys.modules.get('torch')
+    if torch is not None:
+        torch.set_num_threads(max(1, int(num_threads)))
+
+
+def _listen(host: str, port: int, backlog: int = 2048) -> socket.socket:
+    family = socket.AF_INET6 if ':' in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def serve_prefork(
+    app,
+    host: str,
+    port: int,
+    workers: int,
+    preload: Callable[[], None],
+    worker_init: Callable[[], None],
+    log_level: str = 'info',
+) -> int:
+    """preload() を親で1回実行してから workers 個のワーカーで app を配信する
+
+    worker_init() は fork 後の各ワーカーで受け付け開始前に呼ばれる（スレッド数の設定と
+    ウォームアップ）。戻り値はプロセスの終了コード。
+    """
+    import uvicorn
+
+    started = time.perf_counter()
+    # fast tokenizer のスレッドは fork を跨げないため、並列化は使わない
+    os.environ.setdefault('TOKENIZERS_PARALLELISM', 'false')
+    preload()
+    sock = _listen(host, port)
+    # 読み込み済みのオブジェクトを GC の走査対象から外し、fork 後に参照カウント以外で
+    # ページが書き換えられる（copy-on-write でコピーされる）のを減らす
+    gc.collect()
+    gc.freeze()
+    print(f'📦 preloaded in {time.perf_counter() - started:.1f}s; forking {workers} workers on {host}:{port}',
+          file=sys.stderr)
+
+    ready_read, ready_write = os.pipe()
+    children: Dict[int, bool] = {}
+    stopping = False
+
+    def spawn() -> None:
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                os.close(ready_read)
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                signal.signal(signal.SIGINT, signal.SIG_DFL)
+                worker_init()
+                os.write(ready_write, f'{os.getpid()}\n'.encode())
+                uvicorn.Server(uvicorn.Config(app, log_level=log_level)).run(sockets=[sock])
+                code = 0
+            except BaseException:
+                traceback.print_exc()
+            finally:
+                os._exit(code)
+        children[pid] = False
+
+    def stop(signum, frame) -> None:
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for _ in range(workers):
+        spawn()
+
+    announced = False
+    exit_code = 0
+    deadline = time.monotonic() + DEFAULT_READY_TIMEOUT
+    buffer = b''
+    while children:
+        try:
+            readable, _, _ = select.select([ready_read], [], [], 0.5)
+        except InterruptedError:
+            readable = []
+        if readable:
+            buffer += os.read(ready_read, 4096)
+            *lines, buffer = buffer.split(b'\n')
+            for line in lines:
+                if int(line) in children:
+                    children[int(line)] = True
+
+        if not announced and len(children) == workers and all(children.values()):
+            announced = True
+            print(f'✅ ready: {workers} workers warmed up in {time.perf_counter() - started:.1f}s', file=sys.stderr)
+        if not announced and not stopping and time.monotonic() > deadline:
+            print('❌ workers did not become ready in time', file=sys.stderr)
+            exit_code = 1
+            stop(None, None)
+
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            was_ready = children.pop(pid, False)
+            if stopping:
+                continue
+            if not was_ready:
+                # 起動中に落ちるワーカーは fork し直しても同じ結果になるので全体を止める
+                print(f'❌ worker {pid} exited during startup (status {status})', file=sys.stderr)
+                exit_code = 1
+                stop(None, None)
+            else:
+                print(f'⚠️ worker {pid} exited (status {status}); restarting', file=sys.stderr)
+                spawn()
+
+    sock.close()
+    return exit_code
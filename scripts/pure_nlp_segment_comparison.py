@@ -4,19 +4,19 @@
 import sys
 import json
 import time
-from transformers import pipeline
-import torch
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from scripts.inference_backend import load_classifier
 
 class PureNLPSegmentAnalyzer:
     def __init__(self):
         """純粋NLP + 既存セグメントマッピング分析器"""
-        print("🤖 純粋NLPモデルを読み込み中...", file=sys.stderr)
+        print("🤖 純粋NLP分析器を初期化中...", file=sys.stderr)
         
-        # モデル読み込み
-        self.sentiment_analyzer = pipeline(
-            'sentiment-analysis', 
-            model='cl-tohoku/bert-base-japanese-v3'
-        )
+        # モデルは初回の分析時に読み込む
+        self._sentiment_analyzer = None
         
         # 既存セグメント定義
         self.existing_segments = {
@@ -28,7 +28,15 @@ class PureNLPSegmentAnalyzer:
             'customer-support': '顧客サポート'
         }
         
-        print("✅ モデル読み込み完了！", file=sys.stderr)
+        print("✅ 初期化完了！", file=sys.stderr)
+    
+    @property
+    def sentiment_analyzer(self):
+        """感情分析パイプライン（初回アクセス時に読み込む）"""
+        if self._sentiment_analyzer is None:
+            self._sentiment_analyzer = load_classifier('cl-tohoku/bert-base-japanese-v3')
+            print("✅ モデル読み込み完了！", file=sys.stderr)
+        return self._sentiment_analyzer
     
     def map_to_existing_segments(self, sentiment, confidence, text):
         """感情分析結果を既存セグメントにマッピング"""
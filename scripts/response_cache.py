@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+感情分析 API のレスポンスキャッシュ
+
+(モデル名, 正規化テキストのハッシュ) をキーに推論結果をメモリ上の
+LRU + TTL で保持する。同じキーの推論が実行中なら新たに推論せず、
+その結果を待つ（リクエストの合流）。
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, Type
+
+from scripts.analysis_cache import normalize_text
+
+DEFAULT_MAX_ENTRIES = 10000
+DEFAULT_TTL_SECONDS = 3600.0
+
+
+class ResponseCache:
+    """イベントループ上で使う LRU + TTL キャッシュ（実行中の同一キーを合流）
+
+    max_entries=0 でキャッシュを無効にする（合流は有効のまま）。
+    ttl_seconds=0 で期限なし。
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, ttl_seconds: float = DEFAULT_TTL_SECONDS) -> None:
+        self.max_entries = max(0, int(max_entries))
+        self.ttl = max(0.0, float(ttl_seconds))
+        self._entries: OrderedDict[str, tuple] = OrderedDict()
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.retries = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def key(model: str, text: str) -> str:
+        digest = hashlib.sha256()
+        digest.update(model.encode('utf-8'))
+        digest.update(b'\0')
+        digest.update(normalize_text(text).encode('utf-8', errors='ignore'))
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._entries[key]
+            self.expirations += 1
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: str, value: Any) -> None:
+        if self.max_entries == 0:
+            return
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def get_or_compute(
+        self,
+        key: str,
+        compute: Callable[[], Awaitable[Any]],
+        timeout: Optional[float] = None,
+        retry_on: Tuple[Type[BaseException], ...] = (),
+    ) -> Any:
+        """キャッシュにあれば返し、実行中の同じキーがあればそれを待ち、無ければ compute() する
+
+        compute() は独立したタスクで実行するため、最初の呼び出し元が切断しても
+        合流した他の呼び出し元には結果が届く。失敗した結果はキャッシュしない。
+
+        合流した呼び出し元は timeout 秒（自分の締め切りまでの残り）を超えて待たず、
+        asyncio.TimeoutError を送出する。合流先が retry_on の例外（締め切り切れや
+        過負荷など、合流先の呼び出し元に固有の失敗）で終わった場合は、その失敗を
+        受け取らずに自分の compute() で計算し直す。
+        """
+        value = self.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        task = self._inflight.get(key)
+        if task is None:
+            self.misses += 1
+            return await asyncio.shield(self._start(key, compute))
+
+        self.coalesced += 1
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), timeout)
+        except retry_on:
+            if self._inflight.get(key) is task:
+                del self._inflight[key]
+        self.retries += 1
+        # 他の呼び出し元が先に計算し直していても、その失敗をまた受け取らないよう自分の分を計算する
+        if key in self._inflight:
+            return await compute()
+        return await asyncio.shield(self._start(key, compute))
+
+    def _start(self, key: str, compute: Callable[[], Awaitable[Any]]) -> asyncio.Future:
+        task = asyncio.ensure_future(compute())
+        self._inflight[key] = task
+        task.add_done_callback(lambda done: self._finish(key, done))
+        return task
+
+    def _finish(self, key: str, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if task.cancelled():
+            return
+        # 待っている呼び出し元が全員いなくなっても「未取得の例外」にしない
+        if task.exception() is None and task.result() is not None:
+            self.put(key, task.result())
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'ttl_seconds': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'retries': self.retries,
+            # 合流も推論を省いたヒットとして数える（合流先の失敗で計算し直したものは除く）
+            'hit_ratio': round((self.hits + self.coalesced - self.retries) / lookups, 4) if lookups else 0.0,
+            'inflight': len(self._inflight),
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
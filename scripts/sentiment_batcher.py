@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+感情分析 API の動的バッチング
+
+HTTP リクエストごとに分類器を呼ぶ代わりに、リクエストをキューに積み、
+バックグラウンドタスクが最大 max_batch_size 件、または先頭のリクエストから
+max_wait_ms 経過するまでまとめて1回のバッチ推論を行い、各リクエストの
+Future に結果を返す。
+
+- 推論は専用のスレッドプールで実行し、イベントループを塞がない
+- 同時に実行するバッチ数は concurrency まで（空きが無い間はキューに溜まる）
+- キュー（受付待ち）は優先度ごとに queue_limits 件（既定 max_queue_size）まで。
+  満杯なら即座に QueueFullError（低優先度の洪水で高優先度が締め出されない）
+- リクエストには締め切りを付けられる。待ち時間の見込みが締め切りを超えるなら
+  受け付けずに DeadlineUnreachableError、待機中に過ぎたら DeadlineExceededError
+- リクエストには優先度（high / medium / low）を付けられる。バッチは
+  「受付時刻 + 優先度 × aging_ms」の早い順に組むため、高優先度が先に処理され、
+  待たされた低優先度もいずれ新しい高優先度より前に回る（飢餓を防ぐ）
+"""
+
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import math
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Sequence, Union
+
+DEFAULT_MAX_BATCH_SIZE = 16
+DEFAULT_MAX_WAIT_MS = 5.0
+DEFAULT_MAX_QUEUE_SIZE = 1024
+DEFAULT_CONCURRENCY = 1
+
+# 優先度（添字が小さいほど急ぐ）。scoring_pipeline.EnrichRecord の level と同じ名前
+PRIORITIES = ('high', 'medium', 'low')
+DEFAULT_PRIORITY = 1
+# 1段階低い優先度のリクエストが、この時間だけ後に来た1段階高いリクエストと同順位になる
+DEFAULT_AGING_MS = 500.0
+
+# バッチ処理時間の移動平均の重み
+_LATENCY_SMOOTHING = 0.2
+
+
+class OverloadedError(Exception):
+    """受け付けられない（retry_after 秒後の再試行を促す）"""
+
+    def __init__(self, message: str, retry_after: int = 1) -> None:
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class QueueFullError(OverloadedError):
+    """待ち行列が上限に達している"""
+
+
+class DeadlineUnreachableError(OverloadedError):
+    """待ち時間の見込みが締め切りを超えている"""
+
+
+class DeadlineExceededError(Exception):
+    """推論が終わる前に締め切りを過ぎた"""
+
+
+def resolve_priority(value: Union[str, int, None], default: int = DEFAULT_PRIORITY) -> int:
+    """優先度の名前（high / medium / low）または数値（0 が最優先）を添字にする"""
+    if value is None or value == '':
+        return default
+    if isinstance(value, str) and not value.strip().lstrip('-').isdigit():
+        name = value.strip().lower()
+        if name not in PRIORITIES:
+            raise ValueError(f'unknown priority: {value} (expected one of {", ".join(PRIORITIES)})')
+        return PRIORITIES.index(name)
+    return min(max(int(value), 0), len(PRIORITIES) - 1)
+
+
+class DynamicBatcher:
+    """リクエストをまとめて infer_batch(texts) を呼ぶバッチャー
+
+    infer_batch は texts と同じ順序で結果のリストを返すこと。
+    バッチ全体が失敗した場合は1件ずつ推論し直し、失敗をそのリクエストに限定する。
+    複数のバッチャー（モデルごとなど）で executor と slots を共有すると、
+    同時実行数の上限を全体で守れる。
+    """
+
+    def __init__(
+        self,
+        infer_batch: Callable[[List[str]], Sequence],
+        max_batch_size: int = DEFAULT_MAX_BATCH_SIZE,
+        max_wait_ms: float = DEFAULT_MAX_WAIT_MS,
+        max_queue_size: int = DEFAULT_MAX_QUEUE_SIZE,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        executor: Optional[ThreadPoolExecutor] = None,
+        slots: Optional[asyncio.Semaphore] = None,
+        queue_limits: Optional[Sequence[int]] = None,
+        aging_ms: float = DEFAULT_AGING_MS,
+    ) -> None:
+        self.infer_batch = infer_batch
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000
+        self.max_queue_size = max(1, int(max_queue_size))
+        self.queue_limits = [
+            max(1, int(limit)) for limit in (queue_limits or [self.max_queue_size] * len(PRIORITIES))
+        ]
+        self.aging = max(0.0, float(aging_ms)) / 1000
+        self.concurrency = max(1, int(concurrency))
+        self.batches = 0
+        self.items = 0
+        self.rejected = 0
+        self.expired = 0
+        self.batch_seconds: Optional[float] = None
+
+        # (順位, 受付順, 優先度, テキスト, Future, 締め切り) のヒープと優先度ごとの件数
+        self._queue: list = []
+        self._queued = [0] * len(PRIORITIES)
+        self._sequence = itertools.count()
+        self._arrival: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._slots: Optional[asyncio.Semaphore] = slots
+        self._running: set = set()
+        self._executor: Optional[ThreadPoolExecutor] = executor
+        self._owns_executor = executor is None
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._queue)
+
+    @property
+    def active_batches(self) -> int:
+        return len(self._running)
+
+    def is_full(self, priority: int = DEFAULT_PRIORITY) -> bool:
+        return self._queued[priority] >= self.queue_limits[priority]
+
+    def queued_by_priority(self) -> Dict[str, int]:
+        return dict(zip(PRIORITIES, self._queued))
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._arrival = asyncio.Event()
+            if self._slots is None:
+                self._slots = asyncio.Semaphore(self.concurrency)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='sentiment-infer')
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        # 実行中のバッチは完了を待ち、残っているリクエストは失敗させる
+        if self._running:
+            await asyncio.gather(*self._running, return_exceptions=True)
+        while self._queue:
+            future = heapq.heappop(self._queue)[4]
+            if not future.done():
+                future.set_exception(RuntimeError('batcher stopped'))
+        self._queued = [0] * len(PRIORITIES)
+        if self._executor is not None and self._owns_executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def estimated_wait(self, queued: Optional[int] = None, priority: Optional[int] = None) -> float:
+        """いまキューに積んだリクエストの結果が返るまでの見込み秒数
+
+        priority を指定すると、同じか高い優先度の待ち件数だけを前にいるものとして数える。
+        """
+        if self.batch_seconds is None:
+            return 0.0
+        if queued is None:
+            queued = self.queue_depth if priority is None else sum(self._queued[:priority + 1])
+        batches_ahead = math.ceil((queued + 1) / self.max_batch_size)
+        waves = math.ceil((batches_ahead + self.active_batches) / self.concurrency)
+        return self.max_wait + waves * self.batch_seconds
+
+    def retry_after(self, priority: Optional[int] = None) -> int:
+        """Retry-After ヘッダー用の秒数（1秒以上）"""
+        return max(1, math.ceil(self.estimated_wait(priority=priority)))
+
+    async def submit(self, text: str, deadline: Optional[float] = None, priority: int = DEFAULT_PRIORITY):
+        """テキストをキューに積み、推論結果を待つ
+
+        deadline は `asyncio.get_running_loop().time()` 基準の締め切り時刻。
+        priority は PRIORITIES の添字（resolve_priority() で名前から変換できる）。
+        """
+        if self._task is None:
+            raise RuntimeError('batcher is not running')
+
+        loop = asyncio.get_running_loop()
+        if deadline is not None:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                raise DeadlineExceededError('deadline already passed')
+            expected = self.estimated_wait(priority=priority)
+            if expected > remaining:
+                self.rejected += 1
+                raise DeadlineUnreachableError(
+                    f'expected wait {expected:.3f}s exceeds the deadline', self.retry_after(priority)
+                )
+
+        if self.is_full(priority):
+            self.rejected += 1
+            raise QueueFullError(
+                f'{PRIORITIES[priority]} priority queue is full ({self.queue_limits[priority]} pending)',
+                self.retry_after(priority),
+            )
+        future = loop.create_future()
+        now = loop.time()
+        heapq.heappush(self._queue, (now + priority * self.aging, next(self._sequence), priority, text, future, deadline))
+        self._queued[priority] += 1
+        self._arrival.set()
+
+        if deadline is None:
+            return await future
+        try:
+            return await asyncio.wait_for(future, deadline - loop.time())
+        except asyncio.TimeoutError as exc:
+            self.expired += 1
+            raise DeadlineExceededError('deadline exceeded while waiting for inference') from exc
+
+    async def _wait_for_items(self, count: int, timeout: Optional[float] = None) -> None:
+        """count 件溜まるまで（timeout 秒を過ぎたらそこまで）待つ"""
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        while self.queue_depth < count:
+            self._arrival.clear()
+            remaining = None if deadline is None else deadline - loop.time()
+            if remaining is not None and remaining <= 0:
+                return
+            try:
+                await asyncio.wait_for(self._arrival.wait(), remaining)
+            except asyncio.TimeoutError:
+                return
+
+    def _take_batch(self) -> list:
+        """順位の早い順に最大 max_batch_size 件取り出す"""
+        now = asyncio.get_running_loop().time()
+        live = []
+        while self._queue and len(live) < self.max_batch_size:
+            _, _, priority, text, future, request_deadline = heapq.heappop(self._queue)
+            self._queued[priority] -= 1
+            # キャンセル済み・締め切り切れのリクエストは推論しない
+            if future.done():
+                continue
+            if request_deadline is not None and request_deadline <= now:
+                self.expired += 1
+                future.set_exception(DeadlineExceededError('deadline exceeded while queued'))
+                continue
+            live.append((text, future))
+        return live
+
+    async def _run(self) -> None:
+        while True:
+            await self._wait_for_items(1)
+
+            # 実行枠が空くまで次のバッチを作らない（その間のリクエストはキューに溜まる）。
+            # 枠はリクエストが届いてから取るので、他のバッチャーと共有しても
+            # 待機中のバッチャーが枠を占有しない
+            await self._slots.acquire()
+            try:
+                # 枠が取れたら最大 max_wait だけ後続を待ち、その時点の順位でバッチを組む
+                await self._wait_for_items(self.max_batch_size, self.max_wait)
+                batch = self._take_batch()
+            except BaseException:
+                self._slots.release()
+                raise
+            if not batch:
+                self._slots.release()
+                continue
+
+            task = asyncio.create_task(self._run_batch(batch))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _run_batch(self, batch: list) -> None:
+        loop = asyncio.get_running_loop()
+        texts = [text for text, _ in batch]
+        started = loop.time()
+        try:
+            outcomes = await loop.run_in_executor(self._executor, self._infer, texts)
+        except Exception as exc:
+            outcomes = [(False, exc)] * len(batch)
+        finally:
+            self._slots.release()
+
+        elapsed = loop.time() - started
+        if self.batch_seconds is None:
+            self.batch_seconds = elapsed
+        else:
+            self.batch_seconds += _LATENCY_SMOOTHING * (elapsed - self.batch_seconds)
+        self.batches += 1
+        self.items += len(batch)
+
+        for (_, future), (ok, value) in zip(batch, outcomes):
+            if future.done():
+                continue
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+    def _infer(self, texts: List[str]) -> List[tuple]:
+        """バッチ推論し、(成功したか, 結果または例外) のリストを返す"""
+        try:
+            results = list(self.infer_batch(texts))
+            if len(results) != len(texts):
+                raise RuntimeError(f'expected {len(texts)} results, got {len(results)}')
+            return [(True, result) for result in results]
+        except Exception as exc:
+            if len(texts) == 1:
+                return [(False, exc)]
+
+        outcomes = []
+        for text in texts:
+            try:
+                outcomes.append((True, list(self.infer_batch([text]))[0]))
+            except Exception as exc:
+                outcomes.append((False, exc))
+        return outcomes
+
+    def stats(self) -> dict:
+        return {
+            'batches': self.batches,
+            'items': self.items,
+            'mean_batch_size': round(self.items / self.batches, 2) if self.batches else 0.0,
+            'queue_depth': self.queue_depth,
+            'queued_by_priority': self.queued_by_priority(),
+            'active_batches': self.active_batches,
+            'rejected': self.rejected,
+            'expired': self.expired,
+            'batch_ms': round(self.batch_seconds * 1000, 2) if self.batch_seconds is not None else None,
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait * 1000,
+            'max_queue_size': self.max_queue_size,
+            'queue_limits': dict(zip(PRIORITIES, self.queue_limits)),
+            'aging_ms': self.aging * 1000,
+            'concurrency': self.concurrency,
+        }
@@ -0,0 +1,446 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ローカル感情分析サーバーの負荷試験
+
+sample_alerts.json / sample_alerts_clean.json の本文を `local_sentiment_server`
+に繰り返し送り（既定では応答キャッシュに当たらないよう連番を付ける）、レイテンシ
+（p50/p95/p99）、スループット、エラー率・429 率を測って JSON ファイルに書き出す。バッチングやバックエンドの設定を変えた実行
+結果を並べて比較できるよう、設定とサーバー側の統計も一緒に記録する。
+
+- closed-loop: --concurrency 本の接続がそれぞれ応答を待ってから次を送る（同時実行数が一定）
+- open-loop:   --rate req/s で応答を待たずに送る（到着率が一定）。レイテンシは
+               予定送信時刻から測るため、サーバーが詰まって送信が遅れた分も含まれる
+- --start-server でサーバーを子プロセスとして起動し（--server-env で環境変数を上書き）、
+  /readyz が 200 になってから計測を始める
+
+標準ライブラリのみで動く（HTTP/1.1 keep-alive の最小限のクライアントを内蔵）。
+
+実行方法:
+  python scripts/sentiment_loadtest.py --start-server --mode closed --concurrency 16 --duration 30
+  python scripts/sentiment_loadtest.py --mode open --rate 200 --batch-size 8 \\
+      --start-server --server-env LOCAL_SENTIMENT_MAX_BATCH_SIZE=32 --output artifacts/loadtest/b32.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+ROOT = Path(__file__).parent.parent
+DEFAULT_INPUTS = [ROOT / 'sample_alerts.json', ROOT / 'sample_alerts_clean.json']
+DEFAULT_URL = 'http://127.0.0.1:8000'
+DEFAULT_OUTPUT_DIR = ROOT / 'artifacts' / 'loadtest'
+
+
+def load_texts(paths: List[Path], field: str = 'both') -> List[str]:
+    """サンプルファイル（JSON オブジェクトの連結・配列・NDJSON のいずれも可）から送信する本文を読む"""
+    decoder = json.JSONDecoder()
+    texts = []
+    for path in paths:
+        content = Path(path).read_text(encoding='utf-8')
+        position = 0
+        while True:
+            while position < len(content) and content[position].isspace():
+                position += 1
+            if position >= len(content):
+                break
+            value, position = decoder.raw_decode(content, position)
+            for record in value if isinstance(value, list) else [value]:
+                if not isinstance(record, dict):
+                    continue
+                subject = (record.get('subject') or '').strip()
+                body = (record.get('body') or record.get('text') or '').strip()
+                text = {'subject': subject, 'body': body}.get(field, f'{subject}\n{body}'.strip())
+                if text:
+                    texts.append(text)
+    return texts
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """線形補間のパーセンタイル（numpy.percentile の既定と同じ）"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * q / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+
+class HttpConnection:
+    """1本の HTTP/1.1 keep-alive 接続"""
+
+    def __init__(self, host: str, port: int) -> None:
+        self.host = host
+        self.port = port
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+
+    async def request(self, method: str, path: str, body: bytes = b'',
+                      headers: Optional[Dict[str, str]] = None) -> Tuple[int, Dict[str, str], bytes]:
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        lines = [f'{method} {path} HTTP/1.1', f'Host: {self.host}:{self.port}', f'Content-Length: {len(body)}']
+        lines += [f'{name}: {value}' for name, value in (headers or {}).items()]
+        self.writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body)
+        await self.writer.drain()
+
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionError('connection closed by server')
+        status = int(status_line.split()[1])
+        response_headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            response_headers[name.strip().lower()] = value.strip()
+
+        if response_headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await self.reader.readline()).split(b';')[0], 16)
+                chunk = await self.reader.readexactly(size + 2)
+                if size == 0:
+                    break
+                chunks.append(chunk[:-2])
+            content = b''.join(chunks)
+        else:
+            content = await self.reader.readexactly(int(response_headers.get('content-length', '0')))
+
+        if response_headers.get('connection', '').lower() == 'close':
+            self.close()
+        return status, response_headers, content
+
+    def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+class ConnectionPool:
+    """接続を使い回し、足りなければ max_connections 本まで増やす（超えた分は空きを待つ）"""
+
+    def __init__(self, host: str, port: int, max_connections: int) -> None:
+        self.host = host
+        self.port = port
+        self._idle: List[HttpConnection] = []
+        self._slots = asyncio.Semaphore(max(1, max_connections))
+
+    async def request(self, *args, **kwargs):
+        async with self._slots:
+            connection = self._idle.pop() if self._idle else HttpConnection(self.host, self.port)
+            try:
+                result = await connection.request(*args, **kwargs)
+            except BaseException:
+                connection.close()
+                raise
+            self._idle.append(connection)
+            return result
+
+    def close(self) -> None:
+        for connection in self._idle:
+            connection.close()
+        self._idle.clear()
+
+
+def server_timing(header: str, metric: str = 'serialize') -> Optional[float]:
+    """Server-Timing ヘッダーから指定メトリクスの dur（ms）を取り出す"""
+    for entry in header.split(','):
+        name, *params = [piece.strip() for piece in entry.split(';')]
+        if name == metric:
+            for param in params:
+                if param.startswith('dur='):
+                    return float(param[4:])
+    return None
+
+
+class LoadTest:
+    def __init__(self, args: argparse.Namespace, texts: List[str]) -> None:
+        self.args = args
+        url = urlsplit(args.url)
+        self.pool = ConnectionPool(url.hostname or '127.0.0.1', url.port or 80, args.max_connections)
+        self.texts = itertools.cycle(texts)
+        self.sequence = itertools.count()
+        self.records: List[dict] = []
+        self.started = 0.0
+        self.measure_from = 0.0
+        self.stop_at = 0.0
+
+        query = '?compact=1' if args.compact else ''
+        self.path = ('/api/sentiment/batch' if args.batch_size > 1 else '/api/sentiment') + query
+        self.headers = {'Content-Type': 'application/json'}
+        if args.msgpack:
+            self.headers['Accept'] = 'application/msgpack'
+
+    def _next_text(self) -> str:
+        text = next(self.texts)
+        if self.args.repeat_texts:
+            return text
+        # 末尾に連番を付け、サーバーの応答キャッシュに当たらないようにする
+        return f'{text}\n#{next(self.sequence)}'
+
+    def _payload(self) -> bytes:
+        payload: dict = {}
+        if self.args.batch_size > 1:
+            payload['items'] = [{'id': i, 'text': self._next_text()} for i in range(self.args.batch_size)]
+        else:
+            payload['text'] = self._next_text()
+        if self.args.model:
+            payload['model'] = self.args.model
+        if self.args.deadline_ms:
+            payload['deadlineMs'] = self.args.deadline_ms
+        return json.dumps(payload, ensure_ascii=False).encode('utf-8')
+
+    async def _send(self, scheduled: float) -> None:
+        body = self._payload()
+        record = {'scheduled': scheduled, 'status': None, 'error': None, 'serialize_ms': None, 'bytes': 0}
+        try:
+            status, headers, content = await asyncio.wait_for(
+                self.pool.request('POST', self.path, body, self.headers), self.args.timeout
+            )
+            record['status'] = status
+            record['bytes'] = len(content)
+            record['serialize_ms'] = server_timing(headers.get('server-timing', ''))
+            if status == 200 and self.args.batch_size > 1 and not self.args.msgpack:
+                # バッチは HTTP 200 でも件ごとに失敗し得る
+                record['item_errors'] = sum(1 for item in json.loads(content)['results'] if item.get('error'))
+        except asyncio.TimeoutError:
+            record['error'] = 'timeout'
+        except Exception as exc:
+            record['error'] = f'{type(exc).__name__}: {exc}'
+        record['finished'] = time.perf_counter()
+        record['latency'] = record['finished'] - scheduled
+        if scheduled >= self.measure_from:
+            self.records.append(record)
+
+    async def run_closed(self) -> None:
+        async def worker() -> None:
+            while time.perf_counter() < self.stop_at:
+                await self._send(time.perf_counter())
+
+        await asyncio.gather(*(worker() for _ in range(self.args.concurrency)))
+
+    async def run_open(self) -> None:
+        interval = 1.0 / self.args.rate
+        tasks = set()
+        scheduled = time.perf_counter()
+        while scheduled < self.stop_at:
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            task = asyncio.create_task(self._send(scheduled))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            scheduled += random.expovariate(self.args.rate) if self.args.arrival == 'poisson' else interval
+        if tasks:
+            await asyncio.gather(*tasks)
+
+    async def run(self) -> dict:
+        self.started = time.perf_counter()
+        self.measure_from = self.started + self.args.warmup
+        self.stop_at = self.measure_from + self.args.duration
+        try:
+            if self.args.mode == 'open':
+                await self.run_open()
+            else:
+                await self.run_closed()
+        finally:
+            self.pool.close()
+        return self.summarize(time.perf_counter() - self.measure_from)
+
+    def summarize(self, elapsed: float) -> dict:
+        """レイテンシは成功（200）した応答のみ。スループットは計測時間内に完了した分で数える"""
+        total = len(self.records)
+        statuses: Dict[str, int] = {}
+        for record in self.records:
+            key = str(record['status']) if record['status'] is not None else record['error'].split(':')[0]
+            statuses[key] = statuses.get(key, 0) + 1
+        ok = [record for record in self.records if record['status'] == 200]
+        # open-loop で過負荷のときは送信後の待ちが長く、計測後の後始末まで含めると過小評価になる
+        completed = sum(1 for record in ok if record['finished'] <= self.stop_at)
+        duration = self.args.duration
+        latencies = [record['latency'] * 1000 for record in ok]
+        serialize = [record['serialize_ms'] for record in ok if record['serialize_ms'] is not None]
+
+        def rounded(value: Optional[float], digits: int = 2) -> Optional[float]:
+            return round(value, digits) if value is not None else None
+
+        return {
+            'requests': total,
+            'elapsed_seconds': round(elapsed, 3),
+            'throughput_rps': round(completed / duration, 2),
+            'texts_per_second': round(completed * self.args.batch_size / duration, 2),
+            'offered_rps': self.args.rate if self.args.mode == 'open' else None,
+            'latency_ms': {
+                'p50': rounded(percentile(latencies, 50)),
+                'p95': rounded(percentile(latencies, 95)),
+                'p99': rounded(percentile(latencies, 99)),
+                'max': rounded(max(latencies) if latencies else None),
+                'mean': rounded(sum(latencies) / len(latencies) if latencies else None),
+            },
+            'error_rate': round((total - len(ok)) / total, 4) if total else None,
+            'rate_429': round(statuses.get('429', 0) / total, 4) if total else None,
+            'rate_503': round(statuses.get('503', 0) / total, 4) if total else None,
+            'item_errors': sum(record.get('item_errors', 0) for record in ok),
+            'statuses': statuses,
+            'serialize_ms': {
+                'mean': rounded(sum(serialize) / len(serialize) if serialize else None, 3),
+                'p99': rounded(percentile(serialize, 99), 3),
+            },
+            'response_bytes_mean': round(sum(record['bytes'] for record in ok) / len(ok), 1) if ok else None,
+        }
+
+
+async def fetch_json(url: str, path: str) -> Tuple[int, Optional[dict]]:
+    parts = urlsplit(url)
+    connection = HttpConnection(parts.hostname or '127.0.0.1', parts.port or 80)
+    try:
+        status, _, content = await connection.request('GET', path)
+    finally:
+        connection.close()
+    try:
+        return status, json.loads(content)
+    except ValueError:
+        return status, None
+
+
+async def wait_until_ready(url: str, timeout: float, server: Optional[subprocess.Popen] = None) -> dict:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server is not None and server.poll() is not None:
+            raise RuntimeError(f'server exited during startup (code {server.returncode})')
+        try:
+            status, body = await fetch_json(url, '/readyz')
+            if status == 200:
+                return body or {}
+            if body and body.get('status') == 'failed':
+                raise RuntimeError(f"server failed to start: {body.get('error')}")
+        except OSError:
+            pass
+        await asyncio.sleep(0.5)
+    raise TimeoutError(f'{url} did not become ready within {timeout:.0f}s')
+
+
+def start_server(url: str, overrides: Dict[str, str]) -> subprocess.Popen:
+    env = dict(os.environ)
+    env.update(overrides)
+    env['LOCAL_SENTIMENT_PORT'] = str(urlsplit(url).port or 8000)
+    return subprocess.Popen([sys.executable, str(ROOT / 'scripts' / 'local_sentiment_server.py')], env=env, cwd=ROOT)
+
+
+def parse_env(pairs: List[str]) -> Dict[str, str]:
+    overrides = {}
+    for pair in pairs:
+        name, separator, value = pair.partition('=')
+        if not separator:
+            raise SystemExit(f'--server-env expects KEY=VALUE: {pair}')
+        overrides[name] = value
+    return overrides
+
+
+async def run(args: argparse.Namespace) -> dict:
+    texts = load_texts([Path(path) for path in args.input], field=args.field)
+    if not texts:
+        raise SystemExit('no texts to send')
+
+    overrides = parse_env(args.server_env)
+    server = start_server(args.url, overrides) if args.start_server else None
+    try:
+        startup = await wait_until_ready(args.url, args.startup_timeout, server)
+        print(f'🚀 {args.mode}-loop load test against {args.url} ({len(texts)} texts)', file=sys.stderr)
+        results = await LoadTest(args, texts).run()
+        _, server_stats = await fetch_json(args.url, '/api/sentiment/stats')
+    finally:
+        if server is not None:
+            server.terminate()
+            try:
+                server.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                server.kill()
+
+    config = {
+        key: value for key, value in vars(args).items()
+        if key not in ('output', 'server_env', 'start_server', 'startup_timeout')
+    }
+    return {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'config': config,
+        'server_env': overrides,
+        'texts': len(texts),
+        'results': results,
+        'server': {'startup': startup, 'stats': server_stats},
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='ローカル感情分析サーバーの負荷試験')
+    parser.add_argument('--url', default=DEFAULT_URL)
+    parser.add_argument('--input', nargs='+', default=[str(path) for path in DEFAULT_INPUTS],
+                        help='送信する本文のサンプルファイル')
+    parser.add_argument('--field', choices=('both', 'subject', 'body'), default='both', help='送信する項目')
+    parser.add_argument('--mode', choices=('closed', 'open'), default='closed')
+    parser.add_argument('--concurrency', type=int, default=8, help='closed-loop の同時接続数')
+    parser.add_argument('--rate', type=float, default=50.0, help='open-loop の到着率（req/s）')
+    parser.add_argument('--arrival', choices=('uniform', 'poisson'), default='poisson', help='open-loop の到着間隔')
+    parser.add_argument('--max-connections', type=int, default=256, help='open-loop で同時に張る接続の上限')
+    parser.add_argument('--duration', type=float, default=30.0, help='計測する秒数')
+    parser.add_argument('--warmup', type=float, default=5.0, help='計測前に捨てる秒数')
+    parser.add_argument('--timeout', type=float, default=30.0, help='1リクエストのタイムアウト秒数')
+    parser.add_argument('--batch-size', type=int, default=1, help='2以上なら /api/sentiment/batch に N 件ずつ送る')
+    parser.add_argument('--repeat-texts', action='store_true',
+                        help='本文をそのまま繰り返し送る（既定では連番を付けて応答キャッシュを避ける）')
+    parser.add_argument('--model', default=None)
+    parser.add_argument('--deadline-ms', type=float, default=None)
+    parser.add_argument('--compact', action='store_true', help='?compact=1 で送る')
+    parser.add_argument('--msgpack', action='store_true', help='Accept: application/msgpack で送る')
+    parser.add_argument('--start-server', action='store_true', help='サーバーを子プロセスとして起動する')
+    parser.add_argument('--server-env', action='append', default=[], metavar='KEY=VALUE',
+                        help='起動するサーバーの環境変数（複数指定可）')
+    parser.add_argument('--startup-timeout', type=float, default=600.0)
+    parser.add_argument('--output', default=None, help='結果の JSON（既定: artifacts/loadtest/ に日時付きで保存）')
+    args = parser.parse_args()
+
+    if args.mode == 'open' and args.rate <= 0:
+        parser.error('--rate must be positive')
+    args.concurrency = max(1, args.concurrency)
+    args.batch_size = max(1, args.batch_size)
+
+    try:
+        report = asyncio.run(run(args))
+    except (RuntimeError, TimeoutError, OSError) as exc:
+        print(f"❌ {exc}", file=sys.stderr)
+        sys.exit(1)
+
+    output = Path(args.output) if args.output else (
+        DEFAULT_OUTPUT_DIR / f'loadtest-{args.mode}-{datetime.now().strftime("%Y%m%d-%H%M%S")}.json'
+    )
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding='utf-8')
+
+    results = report['results']
+    latency = results['latency_ms']
+    print(
+        f"✅ {results['requests']} requests, {results['throughput_rps']} req/s ({results['texts_per_second']} texts/s), "
+        f"p50 {latency['p50']}ms p95 {latency['p95']}ms p99 {latency['p99']}ms, "
+        f"errors {results['error_rate']}, 429 {results['rate_429']}",
+        file=sys.stderr,
+    )
+    print(f"📄 {output}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+感情分析サーバーのメトリクスとサンプリングプロファイラ
+
+- Counter / Gauge / Histogram を Prometheus のテキスト形式（0.0.4）で出力する
+  最小限の実装（prometheus_client への依存を増やさない）
+- StackSampler: 指定スレッドのスタックを一定間隔で採取し、flamegraph.pl /
+  speedscope で読める collapsed 形式で返すサンプリングプロファイラ
+"""
+
+from __future__ import annotations
+
+import bisect
+import sys
+import threading
+import time
+from collections import Counter as _Tally
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append(f'{extra[0]}="{_escape(extra[1])}"')
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def header(self) -> List[str]:
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+
+
+class _ValueMetric(_Metric):
+    """ラベルごとに1つの値を持つメトリクス
+
+    collect を渡すと、出力時に呼んで (ラベル, 値) の組を読み取る（他のオブジェクトが
+    持っている統計値をそのまま出力する用途）。
+    """
+
+    def __init__(self, *args, collect: Optional[Callable[[], Iterable[Tuple[Dict[str, str], float]]]] = None,
+                 **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._values: Dict[LabelValues, float] = {}
+        self._collect = collect
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = dict(self._values)
+        if self._collect is not None:
+            for labels, value in self._collect():
+                values[self._key(labels)] = value
+        return self.header() + [
+            f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}'
+            for key, value in sorted(values.items())
+        ]
+
+
+class Counter(_ValueMetric):
+    kind = 'counter'
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(_ValueMetric):
+    kind = 'gauge'
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, *args, buckets: Sequence[float] = LATENCY_BUCKETS, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[LabelValues, list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # バケットごとの件数（累積は出力時に計算）、合計、件数
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        with self._lock:
+            items = sorted((key, [list(series[0]), series[1], series[2]]) for key, series in self._series.items())
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, ('le', _format_value(bound)))
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+            lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = (), collect=None) -> Counter:
+        return self.register(Counter(name, documentation, labelnames, collect=collect))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = (), collect=None) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames, collect=collect))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets=buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+class StackSampler:
+    """スレッドのスタックを interval 秒ごとに採取するサンプリングプロファイラ
+
+    thread_prefix で対象スレッドを名前で絞り込む（空なら全スレッド）。
+    """
+
+    def __init__(self, interval: float = 0.005, thread_prefix: str = '') -> None:
+        self.interval = max(0.001, float(interval))
+        self.thread_prefix = thread_prefix
+        self._lock = threading.Lock()
+
+    def sample(self, seconds: float, interval: Optional[float] = None) -> Dict[str, int]:
+        """seconds 秒間採取し、collapsed 形式のスタック → 件数を返す（同時実行は1つまで）"""
+        interval = self.interval if interval is None else max(0.001, float(interval))
+        if not self._lock.acquire(blocking=False):
+            raise RuntimeError('a profile is already running')
+        try:
+            stacks: _Tally = _Tally()
+            own_thread = threading.get_ident()
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+                for thread_id, frame in sys._current_frames().items():
+                    name = names.get(thread_id, str(thread_id))
+                    if thread_id == own_thread or not name.startswith(self.thread_prefix):
+                        continue
+                    stacks[self._collapse(name, frame)] += 1
+                time.sleep(interval)
+            return dict(stacks)
+        finally:
+            self._lock.release()
+
+    @staticmethod
+    def _collapse(thread_name: str, frame) -> str:
+        parts = []
+        while frame is not None:
+            code = frame.f_code
+            parts.append(f'{code.co_name} ({code.co_filename.rsplit("/", 1)[-1]}:{frame.f_lineno})')
+            frame = frame.f_back
+        # プールのワーカー番号（name_N の _N）は落として同じプールのスレッドをまとめる
+        return ';'.join([thread_name.split('_')[0]] + parts[::-1])
+
+    @staticmethod
+    def render_collapsed(stacks: Dict[str, int]) -> str:
+        return ''.join(f'{stack} {count}\n' for stack, count in sorted(stacks.items(), key=lambda item: -item[1]))
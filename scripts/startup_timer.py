@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+分析スクリプトの起動時間の計測
+
+スクリプトの先頭（重い import の前）で StartupTimer を作り、import が
+終わったら imports_done()、初期化が終わったら report() を呼ぶ。
+"""
+
+from __future__ import annotations
+
+import sys
+import time
+from typing import Optional
+
+
+class StartupTimer:
+    """import と初期化にかかった時間を測る"""
+
+    def __init__(self) -> None:
+        self.started_at = time.perf_counter()
+        self.imports_done_at: Optional[float] = None
+
+    def imports_done(self) -> None:
+        self.imports_done_at = time.perf_counter()
+
+    def report(self) -> None:
+        """import と初期化にかかった時間を標準エラーに出力する"""
+        now = time.perf_counter()
+        imports_done_at = self.imports_done_at if self.imports_done_at is not None else now
+        import_ms = (imports_done_at - self.started_at) * 1000
+        init_ms = (now - imports_done_at) * 1000
+        print(f"⏱️ 起動時間: import {import_ms:.1f}ms / 初期化 {init_ms:.1f}ms", file=sys.stderr)
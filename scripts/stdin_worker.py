@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+常駐 stdin ワーカーのマイクロバッチ処理
+
+標準入力の NDJSON（{"id": ..., "text": ...}）を読み取りスレッドでキューに積み、
+処理側は短い待ち時間（batch window）のあいだに届いた行、または最大バッチ
+サイズまでをまとめて1回のバッチ推論に渡す。結果は1バッチにつき1回の
+書き込みと flush で返す。
+
+- 結果には入力の id（無ければ入力行の通し番号）を `id` として付ける。
+  呼び出し側は順序ではなく id で結果を対応づけること
+- 推論中に届いた行はキューに溜まり、次のバッチで待たずにまとめて処理される。
+  アイドル時の単発リクエストの遅延増加は最大で batch window 分
+"""
+
+from __future__ import annotations
+
+import json
+import queue
+import sys
+import threading
+import time
+from typing import Callable, List, Optional
+
+DEFAULT_BATCH_WINDOW_MS = 5.0
+DEFAULT_MAX_BATCH_SIZE = 32
+
+_EOF = object()
+
+
+def add_worker_arguments(parser) -> None:
+    """マイクロバッチ用の CLI 引数を追加する"""
+    parser.add_argument('--batch-window-ms', type=float, default=DEFAULT_BATCH_WINDOW_MS,
+                        help='最初の行が届いてから後続の行を待つ時間（ミリ秒、0で待たない）')
+    parser.add_argument('--max-batch-size', type=int, default=DEFAULT_MAX_BATCH_SIZE,
+                        help='1回のバッチ推論にまとめる最大行数')
+
+
+def _read_requests(stream, requests: queue.Queue) -> None:
+    """標準入力を読み、(id, text) をキューに積む（読み取りスレッド）"""
+    try:
+        for line_no, line in enumerate(stream):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                data = json.loads(line)
+            except json.JSONDecodeError:
+                print("❌ JSON形式が無効です", file=sys.stderr)
+                continue
+            if not isinstance(data, dict):
+                continue
+
+            text = data.get('text', '')
+            if not text:
+                continue
+            request_id = data.get('id', data.get('request_id', line_no))
+            requests.put((request_id, text))
+    finally:
+        requests.put(_EOF)
+
+
+def _next_batch(requests: queue.Queue, window: float, max_batch_size: int) -> Optional[List[tuple]]:
+    """次のバッチを取り出す（入力終了かつ空なら None）"""
+    first = requests.get()
+    if first is _EOF:
+        return None
+
+    batch = [first]
+    deadline = time.monotonic() + window
+    while len(batch) < max_batch_size:
+        try:
+            # 既に溜まっている行は待たずに取り出し、無ければ window の残りだけ待つ
+            remaining = deadline - time.monotonic()
+            item = requests.get_nowait() if remaining <= 0 else requests.get(timeout=remaining)
+        except queue.Empty:
+            break
+        if item is _EOF:
+            # 入力終了は次の呼び出しに伝える
+            requests.put(_EOF)
+            break
+        batch.append(item)
+    return batch
+
+
+def run_stdin_worker(
+    analyze_batch: Callable[[List[str]], List[dict]],
+    batch_window_ms: float = DEFAULT_BATCH_WINDOW_MS,
+    max_batch_size: int = DEFAULT_MAX_BATCH_SIZE,
+    stdin=None,
+    stdout=None,
+) -> None:
+    """標準入力を読み、マイクロバッチごとに analyze_batch を呼んで結果を書き出す"""
+    stdin = stdin or sys.stdin
+    stdout = stdout or sys.stdout
+    window = max(0.0, batch_window_ms) / 1000
+    max_batch_size = max(1, int(max_batch_size))
+
+    # 入力待ちとバッチ推論を重ねるため、読み取りは別スレッドで行う
+    requests: queue.Queue = queue.Queue()
+    reader = threading.Thread(target=_read_requests, args=(stdin, requests), daemon=True)
+    reader.start()
+
+    try:
+        while True:
+            batch = _next_batch(requests, window, max_batch_size)
+            if batch is None:
+                break
+
+            try:
+                results = analyze_batch([text for _, text in batch])
+            except Exception as e:
+                print(f"❌ 予期しないエラー: {e}", file=sys.stderr)
+                results = [{'error': str(e), 'processed': False} for _ in batch]
+
+            lines = []
+            for (request_id, _), result in zip(batch, results):
+                lines.append(json.dumps({'id': request_id, **result}, ensure_ascii=False))
+            stdout.write('\n'.join(lines) + '\n')
+            stdout.flush()
+    except KeyboardInterrupt:
+        print("\n👋 処理を終了します", file=sys.stderr)
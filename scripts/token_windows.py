@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+トークン単位のスライディングウィンドウ分類
+
+文字数での `text[:512]` 切り詰めの代わりに、本文をモデルの最大トークン長に
+収まる重なり付きウィンドウへ分割し、複数メッセージのウィンドウをまとめて
+バッチ推論してからウィンドウごとのスコアをプーリングする。
+短文はパディングされず、長文は末尾まで評価されるため、計算量は実際の
+トークン数に比例する。
+"""
+
+from __future__ import annotations
+
+from typing import List, Sequence
+
+POOLING_METHODS = ('max-negative', 'mean')
+
+DEFAULT_MAX_LENGTH = 512
+DEFAULT_STRIDE = 128
+DEFAULT_NEGATIVE_LABEL = 'LABEL_0'
+
+
+def split_token_windows(input_ids: Sequence[int], window_size: int, stride: int) -> List[List[int]]:
+    """トークン列を stride トークンずつ重なるウィンドウに分割する"""
+    input_ids = list(input_ids)
+    if len(input_ids) <= window_size:
+        return [input_ids]
+
+    step = max(1, window_size - stride)
+    windows = []
+    for start in range(0, len(input_ids), step):
+        windows.append(input_ids[start:start + window_size])
+        if start + window_size >= len(input_ids):
+            break
+    return windows
+
+
+class WindowedClassifier:
+    """テキスト分類器をウィンドウ単位で実行する
+
+    HF パイプライン、または `probabilities()` を持つ分類器（ONNX バックエンド）の
+    モデルとトークナイザーをそのまま使い、戻り値はパイプラインと同じ
+    `[{'label', 'score'}]` 形式（`windows` と `tokens` を付加）。
+    """
+
+    def __init__(
+        self,
+        classifier,
+        max_length: int = DEFAULT_MAX_LENGTH,
+        stride: int = DEFAULT_STRIDE,
+        pooling: str = 'max-negative',
+        negative_label: str = DEFAULT_NEGATIVE_LABEL,
+        batch_size: int = 16,
+    ) -> None:
+        if pooling not in POOLING_METHODS:
+            raise ValueError(f'unknown pooling method: {pooling}')
+
+        self.classifier = classifier
+        self.model = getattr(classifier, 'model', None)
+        self.tokenizer = classifier.tokenizer
+        self.pooling = pooling
+        self.negative_label = negative_label
+        self.batch_size = max(1, int(batch_size))
+        self.window_size = max_length - self.tokenizer.num_special_tokens_to_add()
+        self.stride = min(max(0, int(stride)), self.window_size - 1)
+        self.id2label = getattr(classifier, 'id2label', None) or self.model.config.id2label
+
+    def __call__(self, texts: Sequence[str]) -> List[list]:
+        # 1. 全メッセージをウィンドウに分割（所属メッセージを記録）
+        encoded = self.tokenizer(list(texts), add_special_tokens=False, truncation=False)['input_ids']
+        windows = []
+        owners = []
+        for owner, input_ids in enumerate(encoded):
+            for window in split_token_windows(input_ids, self.window_size, self.stride):
+                windows.append(window)
+                owners.append(owner)
+
+        # 2. メッセージをまたいでウィンドウを長さ順にバッチ推論
+        probabilities = [None] * len(windows)
+        order = sorted(range(len(windows)), key=lambda i: len(windows[i]))
+        for start in range(0, len(order), self.batch_size):
+            indices = order[start:start + self.batch_size]
+            batch_probs = self._forward([windows[i] for i in indices])
+            for i, probs in zip(indices, batch_probs):
+                probabilities[i] = probs
+
+        # 3. メッセージごとにプーリング
+        per_text = [[] for _ in texts]
+        for owner, window, probs in zip(owners, windows, probabilities):
+            per_text[owner].append((len(window), probs))
+
+        return [
+            [self._pool(window_probs, token_count=len(input_ids))]
+            for window_probs, input_ids in zip(per_text, encoded)
+        ]
+
+    def _forward(self, windows: List[List[int]]) -> List[List[float]]:
+        encoded = {'input_ids': [self.tokenizer.build_inputs_with_special_tokens(window) for window in windows]}
+        if hasattr(self.classifier, 'probabilities'):
+            return self.classifier.probabilities(self.tokenizer.pad(encoded, return_tensors='np'))
+
+        import torch
+
+        features = self.tokenizer.pad(encoded, return_tensors='pt')
+        features = {name: tensor.to(self.model.device) for name, tensor in features.items()}
+        with torch.inference_mode():
+            logits = self.model(**features).logits
+        return logits.softmax(dim=-1).tolist()
+
+    def _pool(self, window_probs, token_count: int) -> dict:
+        if self.pooling == 'max-negative':
+            negative_id = self._label_id(self.negative_label)
+            _, pooled = max(window_probs, key=lambda item: item[1][negative_id])
+        else:
+            # トークン数で重み付けした平均
+            total = sum(length for length, _ in window_probs) or 1
+            pooled = [
+                sum(length * probs[label_id] for length, probs in window_probs) / total
+                for label_id in range(len(window_probs[0][1]))
+            ]
+
+        label_id = max(range(len(pooled)), key=lambda i: pooled[i])
+        return {
+            'label': self.id2label[label_id],
+            'score': float(pooled[label_id]),
+            'windows': len(window_probs),
+            'tokens': token_count,
+        }
+
+    def _label_id(self, label: str) -> int:
+        for label_id, name in self.id2label.items():
+            if name == label:
+                return int(label_id)
+        raise ValueError(f'label not found in model config: {label}')